@@ -0,0 +1,140 @@
+from contextlib import asynccontextmanager
+from typing import Optional, Tuple
+from app.core.config import settings
+from app.core.request_context import current_tenant, current_quota
+from app.services.usage_accounting import Reservation, current_reservation, usage_accountant
+import asyncio
+import json
+import math
+import time
+
+
+def resolve_tenant(headers: dict) -> Tuple[Optional[str], int]:
+    """Map the request's API key to (tenant, tokens_per_minute); tenant is None for an unknown key."""
+    api_key = headers.get(b"x-api-key", b"").decode("latin-1").strip()
+    if not api_key:
+        authorization = headers.get(b"authorization", b"").decode("latin-1")
+        if authorization.lower().startswith("bearer "):
+            api_key = authorization[7:].strip()
+    if api_key:
+        config = settings.api_keys.get(api_key)
+        if config is not None:
+            return config.tenant, config.tokens_per_minute
+        return None, 0
+    if settings.require_api_key:
+        return None, 0
+    return "anonymous", settings.anonymous_tokens_per_minute
+
+
+async def reserve(reservation: Reservation, limit: int) -> Optional[float]:
+    """
+    Reserve the estimate against the tenant's quota, waiting up to the queue
+    timeout for capacity. Returns None when admitted, otherwise the seconds
+    until enough capacity should free up.
+    """
+    tenant = reservation.tenant
+    retry_after = usage_accountant.try_reserve(reservation, limit)
+    if retry_after is not None:
+        usage_accountant.count_admission(tenant, "queued")
+        deadline = time.monotonic() + settings.admission_queue_timeout_seconds
+        while retry_after is not None and time.monotonic() < deadline:
+            await asyncio.sleep(min(0.25, max(deadline - time.monotonic(), 0)))
+            retry_after = usage_accountant.try_reserve(reservation, limit)
+        if retry_after is not None:
+            usage_accountant.count_admission(tenant, "rejected")
+    return retry_after
+
+
+class QuotaExceeded(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__("Token quota exceeded")
+        self.detail = "Token quota exceeded"
+        self.retry_after = retry_after
+
+
+@asynccontextmanager
+async def admitted(path: str):
+    """
+    Hold a reservation of the current tenant's quota while one request made
+    over an open WebSocket runs, at the estimate of the equivalent HTTP route.
+    Raises QuotaExceeded when the quota can't cover it in time.
+    """
+    estimate = settings.admission_estimates.get(path, 0)
+    if not estimate:
+        yield
+        return
+    reservation = Reservation(current_tenant.get(), estimate)
+    retry_after = await reserve(reservation, current_quota.get())
+    if retry_after is not None:
+        raise QuotaExceeded(retry_after)
+    token = current_reservation.set(reservation)
+    try:
+        yield
+    finally:
+        current_reservation.reset(token)
+        usage_accountant.release(reservation)
+
+
+class AdmissionControlMiddleware:
+    """
+    ASGI middleware that identifies the tenant from its API key and admits a
+    request only if the tenant's token-per-minute quota can cover the route's
+    estimated cost. Requests over quota wait briefly for capacity, then get 429.
+    A WebSocket is only authenticated here: it would hold its reservation for as
+    long as it stays open, so each request sent over it is admitted on its own.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        path = scope.get("path", "")
+        estimate = settings.admission_estimates.get(path, 0)
+        if scope["type"] == "http" and scope["method"] not in ("POST", "GET"):
+            estimate = 0
+        if not estimate:
+            # Unmetered routes (metrics, job polling, health) skip accounting
+            await self.app(scope, receive, send)
+            return
+
+        tenant, limit = resolve_tenant(dict(scope.get("headers") or []))
+        if tenant is None:
+            await self._reject(scope, send, 401, "Missing or unknown API key")
+            return
+
+        if scope["type"] == "websocket":
+            token, quota_token = current_tenant.set(tenant), current_quota.set(limit)
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                current_quota.reset(quota_token)
+                current_tenant.reset(token)
+            return
+
+        reservation = Reservation(tenant, estimate)
+        retry_after = await reserve(reservation, limit)
+        if retry_after is not None:
+            await self._reject(scope, send, 429, "Token quota exceeded", retry_after)
+            return
+
+        token, reservation_token = current_tenant.set(tenant), current_reservation.set(reservation)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_reservation.reset(reservation_token)
+            current_tenant.reset(token)
+            usage_accountant.release(reservation)
+
+    async def _reject(self, scope, send, status: int, detail: str, retry_after: Optional[float] = None):
+        if scope["type"] == "websocket":
+            await send({"type": "websocket.close", "code": 1008 if status == 401 else 1013})
+            return
+        body = json.dumps({"detail": detail}).encode("utf-8")
+        headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+        if retry_after is not None:
+            headers.append((b"retry-after", str(max(math.ceil(retry_after), 1)).encode()))
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
@@ -1,13 +1,220 @@
+from pydantic import BaseModel, field_validator
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Optional, Dict, List, Any
+
+
+class ModelTier(BaseModel):
+    """A model tier that call sites can be routed to."""
+    model: str
+    # "openai", "local" (OpenAI-compatible server such as llama.cpp or vLLM), "llama_cpp"
+    # (in-process CPU model), "stub" (canned answers, for offline testing) or "heuristic"
+    backend: str = "openai"
+    base_url: Optional[str] = None
+    api_key: Optional[str] = None
+    timeout: float = 30.0
+    # Send JSON-producing calls a JSON-schema response_format (turn off for servers without support)
+    structured_output: bool = True
+    # USD per 1K tokens, used for cost estimates in the routing metrics
+    prompt_cost_per_1k: float = 0.0
+    completion_cost_per_1k: float = 0.0
+    # Backend-specific settings, e.g. {"model_path": ...} for llama_cpp or {"latency_ms": ...} for stub
+    options: Dict[str, Any] = {}
+    # Group concurrent requests into micro-batches on backends that benefit from it
+    batch: bool = True
+
+
+class CallSiteRoute(BaseModel):
+    """Routing rule for a single LLM call site."""
+    tier: str
+    max_tokens: Optional[int] = None
+    timeout: Optional[float] = None
+    stop: Optional[List[str]] = None
+    # Stream the response and close it once this much is available: "sentence", "paragraph" or "json"
+    cutoff: Optional[str] = None
+
+
+class TenantConfig(BaseModel):
+    """A tenant identified by an API key."""
+    tenant: str
+    # 0 means unlimited
+    tokens_per_minute: int = 60000
+
+
+# Expected prompt + completion tokens per request, charged against the tenant's
+# quota at admission and released once the real usage has been recorded. On
+# WebSocket routes the entry only turns metering on: each request sent over the
+# socket is charged at the estimate of the equivalent HTTP route.
+DEFAULT_ADMISSION_ESTIMATES: Dict[str, int] = {
+    "/formulation/": 7000,
+    "/formulation/stream": 7000,
+    "/formulation/jobs": 7000,
+    "/formulation/validate": 1200,
+    "/formulation/suggestions": 1200,
+    "/formulation/analyze": 2000,
+    "/formulation/validate/ws": 1200,
+    "/conversation/start": 4000,
+    "/conversation/continue": 4000,
+    "/conversation/aggregate-intent": 1500,
+    "/conversation/summary": 2000,
+    "/conversation/stream": 1500,
+    "/conversation/ws": 4000,
+}
+
+
+# Default end-to-end budget in seconds for requests to these routes; clients can send a
+# smaller or larger one in X-Request-Budget-Ms. Streaming, WebSocket and job routes have none.
+DEFAULT_REQUEST_BUDGETS: Dict[str, float] = {
+    "/formulation/": 120.0,
+    "/formulation/validate": 20.0,
+    "/formulation/suggestions": 20.0,
+    "/formulation/analyze": 45.0,
+    "/conversation/start": 45.0,
+    "/conversation/continue": 45.0,
+    "/conversation/aggregate-intent": 30.0,
+    "/conversation/summary": 30.0,
+}
+
+
+DEFAULT_LLM_TIERS: Dict[str, ModelTier] = {
+    # Tiny yes/no and label-style answers
+    "classify": ModelTier(
+        model="gpt-4o-mini", timeout=10.0,
+        prompt_cost_per_1k=0.00015, completion_cost_per_1k=0.0006
+    ),
+    # Short structured analysis and rewriting
+    "standard": ModelTier(
+        model="gpt-4o-mini", timeout=30.0,
+        prompt_cost_per_1k=0.00015, completion_cost_per_1k=0.0006
+    ),
+    # Long-form generation (ingredient lists)
+    "generate": ModelTier(
+        model="gpt-4o-mini", timeout=90.0,
+        prompt_cost_per_1k=0.00015, completion_cost_per_1k=0.0006
+    ),
+}
+
+
+DEFAULT_LLM_ROUTES: Dict[str, CallSiteRoute] = {
+    "is_vague": CallSiteRoute(tier="classify", max_tokens=2),
+    "detect_dimensions": CallSiteRoute(tier="classify", max_tokens=60, cutoff="json"),
+    "analyze_intent": CallSiteRoute(tier="standard", max_tokens=600, cutoff="json"),
+    "analyze_user_response": CallSiteRoute(tier="standard", max_tokens=500, cutoff="json"),
+    "aggregate_intent": CallSiteRoute(tier="standard", max_tokens=400, cutoff="json"),
+    "intelligent_question": CallSiteRoute(tier="standard", max_tokens=80, stop=["\n"]),
+    "completion_message": CallSiteRoute(tier="standard", max_tokens=60, stop=["\n"]),
+    "reconstruct_query": CallSiteRoute(tier="standard", max_tokens=200, stop=["\n\n"], cutoff="paragraph"),
+    "enhance_query": CallSiteRoute(tier="standard", max_tokens=500),
+    "conversation_stream": CallSiteRoute(tier="standard", max_tokens=400),
+    "generate_ingredients": CallSiteRoute(tier="generate", max_tokens=4000, cutoff="json"),
+}
 
 
 class Settings(BaseSettings):
-    openai_api_key: str
-    
+    # Only needed by tiers on the "openai" backend
+    openai_api_key: Optional[str] = None
+
+    # Model routing. Both maps can be overridden with JSON in the environment,
+    # e.g. LLM_TIERS='{"classify": {"model": "heuristic", "backend": "heuristic"}}'
+    llm_tiers: Dict[str, ModelTier] = DEFAULT_LLM_TIERS
+    llm_routes: Dict[str, CallSiteRoute] = DEFAULT_LLM_ROUTES
+    llm_default_tier: str = "standard"
+    # Run every non-heuristic tier on one backend, e.g. "stub" to exercise the pipeline offline
+    llm_backend: Optional[str] = None
+    llm_batching: bool = True
+    llm_batch_window_ms: float = 2.0
+    llm_batch_max_size: int = 8
+    # Close streamed responses as soon as a call site's cutoff is satisfied
+    llm_early_cutoff: bool = True
+    # Extra completions allowed when a JSON response can't be parsed even after local repair
+    llm_json_retries: int = 1
+
+    # Background formulation jobs
+    job_db_path: str = "data/jobs.sqlite3"
+    job_workers: int = 2
+    job_result_ttl_seconds: int = 3600
+    job_max_pending: int = 1000
+    # Hosts job webhooks may be sent to (a leading "." also allows subdomains); empty disables callbacks
+    job_callback_allowed_hosts: List[str] = []
+
+    # HTTP response cache for opted-in deterministic routes
+    response_cache_enabled: bool = True
+    response_cache_max_entries: int = 2048
+    response_cache_max_bytes: int = 32 * 1024 * 1024
+
+    # Live validation channel: wait this long after the last keystroke before calling the LLM
+    validation_debounce_ms: int = 350
+
+    # Tenants and quotas. API_KEYS is a JSON map of key -> {"tenant": ..., "tokens_per_minute": ...};
+    # requests without a known key are charged to the "anonymous" tenant unless keys are required
+    api_keys: Dict[str, TenantConfig] = {}
+    require_api_key: bool = False
+    # Unlimited by default, so keyless deployments aren't throttled as one shared tenant
+    anonymous_tokens_per_minute: int = 0
+    admission_estimates: Dict[str, int] = DEFAULT_ADMISSION_ESTIMATES
+    # How long a request over quota waits for capacity before it is rejected with 429
+    admission_queue_timeout_seconds: float = 5.0
+    usage_db_path: str = "data/usage.sqlite3"
+    usage_flush_interval_seconds: float = 10.0
+
+    # Deadlines and load shedding for the routes in REQUEST_BUDGETS
+    request_budgets: Dict[str, float] = DEFAULT_REQUEST_BUDGETS
+    max_request_budget_seconds: float = 300.0
+    # Requests in flight beyond this are rejected with 503; 0 disables shedding
+    max_inflight_requests: int = 64
+
+    # Per-query artifacts (intent analysis, enhanced query) shared between the formulation endpoints
+    query_artifact_ttl_seconds: int = 900
+    query_artifact_max_entries: int = 2048
+    # Budget of the shared task producing an artifact, independent of the requests waiting for it
+    query_artifact_budget_seconds: float = 120.0
+
+    # How conversation questions and completion messages are written: "template" uses the
+    # local phrase banks only, "hybrid" falls back to the LLM when no template fits, "llm" always calls it
+    conversation_message_mode: str = "hybrid"
+
+    # Precomputed formulations for the most requested queries, regenerated during off-peak hours
+    warehouse_enabled: bool = True
+    warehouse_db_path: str = "data/warehouse.sqlite3"
+    warehouse_top_n: int = 100
+    warehouse_min_hits: int = 3
+    warehouse_window_days: int = 7
+    # Server-local hours during which results are refreshed
+    warehouse_refresh_hours: List[int] = [2, 3, 4, 5]
+    warehouse_refresh_after_hours: float = 20.0
+    warehouse_max_age_hours: float = 48.0
+    warehouse_check_interval_seconds: float = 300.0
+    # Change to invalidate every stored result, e.g. after a model update behind the same name
+    warehouse_version_salt: str = ""
+
+    # Admin endpoints (/admin/...) require this key in X-Admin-Key; unset disables them
+    admin_api_key: Optional[str] = None
+    # Sample call stacks continuously from startup; otherwise only on demand via /admin/profile
+    profiling_enabled: bool = False
+    profiler_interval_ms: float = 10.0
+    profiler_max_stacks: int = 5000
+
+    # Per-conversation state kept between turns: sharded by conversation ID, least recently used
+    # sessions evicted beyond max_entries and sessions idle longer than the TTL dropped
+    session_shards: int = 16
+    session_max_entries: int = 10000
+    session_idle_ttl_seconds: float = 1800.0
+    # Hard caps on what a conversation request may carry (422 beyond them)
+    conversation_max_history: int = 40
+    max_message_chars: int = 4000
+
+    @field_validator("llm_tiers")
+    @classmethod
+    def _merge_default_tiers(cls, v: Dict[str, ModelTier]) -> Dict[str, ModelTier]:
+        return {**DEFAULT_LLM_TIERS, **v}
+
+    @field_validator("llm_routes")
+    @classmethod
+    def _merge_default_routes(cls, v: Dict[str, CallSiteRoute]) -> Dict[str, CallSiteRoute]:
+        return {**DEFAULT_LLM_ROUTES, **v}
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
 
 
-settings = Settings() 
\ No newline at end of file
+settings = Settings()
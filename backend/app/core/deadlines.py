@@ -0,0 +1,127 @@
+from typing import Dict, Any, Optional
+from app.core.config import settings
+from app.core.request_context import current_deadline
+import asyncio
+import json
+import math
+import time
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when the request's remaining budget can't cover a call."""
+
+
+class LoadShedder:
+    """
+    Counts requests in flight on budgeted routes and turns new ones away once
+    the server is saturated, with a Retry-After estimated from how long the
+    excess takes to drain at the recent request latency.
+    """
+
+    def __init__(self, max_inflight: int):
+        self.max_inflight = max_inflight
+        self.inflight = 0
+        self.avg_latency = 1.0  # seconds, exponentially weighted
+        self._stats = {"admitted": 0, "shed": 0, "timeouts": 0}
+
+    def try_enter(self) -> Optional[float]:
+        """Admit a request (returns None) or return the seconds the client should wait."""
+        if self.max_inflight and self.inflight >= self.max_inflight:
+            self._stats["shed"] += 1
+            excess = self.inflight - self.max_inflight + 1
+            return excess * self.avg_latency / self.max_inflight
+        self.inflight += 1
+        self._stats["admitted"] += 1
+        return None
+
+    def exit(self, latency: float):
+        self.inflight -= 1
+        self.avg_latency = 0.9 * self.avg_latency + 0.1 * latency
+
+    def count_timeout(self):
+        self._stats["timeouts"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "inflight": self.inflight,
+            "max_inflight": self.max_inflight,
+            "avg_latency_ms": round(self.avg_latency * 1000, 1),
+        }
+
+
+def request_budget(path: str, headers: dict) -> Optional[float]:
+    """
+    The request's budget in seconds: X-Request-Budget-Ms if sent, else the
+    route's default. Only budgeted routes have one, so the header can't put
+    a deadline on streams and other routes outside REQUEST_BUDGETS.
+    """
+    default = settings.request_budgets.get(path)
+    if default is None:
+        return None
+    raw = headers.get(b"x-request-budget-ms", b"").decode("latin-1").strip()
+    if raw:
+        try:
+            budget = float(raw) / 1000
+        except ValueError:
+            return default
+        if math.isfinite(budget):
+            return min(max(budget, 0.001), settings.max_request_budget_seconds)
+    return default
+
+
+class DeadlineMiddleware:
+    """
+    ASGI middleware that gives each HTTP request a deadline (propagated to
+    services through `current_deadline`), sheds load with 503 when too many
+    requests are in flight, and answers 504 once the deadline passes, which
+    also cancels the request's remaining work.
+    """
+
+    def __init__(self, app, shedder: LoadShedder):
+        self.app = app
+        self.shedder = shedder
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        budget = request_budget(scope.get("path", ""), dict(scope.get("headers") or []))
+        if budget is None:
+            await self.app(scope, receive, send)
+            return
+
+        retry_after = self.shedder.try_enter()
+        if retry_after is not None:
+            await self._respond(send, 503, "Server is overloaded, retry later",
+                                [(b"retry-after", str(max(math.ceil(retry_after), 1)).encode())])
+            return
+
+        started = time.monotonic()
+        response_started = False
+
+        async def tracking_send(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        token = current_deadline.set(started + budget)
+        try:
+            await asyncio.wait_for(self.app(scope, receive, tracking_send), timeout=budget)
+        except asyncio.TimeoutError:
+            self.shedder.count_timeout()
+            if not response_started:
+                await self._respond(send, 504, "Request deadline exceeded")
+        finally:
+            current_deadline.reset(token)
+            self.shedder.exit(time.monotonic() - started)
+
+    async def _respond(self, send, status: int, detail: str, extra_headers: Optional[list] = None):
+        body = json.dumps({"detail": detail}).encode("utf-8")
+        headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+        await send({"type": "http.response.start", "status": status, "headers": headers + (extra_headers or [])})
+        await send({"type": "http.response.body", "body": body})
+
+
+load_shedder = LoadShedder(max_inflight=settings.max_inflight_requests)
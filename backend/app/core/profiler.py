@@ -0,0 +1,140 @@
+from collections import Counter
+from typing import Dict, Any, List, Optional
+from app.core.config import settings
+import os
+import sys
+import threading
+import time
+
+
+_APP_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Stacks are kept only when they pass through one of these (services and route handlers)
+_FOCUS_DIRS = tuple(os.path.join(_APP_ROOT, "app", part) + os.sep for part in ("services", "routes"))
+
+
+def _label(frame) -> str:
+    code = frame.f_code
+    path = code.co_filename
+    if path.startswith(_APP_ROOT + os.sep):
+        path = os.path.relpath(path, _APP_ROOT)
+    else:
+        path = os.path.basename(path)
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{path}:{name}"
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler that samples every thread's call stack with
+    sys._current_frames() from a background thread. Stacks that pass
+    through the services or route handlers are counted, rooted at their
+    outermost app frame, and exported in the folded format that flamegraph
+    tools (flamegraph.pl, speedscope, inferno) read.
+    """
+
+    def __init__(self, interval: float, max_stacks: int):
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self._lock = threading.Lock()
+        self._stacks: Counter = Counter()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._samples = 0
+        self._dropped = 0
+        self._started_at: Optional[float] = None
+        self._sampling_seconds = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._started_at = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def reset(self):
+        with self._lock:
+            self._stacks.clear()
+            self._samples = 0
+            self._dropped = 0
+            self._sampling_seconds = 0.0
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            started = time.perf_counter()
+            self.sample(skip_thread=own)
+            with self._lock:
+                self._sampling_seconds += time.perf_counter() - started
+
+    def sample(self, skip_thread: Optional[int] = None):
+        """Take one sample of every thread's stack."""
+        stacks: List[str] = []
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == skip_thread:
+                continue
+            labels = []
+            root = None
+            while frame is not None:
+                labels.append(_label(frame))
+                if frame.f_code.co_filename.startswith(_FOCUS_DIRS):
+                    root = len(labels)
+                frame = frame.f_back
+            if root is not None:
+                # Innermost first -> root first, dropping the event loop and server frames above the app
+                stacks.append(";".join(reversed(labels[:root])))
+        with self._lock:
+            self._samples += 1
+            for stack in stacks:
+                if stack in self._stacks or len(self._stacks) < self.max_stacks:
+                    self._stacks[stack] += 1
+                else:
+                    self._dropped += 1
+
+    def folded(self) -> str:
+        """One "frame;frame;frame count" line per distinct stack."""
+        with self._lock:
+            return "".join(f"{stack} {count}\n" for stack, count in self._stacks.most_common())
+
+    def top(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """Functions with the most samples at the top of the stack (self) and anywhere in it (total)."""
+        own: Counter = Counter()
+        total: Counter = Counter()
+        with self._lock:
+            for stack, count in self._stacks.items():
+                frames = stack.split(";")
+                own[frames[-1]] += count
+                for frame in set(frames):
+                    total[frame] += count
+        return [{"frame": frame, "total": count, "self": own.get(frame, 0)}
+                for frame, count in total.most_common(limit)]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "running": self.running,
+                "interval_ms": round(self.interval * 1000, 2),
+                "samples": self._samples,
+                "stacks": len(self._stacks),
+                "dropped": self._dropped,
+                # Time the sampler spent walking stacks, i.e. its own overhead
+                "sampling_ms": round(self._sampling_seconds * 1000, 1),
+                "uptime_s": round(time.monotonic() - self._started_at, 1) if self._started_at else 0.0,
+            }
+
+
+profiler = SamplingProfiler(
+    interval=settings.profiler_interval_ms / 1000,
+    max_stacks=settings.profiler_max_stacks,
+)
@@ -0,0 +1,93 @@
+from concurrent.futures import Executor
+from contextvars import ContextVar
+from typing import Optional
+import threading
+import time
+
+
+# The route path of the request being served, used to attribute LLM usage per endpoint
+current_endpoint: ContextVar[str] = ContextVar("current_endpoint", default="internal")
+
+# Thread pool that blocking LLM calls run on; None means the event loop's default executor.
+# Background jobs set their own pool so long generations don't take interactive slots.
+llm_executor: ContextVar[Optional[Executor]] = ContextVar("llm_executor", default=None)
+
+# Set by callers that may abandon their LLM calls: the calls are streamed and the upstream
+# response is closed at the next chunk once the event is set
+llm_cancel: ContextVar[Optional[threading.Event]] = ContextVar("llm_cancel", default=None)
+
+
+class RequestUsage:
+    """LLM usage observed while serving one request."""
+
+    def __init__(self):
+        self.llm_calls = 0
+        self.llm_errors = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.max_temperature: Optional[float] = None
+        # Calls answered by a heuristic or skipped because the deadline couldn't cover them
+        self.degraded_calls = 0
+        # Part of the answer is a fallback (unparseable model output, a failed or timed-out stage)
+        self.fallback = False
+
+    @property
+    def degraded(self) -> bool:
+        """Whether the answer must not be cached or stored for reuse."""
+        return bool(self.llm_errors or self.degraded_calls or self.fallback)
+
+    def observe_call(self, temperature: float):
+        self.llm_calls += 1
+        if self.max_temperature is None or temperature > self.max_temperature:
+            self.max_temperature = temperature
+
+    def inherit(self, other: "RequestUsage"):
+        """Take on what another usage says about a result this request reuses."""
+        self.fallback = self.fallback or other.degraded
+        if other.max_temperature is not None and (
+                self.max_temperature is None or other.max_temperature > self.max_temperature):
+            self.max_temperature = other.max_temperature
+
+
+current_usage: ContextVar[Optional[RequestUsage]] = ContextVar("current_usage", default=None)
+
+# The tenant LLM usage is charged to
+current_tenant: ContextVar[str] = ContextVar("current_tenant", default="anonymous")
+
+# That tenant's tokens-per-minute quota, for requests admitted one by one over an open WebSocket
+current_quota: ContextVar[int] = ContextVar("current_quota", default=0)
+
+# time.monotonic() by which the request must be answered; None means no deadline
+current_deadline: ContextVar[Optional[float]] = ContextVar("current_deadline", default=None)
+
+
+def mark_fallback():
+    """Flag the current request's answer as containing a fallback, so it is neither cached nor stored."""
+    usage = current_usage.get()
+    if usage is not None:
+        usage.fallback = True
+
+
+def remaining_budget() -> Optional[float]:
+    """Seconds left before the current request's deadline, or None without one."""
+    deadline = current_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+class RequestContextMiddleware:
+    """ASGI middleware that records per-request context for downstream services."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        endpoint_token = current_endpoint.set(scope.get("path", "internal"))
+        usage_token = current_usage.set(RequestUsage())
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_usage.reset(usage_token)
+            current_endpoint.reset(endpoint_token)
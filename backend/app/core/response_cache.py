@@ -0,0 +1,230 @@
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+from app.core.config import settings
+from app.core.request_context import current_usage
+import hashlib
+import json
+import threading
+import time
+
+
+class CachePolicy:
+    """Per-route caching rule."""
+
+    def __init__(self, ttl: int, max_temperature: Optional[float] = None):
+        self.ttl = ttl
+        # Only cache a response if every LLM call made for it ran at or below this
+        # temperature; None caches regardless of temperature
+        self.max_temperature = max_temperature
+
+
+class _Entry:
+    __slots__ = ("status", "headers", "body", "etag", "expires_at")
+
+    def __init__(self, status: int, headers: List[Tuple[bytes, bytes]], body: bytes, etag: str, expires_at: float):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.etag = etag
+        self.expires_at = expires_at
+
+
+class ResponseCache:
+    """
+    Bounded LRU store of full HTTP responses for opted-in routes, keyed on
+    method, path, query string and the canonicalized JSON request body.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._policies: Dict[str, CachePolicy] = {}
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "not_modified": 0, "stores": 0,
+                       "evictions": 0, "expired": 0, "skipped_temperature": 0}
+
+    def cache_route(self, path: str, ttl: int, max_temperature: Optional[float] = None):
+        """Opt a route path in to response caching."""
+        self._policies[path] = CachePolicy(ttl, max_temperature)
+
+    def policy_for(self, path: str) -> Optional[CachePolicy]:
+        return self._policies.get(path)
+
+    def key_for(self, method: str, path: str, query_string: bytes, body: bytes) -> str:
+        try:
+            canonical = json.dumps(json.loads(body), sort_keys=True, separators=(",", ":")).encode("utf-8")
+        except (ValueError, UnicodeDecodeError):
+            canonical = body
+        digest = hashlib.sha256()
+        for part in (method.encode(), path.encode(), query_string, canonical):
+            digest.update(part)
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[_Entry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            if entry.expires_at <= time.time():
+                self._remove(key)
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry
+
+    def put(self, key: str, entry: _Entry):
+        size = len(entry.body)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._bytes += size
+            self._stats["stores"] += 1
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._stats["evictions"] += 1
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self._bytes -= len(entry.body)
+
+    def count(self, stat: str):
+        with self._lock:
+            self._stats[stat] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "hit_ratio": round(self._stats["hits"] / lookups, 3) if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "routes": {path: {"ttl": p.ttl, "max_temperature": p.max_temperature}
+                           for path, p in self._policies.items()},
+            }
+
+
+class ResponseCacheMiddleware:
+    """
+    ASGI middleware serving opted-in routes from the response cache, with
+    ETag/Cache-Control headers and 304 responses on If-None-Match revalidation.
+    """
+
+    def __init__(self, app, cache: ResponseCache):
+        self.app = app
+        self.cache = cache
+
+    async def __call__(self, scope, receive, send):
+        policy = self.cache.policy_for(scope.get("path", "")) if scope["type"] == "http" else None
+        if policy is None or scope["method"] not in ("GET", "POST") or not settings.response_cache_enabled:
+            await self.app(scope, receive, send)
+            return
+
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] != "http.request":
+                await self.app(scope, receive, send)
+                return
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+        headers = dict(scope.get("headers") or [])
+        if_none_match = headers.get(b"if-none-match", b"").decode("latin-1")
+        key = self.cache.key_for(scope["method"], scope["path"], scope.get("query_string", b""), body)
+
+        entry = self.cache.get(key)
+        if entry is not None:
+            max_age = max(int(entry.expires_at - time.time()), 0)
+            await self._send_entry(send, entry, if_none_match, max_age, "HIT")
+            return
+
+        replayed = False
+
+        async def replay_receive():
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        start: Dict[str, Any] = {}
+        chunks: List[bytes] = []
+
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                start.update(message)
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        await self.app(scope, replay_receive, capture_send)
+
+        response_body = b"".join(chunks)
+        response_headers = [(k, v) for k, v in start.get("headers", [])
+                            if k.lower() not in (b"etag", b"cache-control", b"content-length")]
+        entry = _Entry(
+            status=start.get("status", 500),
+            headers=response_headers,
+            body=response_body,
+            etag='"' + hashlib.sha256(response_body).hexdigest()[:32] + '"',
+            expires_at=time.time() + policy.ttl,
+        )
+        if entry.status == 200 and self._cacheable(policy):
+            self.cache.put(key, entry)
+            await self._send_entry(send, entry, if_none_match, policy.ttl, "MISS")
+        else:
+            await self._send_entry(send, entry, "", 0, "BYPASS")
+
+    def _cacheable(self, policy: CachePolicy) -> bool:
+        usage = current_usage.get()
+        # Fallback or degraded answers (LLM errors, unparseable output, deadline pressure) must not be served again
+        if usage is not None and usage.degraded:
+            return False
+        if policy.max_temperature is None:
+            return True
+        temperature = usage.max_temperature if usage is not None else None
+        if temperature is not None and temperature > policy.max_temperature:
+            self.cache.count("skipped_temperature")
+            return False
+        return True
+
+    async def _send_entry(self, send, entry: _Entry, if_none_match: str, max_age: int, cache_status: str):
+        if entry.status == 200 and if_none_match and entry.etag in [t.strip() for t in if_none_match.split(",")]:
+            self.cache.count("not_modified")
+            await send({
+                "type": "http.response.start",
+                "status": 304,
+                "headers": [(b"etag", entry.etag.encode()),
+                            (b"cache-control", f"private, max-age={max_age}".encode()),
+                            (b"x-cache", cache_status.encode())],
+            })
+            await send({"type": "http.response.body", "body": b""})
+            return
+        headers = list(entry.headers) + [
+            (b"content-length", str(len(entry.body)).encode()),
+            (b"x-cache", cache_status.encode()),
+        ]
+        if entry.status == 200:
+            cache_control = f"private, max-age={max_age}" if max_age else "no-cache"
+            headers += [(b"etag", entry.etag.encode()), (b"cache-control", cache_control.encode())]
+        await send({"type": "http.response.start", "status": entry.status, "headers": headers})
+        await send({"type": "http.response.body", "body": entry.body})
+
+
+response_cache = ResponseCache(
+    max_entries=settings.response_cache_max_entries,
+    max_bytes=settings.response_cache_max_bytes,
+)
@@ -0,0 +1,99 @@
+from pydantic import BaseModel, model_validator
+from typing import List, Any, Literal
+from app.models.ingredient import Ingredient
+
+
+def _lowercase_keys(data: Any) -> Any:
+    if isinstance(data, dict):
+        return {str(key).lower(): value for key, value in data.items()}
+    return data
+
+
+def _as_text(value: Any) -> Any:
+    # Flatten list or object answers such as ["aloe", "shea butter"] into text
+    if isinstance(value, list):
+        return ", ".join(map(str, value))
+    if isinstance(value, dict):
+        return "; ".join(f"{key}: {item}" for key, item in value.items())
+    return value
+
+
+class IntentAnalysis(BaseModel):
+    """Structured output of the query intent analysis."""
+    intent: str = ""
+    target_audience: str = ""
+    product_type: str = ""
+    specific_concerns: List[str] = []
+    ingredient_preferences: List[str] = []
+    missing_context: List[str] = []
+    suggestions: List[str] = []
+    complexity_level: str = ""
+
+    @model_validator(mode="before")
+    @classmethod
+    def _normalize(cls, data: Any) -> Any:
+        return _lowercase_keys(data)
+
+
+class UserResponseAnalysis(BaseModel):
+    """Structured output of the per-turn conversation analysis."""
+    provided_info: Any = ""
+    missing_info: List[str] = []
+    next_question_rationale: str = ""
+    confidence: float = 0.0
+    ready_for_formulation: bool = False
+
+    @model_validator(mode="before")
+    @classmethod
+    def _normalize(cls, data: Any) -> Any:
+        data = _lowercase_keys(data)
+        if isinstance(data, dict) and isinstance(data.get("missing_info"), str):
+            data["missing_info"] = [data["missing_info"]] if data["missing_info"] else []
+        return data
+
+
+class DimensionCoverage(BaseModel):
+    """Which of the four conversation dimensions a text covers."""
+    covered: List[Literal["product_type", "achievement_goal", "target_audience", "special_ingredients"]] = []
+
+    @model_validator(mode="before")
+    @classmethod
+    def _normalize(cls, data: Any) -> Any:
+        # Models often answer with the bare array the prompt used to ask for
+        if isinstance(data, list):
+            data = {"covered": data}
+        return _lowercase_keys(data)
+
+
+class ConversationIntent(BaseModel):
+    """The user's intent aggregated over a conversation."""
+    product_type: str = ""
+    achievement_goal: str = ""
+    target_audience: str = ""
+    special_ingredients: str = ""
+
+    @model_validator(mode="before")
+    @classmethod
+    def _normalize(cls, data: Any) -> Any:
+        data = _lowercase_keys(data)
+        if isinstance(data, dict):
+            data = {key: _as_text(value) for key, value in data.items()}
+        return data
+
+
+class IngredientList(BaseModel):
+    """Structured output of ingredient generation."""
+    ingredients: List[Ingredient] = []
+
+    @model_validator(mode="before")
+    @classmethod
+    def _normalize(cls, data: Any) -> Any:
+        if isinstance(data, list):
+            data = {"ingredients": data}
+        if isinstance(data, dict) and isinstance(data.get("ingredients"), list):
+            # Drop malformed entries instead of failing the whole list
+            data = {**data, "ingredients": [
+                {"name": item["name"], "attributes": item.get("attributes") or {}}
+                for item in data["ingredients"] if isinstance(item, dict) and item.get("name")
+            ]}
+        return data
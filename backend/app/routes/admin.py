@@ -0,0 +1,51 @@
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import PlainTextResponse
+from typing import Dict, Any, Optional
+from app.core.config import settings
+from app.core.profiler import profiler
+import asyncio
+import hmac
+
+
+MAX_PROFILE_SECONDS = 120
+
+
+def require_admin(x_admin_key: Optional[str] = Header(None)):
+    """Admin routes need ADMIN_API_KEY in X-Admin-Key and don't exist without one configured."""
+    if not settings.admin_api_key:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_admin_key or not hmac.compare_digest(x_admin_key, settings.admin_api_key):
+        raise HTTPException(status_code=401, detail="Invalid admin key")
+
+
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+
+@router.get("/profile", response_class=PlainTextResponse)
+async def get_profile(seconds: float = 10.0):
+    """
+    Sampled call stacks in folded format ("frame;frame;frame count" per line), ready
+    for flamegraph.pl or speedscope. With continuous profiling on this returns every
+    sample since the last reset; otherwise it samples for `seconds` first.
+    """
+    if not profiler.running:
+        profiler.reset()
+        profiler.start()
+        try:
+            await asyncio.sleep(min(max(seconds, 0.1), MAX_PROFILE_SECONDS))
+        finally:
+            await asyncio.to_thread(profiler.stop)
+    return profiler.folded()
+
+
+@router.get("/profile/top", response_model=Dict[str, Any])
+async def get_profile_top(limit: int = 20):
+    """The most sampled frames of the current profile, with sampler stats."""
+    return {"stats": profiler.stats(), "top": profiler.top(limit)}
+
+
+@router.post("/profile/reset", response_model=Dict[str, Any])
+async def reset_profile():
+    """Discard the samples collected so far."""
+    profiler.reset()
+    return profiler.stats()
@@ -1,32 +1,41 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.responses import StreamingResponse
 from fastapi.concurrency import run_in_threadpool
-from pydantic import BaseModel
-from typing import List, Dict, Any
+from pydantic import BaseModel, Field
+from typing import List, Dict, Any, Annotated
+from app.core.config import settings
+from app.services.conversation_channel import conversation_channels
 from app.services.conversational_bot_service import ConversationalBotService
 import logging
 
 
+# Bounded so one request can't hold an arbitrarily large history in memory (or in a prompt)
+Message = Dict[str, Annotated[str, Field(max_length=settings.max_message_chars)]]
+History = Annotated[List[Message], Field(max_length=settings.conversation_max_history)]
+
+
 class StartConversationRequest(BaseModel):
-    initial_query: str
+    initial_query: str = Field(max_length=settings.max_message_chars)
 
 
 class ContinueConversationRequest(BaseModel):
-    conversation_id: str
-    user_response: str
-    conversation_history: List[Dict[str, str]]
+    conversation_id: str = Field(max_length=64)
+    user_response: str = Field(max_length=settings.max_message_chars)
+    conversation_history: History
+    # Clients that don't show the full query on question turns can skip reconstructing it
+    include_current_query: bool = True
 
 
 class GetSummaryRequest(BaseModel):
-    conversation_history: List[Dict[str, str]]
+    conversation_history: History
 
 
 class AggregateIntentRequest(BaseModel):
-    conversation_history: List[Dict[str, str]]
+    conversation_history: History
 
 
 class StreamRequest(BaseModel):
-    messages: List[Dict[str, str]]
+    messages: History
 
 
 router = APIRouter()
@@ -50,7 +59,8 @@ async def continue_conversation(request: ContinueConversationRequest):
         result = await conversational_bot.continue_conversation(
             request.conversation_id,
             request.user_response,
-            request.conversation_history
+            request.conversation_history,
+            include_current_query=request.include_current_query
         )
         return result
     except Exception as e:
@@ -70,21 +80,15 @@ async def aggregate_conversation_intent(request: AggregateIntentRequest):
 @router.post("/stream")
 async def stream_conversation(request: StreamRequest):
     """Stream conversation response for real-time feel."""
+    import contextvars
     import threading
     from queue import Queue
     import logging
     
     def sync_stream():
         try:
-            response = conversational_bot.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=request.messages,
-                temperature=0.7,
-                stream=True
-            )
-            for chunk in response:
-                if chunk.choices[0].delta.content:
-                    yield f"data: {chunk.choices[0].delta.content}\n\n"
+            for content in conversational_bot.llm.stream("conversation_stream", request.messages, temperature=0.7):
+                yield f"data: {content}\n\n"
         except Exception as e:
             logging.error(f"OpenAI API error in streaming: {str(e)}")
             yield f"data: Error: Unable to generate response. Please try again.\n\n"
@@ -101,7 +105,8 @@ async def stream_conversation(request: StreamRequest):
                 q.put(f"data: Error: {str(e)}\n\n")
                 q.put(None)
         
-        threading.Thread(target=worker, daemon=True).start()
+        # Run the worker in a copy of the request context so LLM usage is attributed to this endpoint
+        threading.Thread(target=contextvars.copy_context().run, args=(worker,), daemon=True).start()
         while True:
             try:
                 chunk = await run_in_threadpool(q.get)
@@ -127,4 +132,20 @@ async def get_conversation_summary(request: GetSummaryRequest):
         result = await conversational_bot.get_conversation_summary(request.conversation_history)
         return result
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.websocket("/ws")
+async def conversation_socket(websocket: WebSocket):
+    """
+    One conversation over one socket. Frames are {"t": type, "id": request id, "d": data}.
+    Client frames: "start" {"q"}, "say" {"r", "cq"}, "intent", "summary", "stream" {"m"},
+    "cancel" and "ping". Replies carry the request's id: "turn", "prog" (a finished stage),
+    "tok" and "end" (streamed text), "intent", "summary", "err" and "pong". An "intent"
+    frame without an id is pushed speculatively once the conversation is complete.
+    """
+    await websocket.accept()
+    try:
+        await conversation_channels.serve(conversational_bot, websocket.receive_text, websocket.send_text)
+    except WebSocketDisconnect:
+        pass
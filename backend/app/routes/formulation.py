@@ -1,11 +1,18 @@
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
 from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
-from typing import List, Dict, Any
+from pydantic import BaseModel, HttpUrl, field_validator
+from typing import List, Dict, Any, Optional
+from app.core.admission import admitted
+from app.core.config import settings
+from app.core.deadlines import DeadlineExceeded
+from app.core.request_context import current_tenant
 from app.models.ingredient import Ingredient
 from app.services.formulation_service import FormulationService
+from app.services.job_queue import job_queue, callback_allowed
 import asyncio
 import json
+import threading
 
 
 class FormulationRequest(BaseModel):
@@ -20,20 +27,86 @@ class QuerySuggestionsRequest(BaseModel):
     query: str
 
 
+class QueryAnalysisRequest(BaseModel):
+    query: str
+
+
+class FormulationJobRequest(BaseModel):
+    query: str
+    priority: int = 0
+    callback_url: Optional[HttpUrl] = None
+
+    @field_validator("callback_url")
+    @classmethod
+    def _allowed_callback(cls, v: Optional[HttpUrl]) -> Optional[HttpUrl]:
+        # Webhooks are sent from inside our network, so only to hosts that are explicitly allowed
+        if v is not None and not callback_allowed(str(v)):
+            raise ValueError("callback_url host is not in the allowed callback hosts")
+        return v
+
+
 router = APIRouter()
 formulation_service = FormulationService()
 
 
+async def _run_formulation_job(payload: Dict[str, Any]) -> Dict[str, Any]:
+    token = current_tenant.set(payload.get("tenant", "anonymous"))
+    try:
+        result = await formulation_service.generate_formulation(payload["query"])
+    finally:
+        current_tenant.reset(token)
+    return jsonable_encoder(result)
+
+
+job_queue.register("formulation", _run_formulation_job)
+
+
 @router.post("/", response_model=Dict[str, Any])
 async def generate_formulation(request: FormulationRequest):
     """Generate formulation with enhanced query processing."""
     try:
         result = await formulation_service.generate_formulation(request.query)
         return result
+    except DeadlineExceeded as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/jobs", response_model=Dict[str, Any], status_code=202)
+async def submit_formulation_job(request: FormulationJobRequest):
+    """Queue a formulation to run in the background and return its job ID."""
+    try:
+        job = await job_queue.submit(
+            "formulation", {"query": request.query, "tenant": current_tenant.get()},
+            priority=request.priority, callback_url=str(request.callback_url) if request.callback_url else None
+        )
+    except OverflowError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+    return {"job_id": job["job_id"], "status": job["status"], "deduplicated": job["deduplicated"]}
+
+
+@router.get("/jobs/{job_id}", response_model=Dict[str, Any])
+async def get_formulation_job(job_id: str):
+    """Poll a background formulation job."""
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return job
+
+
+@router.get("/jobs/{job_id}/events")
+async def stream_formulation_job(job_id: str):
+    """Subscribe to a background formulation job's status changes over SSE."""
+    if job_queue.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+
+    async def event_stream():
+        async for job in job_queue.events(job_id):
+            yield f'data: {json.dumps(job)}\n\n'
+    return StreamingResponse(event_stream(), media_type='text/event-stream')
+
+
 @router.post("/validate", response_model=Dict[str, Any])
 async def validate_query(request: QueryValidationRequest):
     """Validate if a query has sufficient information for formulation."""
@@ -54,6 +127,74 @@ async def get_query_suggestions(request: QuerySuggestionsRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/analyze", response_model=Dict[str, Any])
+async def analyze_query(request: QueryAnalysisRequest):
+    """Validation, suggestions and the enhanced query in one response."""
+    try:
+        return await formulation_service.analyze_query(request.query)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.websocket("/validate/ws")
+async def validate_query_live(websocket: WebSocket):
+    """
+    Live validation while the user types. Each message ({"query": "..."} or plain
+    text) gets an immediate "provisional" answer from the local cache or keyword
+    heuristics, then a debounced "final" LLM answer. Newer text cancels the
+    pending analysis, including its LLM call. A query with a stored analysis
+    gets its "final" answer at once.
+    """
+    await websocket.accept()
+    enhancer = formulation_service.query_enhancer
+    pending: Optional[asyncio.Task] = None
+    seq = 0
+
+    async def analyze(query: str, query_seq: int):
+        # Stops the streamed LLM call once this analysis is superseded
+        stop = threading.Event()
+        try:
+            await asyncio.sleep(settings.validation_debounce_ms / 1000)
+            async with admitted("/formulation/validate"):
+                result = await enhancer.analyze_query_live(query, stop)
+            await websocket.send_json({"type": "final", "seq": query_seq, "query": query, "source": "llm", **result})
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await websocket.send_json({"type": "error", "seq": query_seq, "query": query, "detail": str(e)})
+        finally:
+            stop.set()
+
+    try:
+        while True:
+            raw = await websocket.receive_text()
+            try:
+                message = json.loads(raw)
+                query = str(message.get("query", "")) if isinstance(message, dict) else raw
+            except json.JSONDecodeError:
+                query = raw
+            query = query.strip()
+            seq += 1
+            if pending is not None and not pending.done():
+                pending.cancel()
+            if not query:
+                continue
+
+            stored = enhancer.stored_analysis(query)
+            if stored is not None:
+                # The query's analysis is still fresh, no LLM call needed
+                await websocket.send_json({"type": "final", "seq": seq, "query": query, "source": "cache", **stored})
+                continue
+            quick = enhancer.quick_analysis(query)
+            await websocket.send_json({"type": "provisional", "seq": seq, "query": query, **quick})
+            pending = asyncio.create_task(analyze(query, seq))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if pending is not None and not pending.done():
+            pending.cancel()
+
+
 @router.get("/stream")
 async def generate_formulation_stream(query: str = ""):
     async def event_stream():
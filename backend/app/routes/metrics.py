@@ -0,0 +1,103 @@
+from fastapi import APIRouter, Depends
+from typing import Dict, Any
+from app.core.deadlines import load_shedder
+from app.core.response_cache import response_cache
+from app.routes.admin import require_admin
+from app.routes.conversation import conversational_bot
+from app.services.conversation_channel import conversation_channels
+from app.services.formulation_warehouse import formulation_warehouse
+from app.services.ingredient_dedup import ingredient_deduplicator
+from app.services.job_queue import job_queue
+from app.services.llm_router import llm_router
+from app.services.query_artifacts import query_artifacts
+from app.services.session_store import session_store
+from app.services.usage_accounting import usage_accountant
+import asyncio
+
+
+router = APIRouter()
+
+
+@router.get("/llm", response_model=Dict[str, Any])
+async def get_llm_metrics():
+    """Per-tier and per-call-site latency, token and cost metrics for LLM calls."""
+    return llm_router.metrics()
+
+
+@router.get("/llm/output", response_model=Dict[str, Any])
+async def get_llm_output_metrics():
+    """Completion tokens, early cutoffs, max_tokens truncations and tokens saved (an upper bound), per endpoint."""
+    return llm_router.output_metrics()
+
+
+@router.get("/jobs", response_model=Dict[str, Any])
+async def get_job_metrics():
+    """Background job counts by status."""
+    return job_queue.stats()
+
+
+@router.get("/cache", response_model=Dict[str, Any])
+async def get_cache_metrics():
+    """Response cache hit/miss, eviction and memory stats."""
+    return response_cache.stats()
+
+
+@router.get("/llm/parsing", response_model=Dict[str, Any])
+async def get_llm_parse_metrics():
+    """JSON parse failures, local repairs and retries per LLM call site."""
+    return llm_router.parse_metrics()
+
+
+@router.get("/usage", response_model=Dict[str, Any], dependencies=[Depends(require_admin)])
+async def get_usage_metrics(since_minutes: int = 60 * 24):
+    """Per-tenant token usage by endpoint, live quota window and admission counters (admin only)."""
+    # Flushes and queries SQLite, so it runs off the event loop
+    return await asyncio.to_thread(usage_accountant.summary, since_minutes)
+
+
+@router.get("/stages", response_model=Dict[str, Any])
+async def get_stage_metrics():
+    """Runs, skips, memo hits, timeouts and failures per conversation turn stage."""
+    return conversational_bot.turn_graph.stats()
+
+
+@router.get("/messages", response_model=Dict[str, Any])
+async def get_message_metrics():
+    """Conversation questions and completion messages served from local templates vs the LLM."""
+    return conversational_bot.templates.stats()
+
+
+@router.get("/artifacts", response_model=Dict[str, Any])
+async def get_artifact_metrics():
+    """Query artifact hits, misses and requests coalesced onto an in-flight call, per artifact."""
+    return query_artifacts.stats()
+
+
+@router.get("/load", response_model=Dict[str, Any])
+async def get_load_metrics():
+    """Requests in flight, shed with 503 and timed out at their deadline."""
+    return load_shedder.stats()
+
+
+@router.get("/dedup", response_model=Dict[str, Any])
+async def get_dedup_metrics():
+    """Generated ingredients before and after deduplication, and how they were merged."""
+    return ingredient_deduplicator.stats()
+
+
+@router.get("/warehouse", response_model=Dict[str, Any])
+async def get_warehouse_metrics():
+    """Precomputed formulations, the share of requests served from them and refresh status."""
+    return formulation_warehouse.stats()
+
+
+@router.get("/channels", response_model=Dict[str, Any])
+async def get_channel_metrics():
+    """Open conversation sockets, frames in and out, and speculative intents pushed and used."""
+    return conversation_channels.stats()
+
+
+@router.get("/sessions", response_model=Dict[str, Any])
+async def get_session_metrics():
+    """Conversation sessions held in memory, evictions, and process memory (RSS) gauges."""
+    return session_store.stats()
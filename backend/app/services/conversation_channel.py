@@ -0,0 +1,316 @@
+from typing import Dict, Any, List, Optional, Callable, Awaitable
+from app.core.admission import admitted, QuotaExceeded
+from app.core.config import settings
+from app.core.request_context import llm_executor
+from app.services.session_store import session_store
+from app.services.stage_graph import stage_observer
+import asyncio
+import concurrent.futures
+import contextvars
+import json
+import math
+import threading
+
+
+# Requests one socket may have in flight at once
+MAX_PENDING_PER_SOCKET = 8
+# Frames queued for a slow reader before streamed tokens wait for it to catch up
+MAX_OUTBOX_FRAMES = 256
+# Chunks a stream's worker thread reads ahead of the socket
+STREAM_BUFFER_CHUNKS = 32
+
+# Each request frame is admitted against the tenant's quota like the HTTP call it replaces
+FRAME_ROUTES = {
+    "start": "/conversation/start",
+    "say": "/conversation/continue",
+    "intent": "/conversation/aggregate-intent",
+    "summary": "/conversation/summary",
+    "stream": "/conversation/stream",
+}
+
+
+def encode_frame(t: str, id: Any = None, d: Any = None) -> str:
+    """A compact frame: {"t": type, "id": request id, "d": data}, leaving out empty fields."""
+    frame: Dict[str, Any] = {"t": t}
+    if id is not None:
+        frame["id"] = id
+    if d is not None:
+        frame["d"] = d
+    return json.dumps(frame, separators=(",", ":"), default=str)
+
+
+def _compact(result: Dict[str, Any]) -> Dict[str, Any]:
+    """A turn result without the history (the server keeps it) and without empty fields."""
+    return {key: value for key, value in result.items()
+            if key != "conversation_history" and value not in (None, "", [], {})}
+
+
+def _message(data: Dict[str, Any], key: str, what: str) -> str:
+    """A required text field of a frame, within the same size cap as the HTTP endpoints."""
+    text = str(data.get(key, "")).strip()
+    if not text:
+        raise ValueError(f"\"{key}\" ({what}) is required")
+    if len(text) > settings.max_message_chars:
+        raise ValueError(f"\"{key}\" is longer than {settings.max_message_chars} characters")
+    return text
+
+
+class ConversationChannel:
+    """
+    One conversation multiplexed over one WebSocket. The server keeps the
+    session's history, so clients send only what's new. Several requests
+    can be in flight at once, each tagged with a client-chosen id that its
+    reply frames carry; turns are applied in order. Once a turn completes
+    the conversation, the aggregate intent is computed speculatively and
+    pushed before the client asks for it.
+    """
+
+    def __init__(self, bot, send: Callable[[str], Awaitable[None]], registry: "ConversationChannels"):
+        self.bot = bot
+        self.registry = registry
+        self._send = send
+        self._outbox: asyncio.Queue = asyncio.Queue()
+        # Set while the outbox is below MAX_OUTBOX_FRAMES
+        self._outbox_room = asyncio.Event()
+        self._outbox_room.set()
+        self._pending: Dict[Any, asyncio.Task] = {}
+        self._turn_lock = asyncio.Lock()
+        self.conversation_id: Optional[str] = None
+        self.history: List[Dict[str, str]] = []
+        # Aggregate intent computed ahead of the client's request, for the history length it was computed at
+        self._speculation: Optional[asyncio.Task] = None
+        self._speculation_length = 0
+
+    def push(self, t: str, id: Any = None, d: Any = None):
+        self._outbox.put_nowait(encode_frame(t, id, d))
+        self.registry.count("frames_out")
+
+    async def push_streamed(self, t: str, id: Any = None, d: Any = None):
+        """push() for streamed frames: waits while the reader is behind, so a slow reader slows the stream."""
+        while self._outbox.qsize() >= MAX_OUTBOX_FRAMES:
+            self._outbox_room.clear()
+            await self._outbox_room.wait()
+        self.push(t, id, d)
+
+    async def serve(self, receive: Callable[[], Awaitable[str]]):
+        """Read frames until the socket closes (the caller's receive raises), then cancel outstanding work."""
+        writer = asyncio.create_task(self._write_loop())
+        try:
+            while True:
+                raw = await receive()
+                self.registry.count("frames_in")
+                self._dispatch(raw)
+        finally:
+            for task in list(self._pending.values()):
+                task.cancel()
+            if self._speculation is not None:
+                self._speculation.cancel()
+            writer.cancel()
+            await asyncio.gather(writer, *self._pending.values(), return_exceptions=True)
+            # The socket held the conversation; its bot state can't be reached again
+            if self.conversation_id is not None:
+                session_store.discard(self.conversation_id)
+
+    async def _write_loop(self):
+        while True:
+            frame = await self._outbox.get()
+            if self._outbox.qsize() < MAX_OUTBOX_FRAMES:
+                self._outbox_room.set()
+            await self._send(frame)
+
+    def _dispatch(self, raw: str):
+        try:
+            frame = json.loads(raw)
+            kind, id, data = frame["t"], frame.get("id"), frame.get("d") or {}
+        except (json.JSONDecodeError, KeyError, TypeError):
+            self.push("err", d={"detail": "Frames must be JSON objects with a \"t\" field"})
+            return
+        if id is not None and (isinstance(id, bool) or not isinstance(id, (str, int))):
+            self.push("err", d={"detail": "Frame ids must be strings, integers or null"})
+            return
+
+        if kind == "ping":
+            self.push("pong", id)
+            return
+        if kind == "cancel":
+            task = self._pending.get(id)
+            if task is not None:
+                task.cancel()
+            return
+        handler = self._handlers().get(kind)
+        if handler is None:
+            self.push("err", id, {"detail": f"Unknown frame type: {kind}"})
+            return
+        if id in self._pending or len(self._pending) >= MAX_PENDING_PER_SOCKET:
+            self.push("err", id, {"detail": "Duplicate id or too many requests in flight"})
+            return
+        task = asyncio.create_task(self._run(kind, id, handler, data))
+        self._pending[id] = task
+        task.add_done_callback(lambda _: self._pending.pop(id, None))
+
+    def _handlers(self) -> Dict[str, Callable[[Any, Dict[str, Any]], Awaitable[None]]]:
+        return {
+            "start": self._start,
+            "say": self._say,
+            "intent": self._intent,
+            "summary": self._summary,
+            "stream": self._stream,
+        }
+
+    async def _run(self, kind: str, id: Any, handler, data: Dict[str, Any]):
+        # Stages that finish while handling this request are reported as progress frames
+        stage_observer.set(lambda stage: self.push("prog", id, stage))
+        try:
+            async with admitted(FRAME_ROUTES[kind]):
+                await handler(id, data)
+            self.registry.count(kind)
+        except asyncio.CancelledError:
+            self.push("end", id, {"cancelled": True})
+        except QuotaExceeded as e:
+            self.registry.count("rejected")
+            self.push("err", id, {"detail": e.detail, "retry_after": max(math.ceil(e.retry_after), 1)})
+        except Exception as e:
+            print(f"[CONVERSATION WS ERROR] {kind}: {e}")
+            self.registry.count("errors")
+            self.push("err", id, {"detail": getattr(e, "detail", None) or str(e)})
+
+    async def _start(self, id: Any, data: Dict[str, Any]):
+        query = _message(data, "q", "the initial query")
+        async with self._turn_lock:
+            self._drop_speculation()
+            if self.conversation_id is not None:
+                session_store.discard(self.conversation_id)
+            result = await self.bot.start_conversation(query)
+            self.conversation_id = result["conversation_id"]
+            self.history = result["conversation_history"]
+            self.push("turn", id, _compact(result))
+            if result.get("ready_for_formulation"):
+                self._speculate()
+
+    async def _say(self, id: Any, data: Dict[str, Any]):
+        response = _message(data, "r", "the user's response")
+        async with self._turn_lock:
+            # Checked under the lock so a "say" pipelined right behind "start" waits for it
+            if self.conversation_id is None:
+                raise ValueError("Send a \"start\" frame first")
+            if len(self.history) + 2 > settings.conversation_max_history:
+                raise ValueError("Conversation is too long; send a new \"start\" frame")
+            self._drop_speculation()
+            # The bot appends to the history it is given; a failed or cancelled turn must leave ours as it was
+            result = await self.bot.continue_conversation(
+                self.conversation_id, response, list(self.history),
+                include_current_query=bool(data.get("cq", False))
+            )
+            self.history = result["conversation_history"]
+            self.push("turn", id, _compact(result))
+            if result.get("ready_for_formulation"):
+                self._speculate()
+
+    def _speculate(self):
+        self._speculation_length = len(self.history)
+        self._speculation = asyncio.create_task(self._aggregate_intent(list(self.history)))
+        self._speculation.add_done_callback(self._push_speculation)
+        self.registry.count("speculations")
+
+    async def _aggregate_intent(self, history: List[Dict[str, str]]) -> Dict[str, Any]:
+        # Speculative work isn't part of the request that triggered it, so it reports no progress
+        stage_observer.set(None)
+        return await self.bot.aggregate_conversation_intent(history)
+
+    def _push_speculation(self, task: asyncio.Task):
+        if task.cancelled() or task.exception() is not None:
+            return
+        self.push("intent", d={**task.result(), "spec": True})
+
+    def _drop_speculation(self):
+        if self._speculation is not None and not self._speculation.done():
+            self._speculation.cancel()
+        self._speculation = None
+
+    async def _intent(self, id: Any, data: Dict[str, Any]):
+        speculation = self._speculation
+        if speculation is not None and self._speculation_length == len(self.history):
+            try:
+                result = await asyncio.shield(speculation)
+            except Exception:
+                result = None
+            if result is not None:
+                self.registry.count("speculation_hits")
+                self.push("intent", id, result)
+                return
+        self.push("intent", id, await self.bot.aggregate_conversation_intent(list(self.history)))
+
+    async def _summary(self, id: Any, data: Dict[str, Any]):
+        self.push("summary", id, await self.bot.get_conversation_summary(list(self.history)))
+
+    async def _stream(self, id: Any, data: Dict[str, Any]):
+        """Stream a reply to the session history (plus an optional new user message "m") as "tok" frames."""
+        messages = list(self.history)
+        if data.get("m"):
+            messages.append({"role": "user", "content": _message(data, "m", "the message")})
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=STREAM_BUFFER_CHUNKS)
+        stop = threading.Event()
+
+        def put(item: Any) -> bool:
+            """Hand an item to the socket, blocking while the buffer is full; False once it stopped reading."""
+            future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+            while True:
+                try:
+                    future.result(timeout=0.25)
+                    return True
+                except concurrent.futures.TimeoutError:
+                    if stop.is_set():
+                        future.cancel()
+                        return False
+
+        def worker():
+            try:
+                for content in self.bot.llm.stream("conversation_stream", messages, temperature=0.7):
+                    if stop.is_set() or not put(content):
+                        break
+            except Exception as e:
+                put(e)
+            finally:
+                put(None)
+
+        # A copy of the context, so LLM usage is attributed to this endpoint and tenant
+        loop.run_in_executor(llm_executor.get(), contextvars.copy_context().run, worker)
+        try:
+            while True:
+                chunk = await queue.get()
+                if chunk is None:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                await self.push_streamed("tok", id, chunk)
+        finally:
+            stop.set()
+        self.push("end", id)
+
+
+class ConversationChannels:
+    """Counts open conversation sockets and the frames and requests they carry."""
+
+    def __init__(self):
+        self.open = 0
+        self.peak_open = 0
+        self._stats: Dict[str, int] = {}
+
+    def count(self, stat: str):
+        self._stats[stat] = self._stats.get(stat, 0) + 1
+
+    async def serve(self, bot, receive: Callable[[], Awaitable[str]], send: Callable[[str], Awaitable[None]]):
+        self.open += 1
+        self.peak_open = max(self.peak_open, self.open)
+        self.count("connections")
+        try:
+            await ConversationChannel(bot, send, self).serve(receive)
+        finally:
+            self.open -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {"open": self.open, "peak_open": self.peak_open, **self._stats}
+
+
+conversation_channels = ConversationChannels()
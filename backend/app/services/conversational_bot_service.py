@@ -1,23 +1,80 @@
-from openai import OpenAI
-from typing import Dict, Any, List, Optional, AsyncGenerator
+from typing import Dict, Any, List, Optional
 from app.core.config import settings
+from app.core.request_context import mark_fallback
+from app.models.analysis import UserResponseAnalysis, DimensionCoverage, ConversationIntent
+from app.services.llm_cutoff import FILLER_PREFIXES
+from app.services.llm_router import llm_router, StructuredOutputError
+from app.services.message_templates import MessageTemplates, GENERIC_QUESTION
 from app.services.query_enhancement_service import QueryEnhancementService
-import json
+from app.services.session_store import SessionState, session_store
+from app.services.stage_graph import Stage, StageGraph
+import re
 
 
 class ConversationalBotService:
     # the four core dimensions we need
     DIMENSIONS = ["product_type", "achievement_goal", "target_audience", "special_ingredients"]
     MAX_EXCHANGES = 4  # Maximum 4 exchanges (including initial query)
+    # phrases that mark a non-committal answer, used when vague detection is routed to the heuristic tier
+    VAGUE_MARKERS = [
+        "maybe", "not sure", "unsure", "don't know", "dont know", "no idea", "anything", "whatever",
+        "open to suggestions", "no preference", "either", "up to you", "you decide", "traditional",
+        "local flavor", "spices", "doesn't matter", "doesnt matter", "idk", "any",
+    ]
 
     def __init__(self):
-        self.client = OpenAI(api_key=settings.openai_api_key)
+        self.llm = llm_router
         self.query_enhancer = QueryEnhancementService()
-        self.remaining_dims: List[str] = []
-        self.gathered_info: Dict[str, str] = {}
-        self.exchange_count: int = 0
-
-    async def _analyze_user_response(self, text: str, conversation_history: List[Dict[str, str]]) -> Dict[str, Any]:
+        # Per-conversation state (gathered info, exchange count, ...) lives in the session store
+        self.sessions = session_store
+        self.templates = MessageTemplates()
+        self.turn_graph = self._build_turn_graph()
+
+    def _build_turn_graph(self) -> StageGraph:
+        """The stages of one conversation turn and what each depends on."""
+        return StageGraph([
+            Stage("is_vague", lambda user_response: self._is_vague_or_general(user_response),
+                  inputs=["user_response"], timeout=15, fallback=lambda _: False),
+            Stage("analysis",
+                  lambda user_response, history, exchange_count: self._analyze_user_response(
+                      user_response, history, exchange_count),
+                  inputs=["user_response", "history", "exchange_count"], timeout=45,
+                  fallback=lambda kwargs: {"provided_info": None, "missing_info": [], "confidence": 0.0,
+                                           "ready_for_formulation": False, "exchange_count": kwargs["exchange_count"]}),
+            Stage("covered", lambda user_response: self._detect_dimensions(user_response),
+                  inputs=["user_response"], timeout=30, fallback=lambda _: []),
+            Stage("ready", self._is_ready, inputs=["analysis", "exchange_count"]),
+            Stage("full_query", lambda history: self._reconstruct_query_from_conversation(history),
+                  inputs=["history"], timeout=45, fallback=self._joined_user_messages, memoize=True),
+            Stage("enhanced", lambda full_query: self.query_enhancer.enhance_query(full_query),
+                  inputs=["full_query"], timeout=60,
+                  skip_if=lambda kwargs: not kwargs["full_query"],
+                  skip_value={"enhanced_query": "", "intent_analysis": {}},
+                  fallback=lambda _: {"enhanced_query": "", "intent_analysis": {}}),
+            # Only needs the reconstructed query, so it runs alongside enhancement
+            Stage("completion", lambda full_query, session: self._generate_completion_message(full_query, session),
+                  inputs=["full_query", "session"], timeout=30,
+                  fallback=lambda _: "There was an error generating your formulation. Please try again."),
+            Stage("next_question",
+                  lambda history, analysis, is_vague, session: self._generate_intelligent_question(
+                      history, analysis, session, is_vague),
+                  inputs=["history", "analysis", "is_vague", "session"], timeout=30,
+                  fallback=lambda _: "There was an error generating the next question. Please try again."),
+        ])
+
+    def _joined_user_messages(self, kwargs: Dict[str, Any]) -> str:
+        """Fallback query when reconstruction fails or doesn't fit the deadline: the user's own words."""
+        return " ".join(m["content"] for m in kwargs["history"] if m.get("role") == "user")
+
+    async def _is_ready(self, analysis: Dict[str, Any], exchange_count: int) -> bool:
+        return bool(analysis.get("ready_for_formulation", False) or exchange_count >= self.MAX_EXCHANGES)
+
+    async def _analyze_user_response(
+        self,
+        text: str,
+        conversation_history: List[Dict[str, str]],
+        exchange_count: int
+    ) -> Dict[str, Any]:
         """Intelligently analyze what information the user has provided and what's still missing."""
         prompt = f"""
 Analyze the user's response and the conversation context to determine:
@@ -45,30 +102,31 @@ Return a JSON object with:
 - "exchange_count": Current exchange number
 """
         
-        resp = self.client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.3
-        )
-        
         try:
-            result = json.loads(resp.choices[0].message.content)
-            result["exchange_count"] = self.exchange_count
+            parsed = await self.llm.complete_json(
+                "analyze_user_response",
+                [{"role": "user", "content": prompt}],
+                UserResponseAnalysis,
+                temperature=0.3
+            )
+            result = parsed.model_dump()
+            result["exchange_count"] = exchange_count
             return result
-        except json.JSONDecodeError:
+        except StructuredOutputError:
+            mark_fallback()
             return {
                 "provided_info": "",
                 "missing_info": [],
                 "next_question_rationale": "Continue gathering information",
                 "confidence": 0.0,
                 "ready_for_formulation": False,
-                "exchange_count": self.exchange_count
+                "exchange_count": exchange_count
             }
 
     async def _detect_dimensions(self, text: str) -> List[str]:
         """Have GPT tell us which of the 4 dims the user's text already covers."""
         prompt = f"""
-Analyze the user's text and identify which of these four categories are covered (return a JSON array of names):
+Analyze the user's text and identify which of these four categories are covered (return a JSON object whose "covered" key is an array of names):
  1. product_type (what specific product they want to create)
  2. achievement_goal (what they want to achieve/benefits they want)
  3. target_audience (who the product is for)
@@ -79,14 +137,16 @@ IMPORTANT: Be strict about coverage. If the user says "I want a cream" but doesn
 User text:
 \"\"\"{text}\"\"\"
 """
-        resp = self.client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0
-        )
         try:
-            return json.loads(resp.choices[0].message.content)
-        except json.JSONDecodeError:
+            coverage = await self.llm.complete_json(
+                "detect_dimensions",
+                [{"role": "user", "content": prompt}],
+                DimensionCoverage,
+                temperature=0
+            )
+            return list(coverage.covered)
+        except StructuredOutputError:
+            mark_fallback()
             return []
 
     def _get_system_prompt(self) -> str:
@@ -102,12 +162,26 @@ User text:
     async def _generate_intelligent_question(
         self,
         conversation_history: List[Dict[str, str]],
-        analysis: Dict[str, Any]
+        analysis: Dict[str, Any],
+        session: SessionState,
+        is_vague: bool = False
     ) -> str:
         """Generate an intelligent question based on what we've learned so far."""
         
-        exchange_count = analysis.get("exchange_count", self.exchange_count)
+        exchange_count = analysis.get("exchange_count", session.exchange_count)
         remaining_exchanges = self.MAX_EXCHANGES - exchange_count
+
+        question = self._templated_question(analysis, session, is_vague, exchange_count)
+        if question is not None:
+            return question
+        session.last_asked_dimension = None
+
+        # A vague answer means the user has no strong preference on that topic
+        vague_note = (
+            "The user's latest answer was vague or non-committal: treat that topic as open "
+            "and move on to a different missing piece of information instead of drilling further.\n"
+            if is_vague else ""
+        )
         
         prompt = f"""
 Based on the conversation analysis, generate the next intelligent question.
@@ -127,44 +201,72 @@ Generate a single, conversational question that:
 
 Focus on the most important missing information that would be most valuable to gather next.
 If we're near the limit, ask for the most critical piece of information only.
-"""
+{vague_note}"""
         
-        resp = self.client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
+        content = await self.llm.complete(
+            "intelligent_question",
+            [
                 {"role": "system", "content": self._get_system_prompt()},
                 {"role": "user", "content": prompt}
             ],
             temperature=0.4
         )
         
-        return resp.choices[0].message.content.strip()
+        return content.strip()
+
+    def _templated_question(
+        self, analysis: Dict[str, Any], session: SessionState, is_vague: bool, exchange_count: int
+    ) -> Optional[str]:
+        """Next question from the phrase banks, or None when it needs the LLM."""
+        mode = settings.conversation_message_mode
+        if mode == "llm":
+            self.templates.record("question", local=False)
+            return None
+        known = {}
+        for info in (session.gathered_info, analysis.get("provided_info")):
+            if isinstance(info, dict):
+                known.update(info)
+        slots = self.templates.slots(known)
+        exclude = session.last_asked_dimension if is_vague else None
+        dimension = self.templates.next_dimension(analysis.get("missing_info", []), slots, exclude=exclude)
+        question = self.templates.question(dimension, slots, variant=exchange_count) if dimension else None
+        if question is None and mode == "template":
+            # Ambiguous case without the LLM: ask about the first open dimension, or generically
+            dimension = next((d for d in self.DIMENSIONS if d not in slots and d != exclude), None)
+            question = self.templates.question(dimension, slots, variant=exchange_count) if dimension else GENERIC_QUESTION
+        self.templates.record("question", local=question is not None)
+        if question is not None:
+            session.last_asked_dimension = dimension
+        return question
 
     async def start_conversation(self, initial_query: str) -> Dict[str, Any]:
         """Start a conversation with intelligent analysis."""
         try:
-            self.exchange_count = 1  # Initial query counts as first exchange
-            
-            # 1) Analyze the initial query
-            analysis = await self._analyze_user_response(initial_query, [{"role": "user", "content": initial_query}])
+            conversation_id = self._generate_conversation_id()
+            session = self.sessions.get_or_create(conversation_id)
+            session.exchange_count = 1  # Initial query counts as first exchange
+            history = [{"role": "user", "content": initial_query}]
             
-            # 2) Detect which dimensions are covered
-            covered = await self._detect_dimensions(initial_query)
-            self.remaining_dims = [d for d in self.DIMENSIONS if d not in covered]
+            # 1) Analyze the initial query and detect covered dimensions concurrently
+            values = await self.turn_graph.run(
+                {"user_response": initial_query, "history": history, "exchange_count": session.exchange_count,
+                 "is_vague": False, "session": session},
+                ["ready", "covered"]
+            )
+            analysis = values["analysis"]
+            session.remaining_dims = [d for d in self.DIMENSIONS if d not in values["covered"]]
             
-            # 3) Store gathered information
-            self.gathered_info = analysis.get("provided_info", {})
+            # 2) Store gathered information
+            session.merge_info(analysis.get("provided_info"))
             
-            # 4) Check if we already have enough information
-            if analysis.get("ready_for_formulation", False) or self.exchange_count >= self.MAX_EXCHANGES:
-                # Complete immediately if we have enough info or hit limit
-                full = await self._reconstruct_query_from_conversation([{"role": "user", "content": initial_query}])
-                enhanced = await self.query_enhancer.enhance_query(full)
-                completion = await self._generate_completion_message(full, enhanced)
+            # 3) Complete immediately if we have enough info or hit the limit
+            if values["ready"]:
+                values = await self.turn_graph.run(values, ["enhanced", "completion"])
+                enhanced, completion = values["enhanced"], values["completion"]
                 
                 return {
-                    "conversation_id": self._generate_conversation_id(),
-                    "current_query": full,
+                    "conversation_id": conversation_id,
+                    "current_query": values["full_query"],
                     "is_sufficient": True,
                     "confidence_score": 1.0,
                     "enhanced_query": enhanced["enhanced_query"],
@@ -177,18 +279,16 @@ If we're near the limit, ask for the most critical piece of information only.
                     "ready_for_formulation": True,
                     "message": completion,
                     "questions_remaining": 0,
-                    "gathered_info": self.gathered_info,
-                    "exchange_count": self.exchange_count
+                    "gathered_info": dict(session.gathered_info),
+                    "exchange_count": session.exchange_count
                 }
             
-            # 5) Generate intelligent first question
-            first_q = await self._generate_intelligent_question(
-                [{"role": "user", "content": initial_query}],
-                analysis
-            )
+            # 4) Generate intelligent first question
+            values = await self.turn_graph.run(values, ["next_question"])
+            first_q = values["next_question"]
 
             return {
-                "conversation_id": self._generate_conversation_id(),
+                "conversation_id": conversation_id,
                 "current_query": initial_query,
                 "missing_information": analysis.get("missing_info", []),
                 "confidence_score": analysis.get("confidence", 0.0),
@@ -201,8 +301,8 @@ If we're near the limit, ask for the most critical piece of information only.
                 "next_question": first_q,
                 "questions_remaining": len(analysis.get("missing_info", [])),
                 "ready_for_formulation": False,
-                "gathered_info": self.gathered_info,
-                "exchange_count": self.exchange_count
+                "gathered_info": dict(session.gathered_info),
+                "exchange_count": session.exchange_count
             }
         except Exception as e:
             raise Exception(f"Failed to start conversation: {str(e)}")
@@ -214,67 +314,63 @@ User response: "{text}"
 Return true if it is vague or general, otherwise false. Respond with only 'true' or 'false'.
 """
         try:
-            resp = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0
+            answer = await self.llm.complete(
+                "is_vague",
+                [{"role": "user", "content": prompt}],
+                temperature=0,
+                heuristic=lambda: "true" if self._looks_vague(text) else "false"
             )
-            answer = resp.choices[0].message.content.strip().lower()
-            return answer.startswith('true')
+            return answer.strip().lower().startswith('true')
         except Exception as e:
             print(f"[VAGUE DETECTION ERROR]: {e}")
+            mark_fallback()
             return False  # Default to not vague if error
 
+    def _looks_vague(self, text: str) -> bool:
+        """Keyword check for non-committal answers, no LLM involved."""
+        words = re.sub(r"[^a-z' ]", " ", text.lower()).split()
+        padded = f" {' '.join(words)} "
+        return any(f" {marker} " in padded for marker in self.VAGUE_MARKERS)
+
     async def continue_conversation(
         self,
         conversation_id: str,
         user_response: str,
-        conversation_history: List[Dict[str, str]]
+        conversation_history: List[Dict[str, str]],
+        include_current_query: bool = True
     ) -> Dict[str, Any]:
         try:
-            # 1) Increment exchange count
-            self.exchange_count += 1
+            # 1) Increment exchange count; a conversation this worker doesn't know (evicted, restarted
+            #    or started on another worker) is picked up from its history
+            session = self.sessions.get(conversation_id)
+            if session is None:
+                session = self.sessions.get_or_create(conversation_id)
+                session.exchange_count = sum(1 for m in conversation_history if m.get("role") == "user")
+            session.exchange_count += 1
             
             # 2) Add the user's answer
             conversation_history.append({"role": "user", "content": user_response})
 
-            # 2.5) Check if the answer is vague/general and if so, skip further drilling
-            try:
-                is_vague = await self._is_vague_or_general(user_response)
-            except Exception as e:
-                print(f"[VAGUE CHECK ERROR]: {e}")
-                is_vague = False
-            try:
-                analysis = await self._analyze_user_response(user_response, conversation_history)
-            except Exception as e:
-                print(f"[ANALYSIS ERROR]: {e}")
-                analysis = {"provided_info": None, "missing_info": [], "confidence": 0.0, "ready_for_formulation": False}
+            # 3) Analyze the answer and check whether it is vague, concurrently
+            values = await self.turn_graph.run(
+                {"user_response": user_response, "history": list(conversation_history),
+                 "exchange_count": session.exchange_count, "session": session},
+                ["ready", "is_vague"]
+            )
+            analysis = values["analysis"]
             
-            # 3) Update gathered information
-            provided_info = analysis.get("provided_info")
-            if isinstance(provided_info, dict):
-                self.gathered_info.update(provided_info)
-            elif isinstance(provided_info, str):
-                # Optionally log or handle the string case
-                pass
-
-            # 4) Check if we have enough information or hit the limit
-            if (analysis.get("ready_for_formulation", False) or 
-                self.exchange_count >= self.MAX_EXCHANGES):
-                try:
-                    full = await self._reconstruct_query_from_conversation(conversation_history)
-                    enhanced = await self.query_enhancer.enhance_query(full)
-                    completion = await self._generate_completion_message(full, enhanced)
-                    conversation_history.append({"role": "assistant", "content": completion})
-                except Exception as e:
-                    print(f"[FINALIZATION ERROR]: {e}")
-                    completion = "There was an error generating your formulation. Please try again."
-                    conversation_history.append({"role": "assistant", "content": completion})
-                    enhanced = {"enhanced_query": "", "intent_analysis": {}}
-                    full = ""
+            # 4) Update gathered information
+            session.merge_info(analysis.get("provided_info"))
+
+            # 5) Enough information or hit the limit: the completion message
+            #    only needs the reconstructed query, so it runs alongside enhancement
+            if values["ready"]:
+                values = await self.turn_graph.run(values, ["enhanced", "completion"])
+                enhanced, completion = values["enhanced"], values["completion"]
+                conversation_history.append({"role": "assistant", "content": completion})
                 return {
                     "conversation_id": conversation_id,
-                    "current_query": full,
+                    "current_query": values["full_query"],
                     "is_sufficient": True,
                     "confidence_score": 1.0,
                     "enhanced_query": enhanced.get("enhanced_query", ""),
@@ -283,44 +379,23 @@ Return true if it is vague or general, otherwise false. Respond with only 'true'
                     "ready_for_formulation": True,
                     "message": completion,
                     "questions_remaining": 0,
-                    "gathered_info": self.gathered_info,
-                    "exchange_count": self.exchange_count
+                    "gathered_info": dict(session.gathered_info),
+                    "exchange_count": session.exchange_count
                 }
 
-            # 5) If vague, skip to next dimension/question
-            if is_vague:
-                try:
-                    next_q = await self._generate_intelligent_question(conversation_history, analysis)
-                    conversation_history.append({"role": "assistant", "content": next_q})
-                except Exception as e:
-                    print(f"[NEXT QUESTION ERROR]: {e}")
-                    next_q = "There was an error generating the next question. Please try again."
-                    conversation_history.append({"role": "assistant", "content": next_q})
-                return {
-                    "conversation_id": conversation_id,
-                    "current_query": await self._reconstruct_query_from_conversation(conversation_history),
-                    "missing_information": analysis.get("missing_info", []),
-                    "confidence_score": analysis.get("confidence", 0.0),
-                    "is_sufficient": False,
-                    "conversation_history": conversation_history,
-                    "next_question": next_q,
-                    "questions_remaining": len(analysis.get("missing_info", [])),
-                    "ready_for_formulation": False,
-                    "gathered_info": self.gathered_info,
-                    "exchange_count": self.exchange_count
-                }
+            # 6) Otherwise ask the next question; a vague answer moves on to the next topic
+            values = await self.turn_graph.run(values, ["next_question"])
+            next_q = values["next_question"]
+            conversation_history.append({"role": "assistant", "content": next_q})
 
-            # 6) Otherwise, generate intelligent next question as usual
-            try:
-                next_q = await self._generate_intelligent_question(conversation_history, analysis)
-                conversation_history.append({"role": "assistant", "content": next_q})
-            except Exception as e:
-                print(f"[NEXT QUESTION ERROR]: {e}")
-                next_q = "There was an error generating the next question. Please try again."
-                conversation_history.append({"role": "assistant", "content": next_q})
+            # Callers that opted out don't pay for reconstructing the query
+            current_query = None
+            if include_current_query:
+                values = await self.turn_graph.run({"history": list(conversation_history)}, ["full_query"])
+                current_query = values["full_query"]
             return {
                 "conversation_id": conversation_id,
-                "current_query": await self._reconstruct_query_from_conversation(conversation_history),
+                "current_query": current_query,
                 "missing_information": analysis.get("missing_info", []),
                 "confidence_score": analysis.get("confidence", 0.0),
                 "is_sufficient": False,
@@ -328,33 +403,26 @@ Return true if it is vague or general, otherwise false. Respond with only 'true'
                 "next_question": next_q,
                 "questions_remaining": len(analysis.get("missing_info", [])),
                 "ready_for_formulation": False,
-                "gathered_info": self.gathered_info,
-                "exchange_count": self.exchange_count
+                "gathered_info": dict(session.gathered_info),
+                "exchange_count": session.exchange_count
             }
         except Exception as e:
             print(f"[CONVERSATION ERROR]: {e}")
             from fastapi import HTTPException
             raise HTTPException(status_code=500, detail=str(e))
 
-    async def stream_conversation_response(self, messages: List[Dict[str, str]]) -> AsyncGenerator[str, None]:
-        """Stream the conversation response for real-time feel."""
-        try:
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=messages,
-                temperature=0.7,
-                stream=True
-            )
-            
-            async for chunk in response:
-                if chunk.choices[0].delta.content:
-                    yield chunk.choices[0].delta.content
-                    
-        except Exception as e:
-            yield f"Error: {str(e)}"
-
-    async def _generate_completion_message(self, full_query: str, enhanced_data: Dict[str, Any]) -> str:
+    async def _generate_completion_message(
+        self,
+        full_query: str,
+        session: SessionState,
+        enhanced_data: Optional[Dict[str, Any]] = None
+    ) -> str:
         """Generate a completion message."""
+        if settings.conversation_message_mode != "llm":
+            # A fixed acknowledgement; the phrase bank fills in what we know instead of spending a completion
+            self.templates.record("completion", local=True)
+            return self.templates.completion(self.templates.slots(session.gathered_info), variant=session.exchange_count)
+        self.templates.record("completion", local=False)
         
         messages = [
             {"role": "system", "content": self._get_system_prompt()},
@@ -363,13 +431,9 @@ Return true if it is vague or general, otherwise false. Respond with only 'true'
 Generate a brief, enthusiastic completion message (exactly one sentence) that acknowledges we have enough information and will proceed to create their perfect formulation."""}
         ]
         
-        response = self.client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages,
-            temperature=0.7
-        )
+        content = await self.llm.complete("completion_message", messages, temperature=0.7)
         
-        return response.choices[0].message.content.strip()
+        return content.strip()
     
     async def _reconstruct_query_from_conversation(self, conversation_history: List[Dict[str, str]]) -> str:
         """Reconstruct the full query from the conversation history."""
@@ -390,19 +454,18 @@ Generate a brief, enthusiastic completion message (exactly one sentence) that ac
         Output:
         - A single, concise, actionable paragraph (no more than 3-4 lines).
         """
-        response = self.client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
+        content = await self.llm.complete(
+            "reconstruct_query",
+            [{"role": "user", "content": prompt}],
             temperature=0.2
         )
-        result = response.choices[0].message.content.strip()
+        result = content.strip()
         # Post-process: Remove any lines starting with 'please', 'additionally', 'request', or similar
-        import re
         lines = result.split('\n')
         filtered = []
         for line in lines:
             l = line.strip().lower()
-            if l.startswith('please') or l.startswith('additionally') or l.startswith('request') or l.startswith('kindly'):
+            if l.startswith(FILLER_PREFIXES):
                 continue
             filtered.append(line)
         # Only keep the first paragraph (up to a blank line or 3-4 lines)
@@ -415,6 +478,11 @@ Generate a brief, enthusiastic completion message (exactly one sentence) that ac
                 break
         return ' '.join(paragraph).strip()
     
+    async def _full_query(self, conversation_history: List[Dict[str, str]]) -> str:
+        """Reconstructed query through the turn graph, so repeated histories reuse the memo."""
+        values = await self.turn_graph.run({"history": list(conversation_history)}, ["full_query"])
+        return values["full_query"]
+
     async def aggregate_conversation_intent(self, conversation_history: List[Dict[str, str]]) -> Dict[str, Any]:
         """Aggregate the conversation to extract the user's complete intent."""
         try:
@@ -433,27 +501,28 @@ Generate a brief, enthusiastic completion message (exactly one sentence) that ac
             3. TARGET_AUDIENCE: Who the product is for
             4. SPECIAL_INGREDIENTS: Any specific ingredients they want to use
 
-            Return a JSON object with these four keys, each containing a clear summary.
+            Return a JSON object with the keys "product_type", "achievement_goal", "target_audience" and
+            "special_ingredients", each containing a clear summary.
             """
             
-            response = self.client.chat.completions.create(
-                model="gpt-4o-mini",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.3
-            )
-            
             try:
-                intent_summary = json.loads(response.choices[0].message.content)
+                intent_summary = await self.llm.complete_json(
+                    "aggregate_intent",
+                    [{"role": "user", "content": prompt}],
+                    ConversationIntent,
+                    temperature=0.3
+                )
                 return {
-                    "product_type": intent_summary.get("product_type", ""),
-                    "achievement_goal": intent_summary.get("achievement_goal", ""),
-                    "target_audience": intent_summary.get("target_audience", ""),
-                    "special_ingredients": intent_summary.get("special_ingredients", ""),
-                    "full_intent": await self._reconstruct_query_from_conversation(conversation_history)
+                    "product_type": intent_summary.product_type,
+                    "achievement_goal": intent_summary.achievement_goal,
+                    "target_audience": intent_summary.target_audience,
+                    "special_ingredients": intent_summary.special_ingredients,
+                    "full_intent": await self._full_query(conversation_history)
                 }
-            except json.JSONDecodeError:
+            except StructuredOutputError:
                 # Fallback if JSON parsing fails
-                full_intent = await self._reconstruct_query_from_conversation(conversation_history)
+                mark_fallback()
+                full_intent = await self._full_query(conversation_history)
                 return {
                     "product_type": "Product type not specified",
                     "achievement_goal": "Achievement goal not specified", 
@@ -473,7 +542,7 @@ Generate a brief, enthusiastic completion message (exactly one sentence) that ac
     async def get_conversation_summary(self, conversation_history: List[Dict[str, str]]) -> Dict[str, Any]:
         """Get a summary of the conversation and current understanding."""
         try:
-            full_query = await self._reconstruct_query_from_conversation(conversation_history)
+            full_query = await self._full_query(conversation_history)
             validation_result = await self.query_enhancer.validate_query(full_query)
             
             return {
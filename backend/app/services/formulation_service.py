@@ -1,30 +1,62 @@
-from openai import OpenAI
-import json
 from typing import List, Dict, Any
-from app.core.config import settings
+from fastapi.encoders import jsonable_encoder
+from app.core.deadlines import DeadlineExceeded
+from app.core.request_context import mark_fallback
+from app.models.analysis import IngredientList, IntentAnalysis
 from app.models.ingredient import Ingredient
+from app.services import ingredient_dedup
+from app.services.formulation_warehouse import formulation_warehouse
+from app.services.ingredient_dedup import ingredient_deduplicator
+from app.services.json_repair import REPAIR_VERSION
+from app.services.llm_router import llm_router, StructuredOutputError
 from app.services.query_enhancement_service import QueryEnhancementService
 
 
 class FormulationService:
+    # Bump when the ingredient generation prompt changes; stored warehouse results depend on it
+    PROMPT_VERSION = 1
+
     def __init__(self):
-        if not settings.openai_api_key:
-            raise ValueError("OpenAI API key is not configured. Please set OPENAI_API_KEY environment variable.")
-        self.client = OpenAI(api_key=settings.openai_api_key)
+        self.llm = llm_router
         self.query_enhancer = QueryEnhancementService()
+
+    def register_warehouse(self):
+        """Let the warehouse precompute formulations with this service, versioned by what shapes them."""
+        formulation_warehouse.register(
+            self._compute_warehouse_formulation,
+            {"formulation": self.PROMPT_VERSION, "enhancement": QueryEnhancementService.PROMPT_VERSION},
+            IngredientList.model_json_schema(),
+            IntentAnalysis.model_json_schema(),
+            {"json_repair": REPAIR_VERSION},
+            {"synonyms": ingredient_dedup.SYNONYMS, "qualifiers": sorted(ingredient_dedup.QUALIFIERS),
+             "form_words": sorted(ingredient_dedup.FORM_WORDS), "identity_words": sorted(ingredient_dedup.IDENTITY_WORDS),
+             "per_alias": ingredient_dedup.PER_ALIAS_ATTRIBUTES, "ngram": ingredient_dedup.NGRAM,
+             "threshold": ingredient_dedup.SIMILARITY_THRESHOLD},
+        )
+
+    async def _compute_warehouse_formulation(self, query: str) -> Dict[str, Any]:
+        return jsonable_encoder(await self.compute_formulation(query))
     
     async def generate_formulation(self, query: str) -> Dict[str, Any]:
         """
         Generate formulation with enhanced query processing.
         Returns both ingredients and query analysis.
         """
+        precomputed = formulation_warehouse.lookup(query)
+        if precomputed is not None:
+            return {**precomputed, "original_query": query}
+        return await self.compute_formulation(query)
+
+    async def compute_formulation(self, query: str) -> Dict[str, Any]:
+        """Run the full enhancement and generation chain, bypassing the warehouse."""
         try:
             # First, enhance the user query
             enhanced_data = await self.query_enhancer.enhance_query(query)
             enhanced_query = enhanced_data["enhanced_query"]
             
-            # Generate ingredients using the enhanced query
-            ingredients = await self._generate_ingredients(enhanced_query)
+            # Generate ingredients using the enhanced query; identical requests in flight share one call
+            ingredients = await self.query_enhancer.artifacts.get_or_create(
+                query, "ingredients", lambda: self._produce_ingredients(enhanced_query), retain=False)
             
             return {
                 "ingredients": ingredients,
@@ -33,6 +65,8 @@ class FormulationService:
                 "enhanced_query": enhanced_query
             }
             
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             raise Exception(f"Failed to generate formulation: {str(e)}")
     
@@ -44,22 +78,24 @@ class FormulationService:
 
         Query: {enhanced_query}
 
-        Return ONLY a valid JSON array of objects with this exact structure (no additional text, no markdown formatting):
-        [
-            {{
-                "name": "ingredient name",
-                "attributes": {{
-                    "benefits": "specific benefits and properties",
-                    "usage": "how to use in formulation",
-                    "safety": "safety considerations and warnings",
-                    "concentration": "recommended concentration range",
-                    "compatibility": "what ingredients it works well with",
-                    "contraindications": "when not to use",
-                    "source": "natural source information",
-                    "certification": "organic/certification status if applicable"
+        Return ONLY a valid JSON object with this exact structure (no additional text, no markdown formatting):
+        {{
+            "ingredients": [
+                {{
+                    "name": "ingredient name",
+                    "attributes": {{
+                        "benefits": "specific benefits and properties",
+                        "usage": "how to use in formulation",
+                        "safety": "safety considerations and warnings",
+                        "concentration": "recommended concentration range",
+                        "compatibility": "what ingredients it works well with",
+                        "contraindications": "when not to use",
+                        "source": "natural source information",
+                        "certification": "organic/certification status if applicable"
+                    }}
                 }}
-            }}
-        ]
+            ]
+        }}
 
         Focus on:
         - 100% natural and clean ingredients
@@ -70,47 +106,24 @@ class FormulationService:
         - Concentration recommendations
         """
         
-        response = self.client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": formulation_prompt}],
-            temperature=0.7
-        )
-        
-        content = response.choices[0].message.content.strip()
-        
-        # Clean the content to extract JSON
-        content = self._extract_json_from_response(content)
-        
         try:
-            ingredients_data = json.loads(content)
-            ingredients = []
-            for item in ingredients_data:
-                if isinstance(item, dict) and 'name' in item:
-                    ingredients.append(Ingredient(
-                        name=item['name'],
-                        attributes=item.get('attributes', {})
-                    ))
-            return ingredients
-        except json.JSONDecodeError as e:
+            result = await self.llm.complete_json(
+                "generate_ingredients",
+                [{"role": "user", "content": formulation_prompt}],
+                IngredientList,
+                temperature=0.7
+            )
+            return ingredient_deduplicator.dedupe(result.ingredients)
+        except StructuredOutputError as e:
             print(f"JSON parsing error: {e}")
-            print(f"Content: {content}")
+            print(f"Content: {e.content}")
             # Fallback: parse the text response manually
-            return self._parse_text_response(content)
-    
-    def _extract_json_from_response(self, content: str) -> str:
-        """Extract JSON from the response, handling various formats."""
-        # Remove markdown code blocks
-        content = content.replace('```json', '').replace('```', '').strip()
-        
-        # Find the first [ and last ] to extract the array
-        start = content.find('[')
-        end = content.rfind(']')
-        
-        if start != -1 and end != -1 and end > start:
-            return content[start:end + 1]
-        
-        return content
+            mark_fallback()
+            return self._parse_text_response(e.content.strip())
     
+    async def _produce_ingredients(self, enhanced_query: str):
+        return await self._generate_ingredients(enhanced_query), True
+
     def _parse_text_response(self, content: str) -> List[Ingredient]:
         """Fallback method to parse text response when JSON parsing fails"""
         ingredients = []
@@ -128,7 +141,7 @@ class FormulationService:
                         attributes['description'] = parts[1].strip()
                     ingredients.append(Ingredient(name=name, attributes=attributes))
         
-        return ingredients
+        return ingredient_deduplicator.dedupe(ingredients)
     
     async def get_query_suggestions(self, query: str) -> List[str]:
         """Get suggestions for improving the user query."""
@@ -136,4 +149,8 @@ class FormulationService:
     
     async def validate_query(self, query: str) -> Dict[str, Any]:
         """Validate if a query has sufficient information."""
-        return await self.query_enhancer.validate_query(query) 
\ No newline at end of file
+        return await self.query_enhancer.validate_query(query) 
+
+    async def analyze_query(self, query: str) -> Dict[str, Any]:
+        """Validation, suggestions and the enhanced query for a query in one call."""
+        return await self.query_enhancer.full_analysis(query)
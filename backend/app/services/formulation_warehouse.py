@@ -0,0 +1,301 @@
+from typing import Dict, Any, List, Optional, Callable, Awaitable, Tuple
+from app.core.config import settings
+from app.core.request_context import RequestUsage, current_endpoint, current_tenant, current_usage
+from app.services.query_artifacts import query_fingerprint
+import asyncio
+import datetime
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+FormulationProducer = Callable[[str], Awaitable[Dict[str, Any]]]
+
+DAY_SECONDS = 24 * 3600
+
+
+def prompt_version(*parts: Any) -> str:
+    """
+    Version of the prompts behind a result: a hash of the given parts (prompt
+    version constants, output schemas, ...) plus the LLM routing config, so
+    bumping a prompt version, changing a schema or rerouting a call site
+    invalidates results produced before.
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps(parts, sort_keys=True, default=str).encode("utf-8"))
+    routing = {
+        "tiers": {name: tier.model_dump() for name, tier in settings.llm_tiers.items()},
+        "routes": {name: route.model_dump() for name, route in settings.llm_routes.items()},
+        "backend": settings.llm_backend,
+        "salt": settings.warehouse_version_salt,
+    }
+    digest.update(json.dumps(routing, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+class FormulationWarehouse:
+    """
+    Precomputed formulations for the most popular queries. Every formulation
+    request is counted in a query log (SQLite, flushed periodically); during
+    off-peak hours a background task mines the top queries from the log and
+    regenerates their results, which are then served without any LLM calls
+    as long as they were produced by the current prompt version.
+    """
+
+    def __init__(self, enabled: bool, db_path: str, top_n: int, min_hits: int, window_days: int,
+                 refresh_hours: List[int], refresh_after: float, max_age: float, check_interval: float):
+        self.enabled = enabled
+        self.db_path = db_path
+        self.top_n = top_n
+        self.min_hits = min_hits
+        self.window_days = window_days
+        self.refresh_hours = set(refresh_hours)
+        self.refresh_after = refresh_after
+        self.max_age = max_age
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._producer: Optional[FormulationProducer] = None
+        self._version_parts: Tuple[Any, ...] = ()
+        self._version: Optional[str] = None
+        # fingerprint -> (result, refreshed_at) for the current version
+        self._entries: Dict[str, Tuple[Dict[str, Any], float]] = {}
+        # (fingerprint, day) -> [query, hits] not yet written to the log
+        self._pending: Dict[Tuple[str, int], List[Any]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._refreshing = False
+        self._stats = {"served": 0, "missed": 0, "refreshed": 0, "refresh_errors": 0, "refresh_runs": 0}
+        self._last_refresh: Optional[float] = None
+
+    def register(self, producer: FormulationProducer, *version_parts: Any):
+        """
+        Set the coroutine that computes a formulation without the warehouse,
+        and what its results depend on (hashed into the prompt version).
+        """
+        self._producer = producer
+        self._version_parts = version_parts
+        self._version = None
+
+    @property
+    def version(self) -> str:
+        if self._version is None:
+            self._version = prompt_version(*self._version_parts)
+        return self._version
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS query_log (
+                    fingerprint TEXT NOT NULL,
+                    day INTEGER NOT NULL,
+                    query TEXT NOT NULL,
+                    hits INTEGER NOT NULL,
+                    PRIMARY KEY (fingerprint, day)
+                )
+            """)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS formulations (
+                    fingerprint TEXT PRIMARY KEY,
+                    query TEXT NOT NULL,
+                    version TEXT NOT NULL,
+                    result TEXT NOT NULL,
+                    refreshed_at REAL NOT NULL
+                )
+            """)
+            self._conn.commit()
+        return self._conn
+
+    def lookup(self, query: str) -> Optional[Dict[str, Any]]:
+        """Log a formulation request and return its precomputed result, if there is a fresh one."""
+        if not self.enabled:
+            return None
+        fingerprint = query_fingerprint(query)
+        now = time.time()
+        with self._lock:
+            pending = self._pending.setdefault((fingerprint, int(now // DAY_SECONDS)), [query, 0])
+            pending[1] += 1
+            entry = self._entries.get(fingerprint)
+            if entry is not None and now - entry[1] <= self.max_age:
+                self._stats["served"] += 1
+                return json.loads(json.dumps(entry[0]))
+            self._stats["missed"] += 1
+        return None
+
+    def flush(self):
+        """Write pending query counts to the log."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        with self._db_lock:
+            conn = self._connect()
+            conn.executemany(
+                "INSERT INTO query_log (fingerprint, day, query, hits) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (fingerprint, day) DO UPDATE SET hits = hits + excluded.hits, query = excluded.query",
+                [(fingerprint, day, query, hits) for (fingerprint, day), (query, hits) in pending.items()]
+            )
+            conn.commit()
+
+    def top_queries(self) -> List[Tuple[str, str, int]]:
+        """(fingerprint, query, hits) of the most requested queries in the log window."""
+        self.flush()
+        since = int(time.time() // DAY_SECONDS) - self.window_days
+        with self._db_lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM query_log WHERE day < ?", (since,))
+            conn.commit()
+            return conn.execute(
+                "SELECT fingerprint, MAX(query), SUM(hits) FROM query_log WHERE day >= ? "
+                "GROUP BY fingerprint HAVING SUM(hits) >= ? ORDER BY SUM(hits) DESC LIMIT ?",
+                (since, self.min_hits, self.top_n)
+            ).fetchall()
+
+    def load(self):
+        """Load stored results of the current prompt version; older versions are dropped."""
+        with self._db_lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM formulations WHERE version != ?", (self.version,))
+            conn.commit()
+            rows = conn.execute("SELECT fingerprint, result, refreshed_at FROM formulations").fetchall()
+        with self._lock:
+            self._entries = {fingerprint: (json.loads(result), refreshed_at)
+                             for fingerprint, result, refreshed_at in rows}
+
+    def _store(self, fingerprint: str, query: str, result: Dict[str, Any]):
+        refreshed_at = time.time()
+        with self._db_lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO formulations (fingerprint, query, version, result, refreshed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (fingerprint, query, self.version, json.dumps(result), refreshed_at)
+            )
+            conn.commit()
+        with self._lock:
+            self._entries[fingerprint] = (result, refreshed_at)
+
+    def _evict(self, keep: List[str]):
+        """Drop results for queries that fell out of the top list."""
+        with self._db_lock:
+            conn = self._connect()
+            rows = conn.execute("SELECT fingerprint FROM formulations").fetchall()
+            dropped = [fingerprint for (fingerprint,) in rows if fingerprint not in set(keep)]
+            conn.executemany("DELETE FROM formulations WHERE fingerprint = ?", [(f,) for f in dropped])
+            conn.commit()
+        with self._lock:
+            for fingerprint in dropped:
+                self._entries.pop(fingerprint, None)
+
+    def is_off_peak(self) -> bool:
+        return datetime.datetime.now().hour in self.refresh_hours
+
+    async def refresh(self, force: bool = False) -> int:
+        """
+        Recompute results for the top queries that are missing, from another
+        prompt version or older than the refresh interval. Outside off-peak
+        hours it stops early unless forced. Returns the number refreshed.
+        """
+        if self._producer is None or self._refreshing:
+            return 0
+        self._refreshing = True
+        refreshed = 0
+        endpoint_token = current_endpoint.set("warehouse")
+        tenant_token = current_tenant.set("warehouse")
+        try:
+            top = await asyncio.to_thread(self.top_queries)
+            await asyncio.to_thread(self._evict, [fingerprint for fingerprint, _, _ in top])
+            for fingerprint, query, _ in top:
+                if not force and not self.is_off_peak():
+                    break
+                with self._lock:
+                    entry = self._entries.get(fingerprint)
+                if entry is not None and time.time() - entry[1] < self.refresh_after:
+                    continue
+                usage = RequestUsage()
+                usage_token = current_usage.set(usage)
+                try:
+                    result = await self._producer(query)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"[WAREHOUSE REFRESH ERROR] {query!r}: {e}")
+                    self._stats["refresh_errors"] += 1
+                    continue
+                finally:
+                    current_usage.reset(usage_token)
+                # Results that contain fallbacks aren't worth serving to everyone
+                if usage.degraded or not result.get("ingredients"):
+                    self._stats["refresh_errors"] += 1
+                    continue
+                await asyncio.to_thread(self._store, fingerprint, query, result)
+                refreshed += 1
+            self._stats["refreshed"] += refreshed
+            self._stats["refresh_runs"] += 1
+            self._last_refresh = time.time()
+        finally:
+            current_tenant.reset(tenant_token)
+            current_endpoint.reset(endpoint_token)
+            self._refreshing = False
+        return refreshed
+
+    async def start(self):
+        if not self.enabled:
+            return
+        await asyncio.to_thread(self.load)
+        self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await asyncio.to_thread(self.flush)
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await asyncio.to_thread(self.flush)
+                if self.is_off_peak():
+                    await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[WAREHOUSE ERROR]: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            entries = len(self._entries)
+        lookups = stats["served"] + stats["missed"]
+        return {
+            "enabled": self.enabled,
+            **stats,
+            "served_ratio": round(stats["served"] / lookups, 4) if lookups else 0.0,
+            "entries": entries,
+            "version": self.version if self._producer is not None else None,
+            "refreshing": self._refreshing,
+            "off_peak": self.is_off_peak(),
+            "last_refresh": self._last_refresh,
+        }
+
+
+formulation_warehouse = FormulationWarehouse(
+    enabled=settings.warehouse_enabled,
+    db_path=settings.warehouse_db_path,
+    top_n=settings.warehouse_top_n,
+    min_hits=settings.warehouse_min_hits,
+    window_days=settings.warehouse_window_days,
+    refresh_hours=settings.warehouse_refresh_hours,
+    refresh_after=settings.warehouse_refresh_after_hours * 3600,
+    max_age=settings.warehouse_max_age_hours * 3600,
+    check_interval=settings.warehouse_check_interval_seconds,
+)
@@ -0,0 +1,324 @@
+from typing import Dict, Any, List, Optional, Tuple
+from app.models.ingredient import Ingredient
+import re
+import threading
+import numpy as np
+
+try:
+    from scipy import sparse
+except ImportError:  # scipy is optional, the NumPy path covers the same cases
+    sparse = None
+
+
+# Canonical name -> other names for the same ingredient (INCI names, common variants)
+SYNONYMS: Dict[str, List[str]] = {
+    "Aloe Vera": ["aloe barbadensis", "aloe barbadensis leaf juice", "aloe barbadensis leaf extract", "aloe"],
+    "Shea Butter": ["butyrospermum parkii", "butyrospermum parkii butter", "vitellaria paradoxa", "shea"],
+    "Cocoa Butter": ["theobroma cacao seed butter", "cacao butter"],
+    "Coconut Oil": ["cocos nucifera oil", "fractionated coconut oil"],
+    "Jojoba Oil": ["simmondsia chinensis seed oil", "jojoba"],
+    "Argan Oil": ["argania spinosa kernel oil"],
+    "Sweet Almond Oil": ["prunus amygdalus dulcis oil", "almond oil"],
+    "Rosehip Oil": ["rosa canina fruit oil", "rosa rubiginosa seed oil", "rosehip"],
+    "Tea Tree Oil": ["melaleuca alternifolia leaf oil", "tea tree"],
+    "Lavender Oil": ["lavandula angustifolia oil", "lavender"],
+    "Green Tea Extract": ["camellia sinensis leaf extract", "green tea"],
+    "Chamomile Extract": ["chamomilla recutita flower extract", "matricaria extract", "chamomile"],
+    "Calendula Extract": ["calendula officinalis flower extract", "calendula"],
+    "Witch Hazel": ["hamamelis virginiana", "hamamelis virginiana water"],
+    "Oat Extract": ["colloidal oatmeal", "avena sativa kernel extract", "oat"],
+    "Beeswax": ["cera alba", "white beeswax"],
+    "Glycerin": ["glycerol", "vegetable glycerin"],
+    "Hyaluronic Acid": ["sodium hyaluronate"],
+    "Vitamin E": ["tocopherol", "tocopheryl acetate", "mixed tocopherols"],
+    "Vitamin C": ["ascorbic acid", "l-ascorbic acid", "sodium ascorbyl phosphate"],
+    "Niacinamide": ["nicotinamide", "vitamin b3"],
+    "Panthenol": ["provitamin b5", "d-panthenol"],
+    "Squalane": ["olive squalane"],
+    "Zinc Oxide": ["non-nano zinc oxide"],
+    "Honey": ["mel", "raw honey"],
+}
+
+# Marketing qualifiers that don't change what the ingredient is
+QUALIFIERS = {"organic", "natural", "pure", "raw", "cold", "pressed", "cold-pressed", "virgin", "extra",
+              "unrefined", "refined", "certified", "premium", "wildcrafted", "100%", "food", "grade"}
+# Plant-part and preparation words, dropped only when comparing names
+FORM_WORDS = {"gel", "juice", "powder", "leaf", "leaves", "flower", "seed", "root", "fruit",
+              "kernel", "essential"}
+# Words that say what material an ingredient is: "Lavender Oil" and "Lavender Extract" are never merged
+IDENTITY_WORDS = {"oil", "extract", "butter"}
+# Dose and safety data describe one material, so merged ingredients keep them per alias instead of joined
+PER_ALIAS_ATTRIBUTES = ("concentration", "safety", "contraindications")
+
+NGRAM = 3
+SIMILARITY_THRESHOLD = 0.85
+# Membership lookups done per step when counting overlaps, bounding the temporary arrays
+OVERLAP_CHUNK = 1 << 20
+# Largest key x n-gram membership table built for overlap counting; beyond it lookups use binary search
+MAX_TABLE_CELLS = 1 << 26
+
+
+def _normalize(name: str) -> str:
+    text = re.sub(r"\([^)]*\)", " ", name.lower())
+    words = re.sub(r"[^a-z0-9%\- ]", " ", text).split()
+    return " ".join(word for word in words if word not in QUALIFIERS)
+
+
+def _compare_key(normalized: str) -> str:
+    words = [word for word in normalized.split() if word not in FORM_WORDS]
+    return " ".join(words) or normalized
+
+
+_ALIASES: Dict[str, str] = {}
+for _canonical, _names in SYNONYMS.items():
+    for _name in [_canonical] + _names:
+        _ALIASES[_normalize(_name)] = _canonical
+        _ALIASES[_compare_key(_normalize(_name))] = _canonical
+
+
+def canonical_name(name: str) -> Optional[str]:
+    """The synonym table's canonical name for an ingredient, including an INCI name in parentheses."""
+    normalized = _normalize(name)
+    for candidate in [normalized, _compare_key(normalized)] + [
+            _normalize(inner) for inner in re.findall(r"\(([^)]*)\)", name)]:
+        if candidate in _ALIASES:
+            return _ALIASES[candidate]
+    return None
+
+
+def _unique(values: np.ndarray) -> np.ndarray:
+    """Sorted distinct values; np.unique is several times slower for large integer arrays."""
+    if not len(values):
+        return values
+    ordered = np.sort(values)
+    return ordered[np.concatenate(([True], ordered[1:] != ordered[:-1]))]
+
+
+class _UnionFind:
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+
+    def find(self, item: int) -> int:
+        while self.parent[item] != item:
+            self.parent[item] = self.parent[self.parent[item]]
+            item = self.parent[item]
+        return item
+
+    def union(self, a: int, b: int):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            # Keep the earlier item as root so clusters keep their first position
+            self.parent[max(root_a, root_b)] = min(root_a, root_b)
+
+
+class IngredientDeduplicator:
+    """
+    Collapses near-duplicate ingredients: names are canonicalized through the
+    synonym table, then clustered by cosine similarity of character n-gram
+    vectors, and each cluster's attributes are merged into one ingredient.
+    """
+
+    def __init__(self, threshold: float = SIMILARITY_THRESHOLD):
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._stats = {"runs": 0, "ingredients_in": 0, "ingredients_out": 0,
+                       "synonym_merges": 0, "fuzzy_merges": 0}
+
+    def _ngrams(self, keys: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """(row, feature) pairs of the distinct padded character n-grams of each key."""
+        vocabulary: Dict[str, int] = {}
+        rows: List[int] = []
+        features: List[int] = []
+        for row, key in enumerate(keys):
+            padded = f"  {key} "
+            distinct = {padded[i:i + NGRAM] for i in range(len(padded) - NGRAM + 1)}
+            rows.extend([row] * len(distinct))
+            features.extend(vocabulary.setdefault(gram, len(vocabulary)) for gram in distinct)
+        return np.array(rows, dtype=np.int64), np.array(features, dtype=np.int64)
+
+    def similar_pairs(self, keys: List[str]) -> np.ndarray:
+        """Index pairs (i < j) of keys whose n-gram cosine similarity reaches the threshold."""
+        n = len(keys)
+        if n < 2:
+            return np.empty((0, 2), dtype=np.int64)
+        rows, features = self._ngrams(keys)
+        norms = np.sqrt(np.bincount(rows, minlength=n)).astype(np.float32)
+
+        if sparse is not None:
+            matrix = sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, features)),
+                                       shape=(n, int(features.max()) + 1))
+            shared = sparse.triu(matrix @ matrix.T, k=1).tocoo()
+            left, right, counts = shared.row, shared.col, shared.data
+        else:
+            left, right = self._candidate_pairs(rows, features, n)
+            counts = self._overlaps(rows, features, left, right)
+        similarity = counts / (norms[left] * norms[right])
+        keep = similarity >= self.threshold
+        return np.stack([left[keep], right[keep]], axis=1).astype(np.int64)
+
+    def _candidate_pairs(self, rows: np.ndarray, features: np.ndarray, n: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Prefix filtering: with n-grams ordered rarest first, two sets with
+        cosine >= t must share one of each other's first |x| - ceil(t^2 |x|) + 1
+        n-grams, so only those generate candidate pairs.
+        """
+        df = np.bincount(features)
+        # Sort by row, then by rarity within the row
+        order = np.lexsort((features, df[features], rows))
+        rows, features = rows[order], features[order]
+        sizes = np.bincount(rows, minlength=n)
+        row_starts = np.cumsum(sizes) - sizes
+        rank = np.arange(len(rows)) - row_starts[rows]
+        prefix = sizes - np.ceil(self.threshold ** 2 * sizes).astype(np.int64) + 1
+        keep = rank < prefix[rows]
+        rows, features = rows[keep], features[keep]
+
+        # Every prefix n-gram is paired with every other row that has it in its prefix
+        order = np.argsort(features, kind="stable")
+        rows, features = rows[order], features[order]
+        _, starts, counts = np.unique(features, return_index=True, return_counts=True)
+        group_sizes = np.repeat(counts, counts)
+        left = np.repeat(np.arange(len(rows)), group_sizes)
+        offsets = np.arange(len(left)) - np.repeat(np.cumsum(group_sizes) - group_sizes, group_sizes)
+        right = np.repeat(np.repeat(starts, counts), group_sizes) + offsets
+        a, b = rows[left], rows[right]
+        # Cosine >= t also needs t^2 <= |x| / |y| <= 1 / t^2
+        mask = (a < b) & (sizes[a] >= self.threshold ** 2 * sizes[b]) & (sizes[b] >= self.threshold ** 2 * sizes[a])
+        pair_ids = _unique(a[mask] * n + b[mask])
+        return pair_ids // n, pair_ids % n
+
+    def _overlaps(self, rows: np.ndarray, features: np.ndarray, left: np.ndarray, right: np.ndarray) -> np.ndarray:
+        """Exact number of n-grams each pair shares, by looking up one side's n-grams in the other's."""
+        if not len(left):
+            return np.empty(0, dtype=np.float32)
+        n = int(rows.max()) + 1
+        vocabulary_size = int(features.max()) + 1
+        order = np.argsort(rows, kind="stable")
+        rows, features = rows[order], features[order]
+        if n * vocabulary_size <= MAX_TABLE_CELLS:
+            table = np.zeros((n, vocabulary_size), dtype=bool)
+            table[rows, features] = True
+            contains = lambda r, f: table[r, f]
+        else:
+            codes = np.sort(rows * vocabulary_size + features)
+
+            def contains(r, f):
+                queries = r * vocabulary_size + f
+                return codes[np.minimum(np.searchsorted(codes, queries), len(codes) - 1)] == queries
+
+        sizes = np.bincount(rows, minlength=n)
+        row_starts = np.cumsum(sizes) - sizes
+        lengths = sizes[left]
+        # Pairs are processed in chunks of about OVERLAP_CHUNK lookups
+        ends = np.searchsorted(np.cumsum(lengths), np.arange(OVERLAP_CHUNK, lengths.sum() + OVERLAP_CHUNK, OVERLAP_CHUNK))
+        overlaps = np.empty(len(left), dtype=np.float32)
+        start = 0
+        for end in np.append(ends + 1, len(left)).tolist():
+            end = min(end, len(left))
+            if end <= start:
+                continue
+            chunk = lengths[start:end]
+            pair_index = np.repeat(np.arange(end - start), chunk)
+            offsets = np.arange(len(pair_index)) - np.repeat(np.cumsum(chunk) - chunk, chunk)
+            grams = features[row_starts[left[start:end]][pair_index] + offsets]
+            found = contains(right[start:end][pair_index], grams)
+            overlaps[start:end] = np.bincount(pair_index, weights=found, minlength=end - start)
+            start = end
+        return overlaps
+
+    def _compatible(self, key_a: str, key_b: str) -> bool:
+        words_a, words_b = set(key_a.split()), set(key_b.split())
+        # An oil and an extract of the same plant are different materials
+        identity_a, identity_b = words_a & IDENTITY_WORDS, words_b & IDENTITY_WORDS
+        if identity_a and identity_b and identity_a != identity_b:
+            return False
+        # "vitamin e" and "vitamin c" are close in n-grams but differ in a short, meaningful token
+        return not any(len(token) <= 2 for token in words_a ^ words_b)
+
+    def cluster(self, names: List[str]) -> List[int]:
+        """Cluster label per name (the index of the cluster's first member)."""
+        canonical = [canonical_name(name) for name in names]
+        keys = [_compare_key(_normalize(c or name)) for name, c in zip(names, canonical)]
+        clusters = _UnionFind(len(names))
+
+        first_by_key: Dict[str, int] = {}
+        synonym_merges = 0
+        for index, key in enumerate(keys):
+            if key in first_by_key:
+                clusters.union(first_by_key[key], index)
+                synonym_merges += int(canonical[index] is not None)
+            else:
+                first_by_key[key] = index
+
+        # Fuzzy matching runs on one representative per distinct key
+        representatives = list(first_by_key.values())
+        fuzzy_merges = 0
+        for i, j in self.similar_pairs([keys[r] for r in representatives]).tolist():
+            a, b = representatives[i], representatives[j]
+            if canonical[a] and canonical[b] and canonical[a] != canonical[b]:
+                continue
+            if not self._compatible(keys[a], keys[b]):
+                continue
+            if clusters.find(a) != clusters.find(b):
+                clusters.union(a, b)
+                fuzzy_merges += 1
+
+        with self._lock:
+            self._stats["synonym_merges"] += synonym_merges
+            self._stats["fuzzy_merges"] += fuzzy_merges
+        return [clusters.find(index) for index in range(len(names))]
+
+    def dedupe(self, ingredients: List[Ingredient]) -> List[Ingredient]:
+        """Merge near-duplicate ingredients, keeping the order of first appearance."""
+        if not ingredients:
+            return ingredients
+        labels = self.cluster([ingredient.name for ingredient in ingredients])
+        members: Dict[int, List[Ingredient]] = {}
+        for label, ingredient in zip(labels, ingredients):
+            members.setdefault(label, []).append(ingredient)
+        result = [self._merge(group) for group in members.values()]
+        with self._lock:
+            self._stats["runs"] += 1
+            self._stats["ingredients_in"] += len(ingredients)
+            self._stats["ingredients_out"] += len(result)
+        return result
+
+    def _merge(self, group: List[Ingredient]) -> Ingredient:
+        canonical = next((canonical_name(i.name) for i in group if canonical_name(i.name)), None)
+        if len(group) == 1 and canonical in (None, group[0].name):
+            return group[0]
+        name = canonical or min((i.name for i in group), key=lambda n: len(_normalize(n)))
+        attributes: Dict[str, Any] = {}
+        # Per-alias attributes of the other members, by member name
+        alias_attributes: Dict[str, Dict[str, Any]] = {}
+        for position, ingredient in enumerate(group):
+            for key, value in (ingredient.attributes or {}).items():
+                if value in (None, "", [], {}):
+                    continue
+                current = attributes.get(key)
+                if key in PER_ALIAS_ATTRIBUTES:
+                    # The first member's values describe the merged ingredient; the others' stay with their names
+                    if position == 0:
+                        attributes[key] = value
+                    elif value != attributes.get(key):
+                        alias_attributes.setdefault(ingredient.name, {})[key] = value
+                    continue
+                if current in (None, "", [], {}):
+                    attributes[key] = value
+                elif isinstance(current, str) and isinstance(value, str) and value.lower() not in current.lower():
+                    attributes[key] = f"{current}; {value}"
+        aliases = [i.name for i in group if i.name != name]
+        if aliases:
+            attributes["aliases"] = list(dict.fromkeys(aliases))
+        if alias_attributes:
+            attributes["alias_attributes"] = alias_attributes
+        return Ingredient(name=name, attributes=attributes)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["backend"] = "scipy.sparse" if sparse is not None else "numpy"
+        return stats
+
+
+ingredient_deduplicator = IngredientDeduplicator()
@@ -0,0 +1,304 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Callable, Awaitable, AsyncGenerator
+from app.core.config import settings
+from app.core.request_context import current_endpoint, llm_executor
+import asyncio
+import hashlib
+import httpx
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+
+
+JobHandler = Callable[[Dict[str, Any]], Awaitable[Any]]
+
+TERMINAL_STATUSES = ("completed", "failed")
+
+
+def callback_allowed(url: str) -> bool:
+    """Whether a webhook URL is http(s) and points at a host in the configured allowlist."""
+    parts = urlsplit(url)
+    host = (parts.hostname or "").lower()
+    if parts.scheme not in ("http", "https") or not host:
+        return False
+    for allowed in settings.job_callback_allowed_hosts:
+        allowed = allowed.lower()
+        if host == allowed.lstrip(".") or (allowed.startswith(".") and host.endswith(allowed)):
+            return True
+    return False
+
+
+class JobQueue:
+    """
+    Persistent SQLite-backed job queue with a bounded pool of local workers.
+    Jobs run by priority (higher first, then oldest), identical pending jobs
+    are deduplicated and finished results are kept for a TTL.
+    """
+
+    def __init__(self, db_path: str, workers: int, result_ttl: int, max_pending: int):
+        self.db_path = db_path
+        self.workers = workers
+        self.result_ttl = result_ttl
+        self.max_pending = max_pending
+        self._handlers: Dict[str, JobHandler] = {}
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self._watchers: Dict[str, List[asyncio.Queue]] = {}
+        # Dedicated threads for job LLM calls, separate from interactive requests
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def register(self, kind: str, handler: JobHandler):
+        """Register the coroutine that executes jobs of a given kind."""
+        self._handlers[kind] = handler
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    fingerprint TEXT NOT NULL,
+                    priority INTEGER NOT NULL DEFAULT 0,
+                    status TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    expires_at REAL
+                )
+            """)
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS jobs_pending ON jobs (status, priority DESC, created_at)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_fingerprint ON jobs (fingerprint, status)")
+            # One row per submitter's webhook, so deduplicated submissions keep their callbacks
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS job_callbacks (
+                    job_id TEXT NOT NULL,
+                    url TEXT NOT NULL,
+                    PRIMARY KEY (job_id, url)
+                )
+            """)
+        return self._conn
+
+    def _fingerprint(self, kind: str, payload: Dict[str, Any]) -> str:
+        canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(f"{kind}:{canonical}".encode("utf-8")).hexdigest()
+
+    def _to_dict(self, row: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            "job_id": row["id"],
+            "kind": row["kind"],
+            "status": row["status"],
+            "priority": row["priority"],
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "created_at": row["created_at"],
+            "started_at": row["started_at"],
+            "finished_at": row["finished_at"],
+            "expires_at": row["expires_at"],
+        }
+
+    async def start(self):
+        """Recover interrupted jobs and start the worker pool."""
+        with self._lock:
+            conn = self._connect()
+            # Jobs that were running when the process died go back to the queue
+            conn.execute("UPDATE jobs SET status = 'pending', started_at = NULL WHERE status = 'running'")
+        self._wakeup = asyncio.Event()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="job-llm")
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._purge_loop()))
+
+    async def stop(self):
+        """Stop the workers; running jobs are picked up again on next start."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    async def submit(self, kind: str, payload: Dict[str, Any], priority: int = 0,
+                     callback_url: Optional[str] = None) -> Dict[str, Any]:
+        """Queue a job, or return the identical job that is already pending or running."""
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        fingerprint = self._fingerprint(kind, payload)
+        with self._lock:
+            conn = self._connect()
+            existing = conn.execute(
+                "SELECT * FROM jobs WHERE fingerprint = ? AND status IN ('pending', 'running') LIMIT 1",
+                (fingerprint,)
+            ).fetchone()
+            if existing is not None:
+                if priority > existing["priority"]:
+                    conn.execute("UPDATE jobs SET priority = ? WHERE id = ?", (priority, existing["id"]))
+                self._add_callback(conn, existing["id"], callback_url)
+                return {**self._to_dict(existing), "deduplicated": True}
+            pending = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'pending'").fetchone()[0]
+            if pending >= self.max_pending:
+                raise OverflowError("Job queue is full, please retry later")
+            job_id = str(uuid.uuid4())
+            conn.execute(
+                "INSERT INTO jobs (id, kind, payload, fingerprint, priority, status, created_at) "
+                "VALUES (?, ?, ?, ?, ?, 'pending', ?)",
+                (job_id, kind, json.dumps(payload), fingerprint, priority, time.time())
+            )
+            self._add_callback(conn, job_id, callback_url)
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return {**self._to_dict(row), "deduplicated": False}
+
+    def _add_callback(self, conn: sqlite3.Connection, job_id: str, callback_url: Optional[str]):
+        if callback_url:
+            conn.execute("INSERT OR IGNORE INTO job_callbacks (job_id, url) VALUES (?, ?)", (job_id, callback_url))
+
+    def _callbacks(self, row: sqlite3.Row) -> List[str]:
+        with self._lock:
+            return [r[0] for r in self._connect().execute(
+                "SELECT url FROM job_callbacks WHERE job_id = ?", (row["id"],)).fetchall()]
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return a job, or None if it does not exist or its result has expired."""
+        with self._lock:
+            row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or (row["expires_at"] and row["expires_at"] < time.time()):
+            return None
+        return self._to_dict(row)
+
+    async def events(self, job_id: str, keepalive: float = 15.0) -> AsyncGenerator[Dict[str, Any], None]:
+        """Yield the job's current state and every status change until it finishes."""
+        queue: asyncio.Queue = asyncio.Queue()
+        self._watchers.setdefault(job_id, []).append(queue)
+        try:
+            job = self.get(job_id)
+            if job is None:
+                return
+            yield job
+            while job["status"] not in TERMINAL_STATUSES:
+                try:
+                    job = await asyncio.wait_for(queue.get(), timeout=keepalive)
+                except asyncio.TimeoutError:
+                    job = self.get(job_id)
+                    if job is None:
+                        return
+                yield job
+        finally:
+            watchers = self._watchers.get(job_id, [])
+            if queue in watchers:
+                watchers.remove(queue)
+            if not watchers:
+                self._watchers.pop(job_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """Job counts by status."""
+        with self._lock:
+            rows = self._connect().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = {row[0]: row[1] for row in rows}
+        return {"workers": self.workers, "max_pending": self.max_pending, "jobs": counts}
+
+    def _claim(self) -> Optional[sqlite3.Row]:
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = 'pending' ORDER BY priority DESC, created_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?", (time.time(), row["id"]))
+            return conn.execute("SELECT * FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+
+    def _finish(self, job_id: str, result: Any = None, error: Optional[str] = None) -> sqlite3.Row:
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, expires_at = ? WHERE id = ?",
+                ("failed" if error else "completed", json.dumps(result) if error is None else None,
+                 error, now, now + self.result_ttl, job_id)
+            )
+            return conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+
+    def _notify(self, row: sqlite3.Row):
+        job = self._to_dict(row)
+        for queue in self._watchers.get(job["job_id"], []):
+            queue.put_nowait(job)
+
+    async def _worker(self):
+        while True:
+            self._wakeup.clear()
+            row = self._claim()
+            if row is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=1.0)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._notify(row)
+            await self._run(row)
+
+    async def _run(self, row: sqlite3.Row):
+        handler = self._handlers.get(row["kind"])
+        endpoint_token = current_endpoint.set(f"job:{row['kind']}")
+        executor_token = llm_executor.set(self._executor)
+        try:
+            if handler is None:
+                raise ValueError(f"No handler registered for job kind: {row['kind']}")
+            result = await handler(json.loads(row["payload"]))
+            finished = self._finish(row["id"], result=result)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[JOB ERROR] {row['id']}: {e}")
+            finished = self._finish(row["id"], error=str(e))
+        finally:
+            llm_executor.reset(executor_token)
+            current_endpoint.reset(endpoint_token)
+        self._notify(finished)
+        job = self._to_dict(finished)
+        for url in self._callbacks(row):
+            await self._send_webhook(url, job)
+
+    async def _send_webhook(self, url: str, job: Dict[str, Any]):
+        # Checked again at send time: the allowlist may have changed since the job was queued
+        if not callback_allowed(url):
+            print(f"[JOB WEBHOOK ERROR] {job['job_id']} -> {url}: host not in JOB_CALLBACK_ALLOWED_HOSTS")
+            return
+        try:
+            async with httpx.AsyncClient(timeout=10.0) as client:
+                await client.post(url, json=job)
+        except Exception as e:
+            print(f"[JOB WEBHOOK ERROR] {job['job_id']} -> {url}: {e}")
+
+    async def _purge_loop(self):
+        while True:
+            await asyncio.sleep(60)
+            with self._lock:
+                conn = self._connect()
+                conn.execute(
+                    "DELETE FROM jobs WHERE expires_at IS NOT NULL AND expires_at < ?", (time.time(),))
+                conn.execute("DELETE FROM job_callbacks WHERE job_id NOT IN (SELECT id FROM jobs)")
+
+
+job_queue = JobQueue(
+    db_path=settings.job_db_path,
+    workers=settings.job_workers,
+    result_ttl=settings.job_result_ttl_seconds,
+    max_pending=settings.job_max_pending,
+)
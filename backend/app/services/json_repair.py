@@ -0,0 +1,130 @@
+from typing import Any, Optional
+import ast
+import json
+import re
+
+
+# Bump when the repair rules change what a model output parses to
+REPAIR_VERSION = 1
+
+_FENCE = re.compile(r"```(?:json|JSON)?")
+_TRAILING_COMMA = re.compile(r",(\s*[}\]])")
+_PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+
+def _first_json_span(text: str) -> Optional[str]:
+    """Return the first balanced {...} or [...] span, tolerating an unterminated tail."""
+    start = next((i for i, char in enumerate(text) if char in "{["), None)
+    if start is None:
+        return None
+    depth = 0
+    quote = None
+    escaped = False
+    for i in range(start, len(text)):
+        char = text[i]
+        if quote:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == quote:
+                quote = None
+            continue
+        if char in "\"'":
+            quote = char
+        elif char in "{[":
+            depth += 1
+        elif char in "}]":
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return text[start:]
+
+
+def _convert_quotes(text: str) -> str:
+    """Rewrite single-quoted strings as double-quoted ones and map Python literals outside strings."""
+    out = []
+    quote = None
+    escaped = False
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if quote:
+            if escaped:
+                escaped = False
+                out.append(char)
+            elif char == "\\":
+                escaped = True
+                out.append(char)
+            elif char == quote:
+                quote = None
+                out.append('"')
+            elif char == '"' and quote == "'":
+                out.append('\\"')
+            else:
+                out.append(char)
+            i += 1
+            continue
+        if char in "\"'":
+            quote = char
+            out.append('"')
+            i += 1
+            continue
+        match = re.match(r"True|False|None", text[i:])
+        if match and (i == 0 or not text[i - 1].isalnum()):
+            out.append(_PYTHON_LITERALS[match.group(0)])
+            i += len(match.group(0))
+            continue
+        out.append(char)
+        i += 1
+    return "".join(out)
+
+
+def repair_json(text: str) -> str:
+    """
+    Fix the common defects in model-produced JSON: code fences, surrounding
+    prose, trailing commas, single quotes and Python literals.
+    """
+    cleaned = _FENCE.sub("", text).strip()
+    span = _first_json_span(cleaned)
+    if span is None:
+        return cleaned
+    repaired = _TRAILING_COMMA.sub(r"\1", _convert_quotes(span))
+    # Close an object or array that was cut off mid-way
+    opened = []
+    in_string = False
+    escaped = False
+    for char in repaired:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            opened.append("}" if char == "{" else "]")
+        elif char in "}]" and opened:
+            opened.pop()
+    if in_string:
+        repaired += '"'
+    return _TRAILING_COMMA.sub(r"\1", repaired + "".join(reversed(opened)))
+
+
+def parse_json_lenient(text: str) -> Any:
+    """Parse JSON from model output, repairing common defects. Raises ValueError if that fails."""
+    try:
+        return json.loads(text)
+    except (json.JSONDecodeError, TypeError):
+        pass
+    repaired = repair_json(text or "")
+    try:
+        return json.loads(repaired)
+    except json.JSONDecodeError:
+        pass
+    try:
+        return ast.literal_eval(_first_json_span(_FENCE.sub("", text or "")) or "")
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        raise ValueError("Could not parse JSON from model output")
@@ -0,0 +1,99 @@
+from typing import Optional, Callable, Dict, Tuple
+
+
+# Lines the query reconstruction drops; they don't count towards a paragraph's length
+FILLER_PREFIXES = ("please", "additionally", "request", "kindly")
+
+
+class SentenceCutoff:
+    """Finds the end of the first sentence in streamed text."""
+
+    TERMINATORS = ".!?"
+    ABBREVIATIONS = ("e.g", "i.e", "vs", "approx", "etc", "dr", "mr", "mrs", "ms", "no")
+
+    def __init__(self):
+        self.text = ""
+
+    def feed(self, delta: str) -> Optional[int]:
+        start = max(len(self.text) - 1, 0)
+        self.text += delta
+        for i in range(start, len(self.text) - 1):
+            if self.text[i] in self.TERMINATORS and self.text[i + 1].isspace() and not self._is_abbreviation(i):
+                return i + 1
+        return None
+
+    def _is_abbreviation(self, index: int) -> bool:
+        if self.text[index] != ".":
+            return False
+        words = self.text[:index].split()
+        return bool(words) and words[-1].lower() in self.ABBREVIATIONS
+
+
+class ParagraphCutoff:
+    """Finds the end of the first paragraph (blank line or a line limit) in streamed text."""
+
+    def __init__(self, max_lines: int = 4, skip_prefixes: Tuple[str, ...] = FILLER_PREFIXES):
+        self.text = ""
+        self.max_lines = max_lines
+        self.skip_prefixes = skip_prefixes
+
+    def feed(self, delta: str) -> Optional[int]:
+        start = len(self.text)
+        self.text += delta
+        for i in range(start, len(self.text)):
+            if self.text[i] != "\n":
+                continue
+            head = self.text[:i]
+            lines = [line for line in head.split("\n")
+                     if line.strip() and not line.strip().lower().startswith(self.skip_prefixes)]
+            if not lines:
+                continue
+            if not head.split("\n")[-1].strip() or len(lines) >= self.max_lines:
+                return i
+        return None
+
+
+class JSONCutoff:
+    """Finds the end of the first complete top-level JSON object or array in streamed text."""
+
+    def __init__(self):
+        self.length = 0
+        self.depth = 0
+        self.started = False
+        self.in_string = False
+        self.escaped = False
+
+    def feed(self, delta: str) -> Optional[int]:
+        for offset, char in enumerate(delta):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+                continue
+            if char == '"' and self.started:
+                self.in_string = True
+            elif char in "{[":
+                self.started = True
+                self.depth += 1
+            elif char in "}]" and self.started:
+                self.depth -= 1
+                if self.depth == 0:
+                    return self.length + offset + 1
+        self.length += len(delta)
+        return None
+
+
+CUTOFF_MODES: Dict[str, Callable[[], object]] = {
+    "sentence": SentenceCutoff,
+    "paragraph": ParagraphCutoff,
+    "json": JSONCutoff,
+}
+
+
+def make_cutoff(mode: Optional[str]):
+    """Create a streaming cutoff detector for a mode, or None if the mode is unknown."""
+    factory = CUTOFF_MODES.get(mode or "")
+    return factory() if factory else None
@@ -0,0 +1,306 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Iterator, Tuple, Union
+from app.core.config import settings, ModelTier
+import threading
+import time
+
+
+class Completion:
+    """A finished chat completion, independent of the backend that produced it."""
+
+    __slots__ = ("content", "finish_reason", "prompt_tokens", "completion_tokens")
+
+    def __init__(self, content: str, finish_reason: Optional[str] = "stop",
+                 prompt_tokens: int = 0, completion_tokens: int = 0):
+        self.content = content
+        self.finish_reason = finish_reason
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+
+
+# One streamed content delta and the finish reason, once the backend reports one
+StreamChunk = Tuple[str, Optional[str]]
+
+
+def _estimate_tokens(text: str) -> int:
+    # ~4 characters per token, used where a backend reports no usage
+    return len(text) // 4
+
+
+class LLMProvider:
+    """
+    A backend that runs chat completions. `complete` and `stream` take the
+    OpenAI request arguments (model, temperature, max_tokens, stop, timeout,
+    response_format); backends ignore the ones they don't support.
+    """
+
+    # Whether concurrent requests gain anything from being sent together
+    supports_batching = False
+
+    def complete(self, messages: List[Dict[str, str]], **kwargs) -> Completion:
+        raise NotImplementedError
+
+    def stream(self, messages: List[Dict[str, str]], **kwargs) -> Iterator[StreamChunk]:
+        """Yield content deltas. Closing the generator closes the upstream response."""
+        completion = self.complete(messages, **kwargs)
+        yield completion.content, completion.finish_reason
+
+    def complete_batch(self, requests: List[Tuple[List[Dict[str, str]], Dict[str, Any]]]
+                       ) -> List[Union[Completion, Exception]]:
+        """Run several requests; a failed request yields its exception instead of a completion."""
+        results: List[Union[Completion, Exception]] = []
+        for messages, kwargs in requests:
+            try:
+                results.append(self.complete(messages, **kwargs))
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+class OpenAIProvider(LLMProvider):
+    """The OpenAI API, or any OpenAI-compatible server (llama.cpp server, vLLM) via `base_url`."""
+
+    def __init__(self, api_key: str, base_url: Optional[str] = None, batch_size: int = 8):
+        from openai import OpenAI
+        self.client = OpenAI(api_key=api_key, base_url=base_url)
+        # A local server batches the requests it has in flight, so a batch is sent concurrently
+        self.supports_batching = base_url is not None
+        self._pool = ThreadPoolExecutor(max_workers=batch_size, thread_name_prefix="llm-batch")
+
+    def complete(self, messages: List[Dict[str, str]], **kwargs) -> Completion:
+        response = self.client.chat.completions.create(messages=messages, **kwargs)
+        usage = getattr(response, "usage", None)
+        return Completion(
+            content=response.choices[0].message.content or "",
+            finish_reason=response.choices[0].finish_reason,
+            prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+            completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+        )
+
+    def stream(self, messages: List[Dict[str, str]], **kwargs) -> Iterator[StreamChunk]:
+        response = self.client.chat.completions.create(messages=messages, stream=True, **kwargs)
+        try:
+            for chunk in response:
+                if chunk.choices:
+                    yield chunk.choices[0].delta.content or "", chunk.choices[0].finish_reason
+        finally:
+            response.close()
+
+    def complete_batch(self, requests: List[Tuple[List[Dict[str, str]], Dict[str, Any]]]
+                       ) -> List[Union[Completion, Exception]]:
+        futures = [self._pool.submit(self.complete, messages, **kwargs) for messages, kwargs in requests]
+        results: List[Union[Completion, Exception]] = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+class LlamaCppProvider(LLMProvider):
+    """
+    A small GGUF model run in-process on the CPU with llama-cpp-python, an
+    optional dependency imported on first use. Tier options: model_path,
+    n_ctx (default 2048) and n_threads.
+    """
+
+    # One model instance runs one generation at a time, so a batch would only add the batching window
+    supports_batching = False
+
+    def __init__(self, options: Dict[str, Any]):
+        try:
+            from llama_cpp import Llama
+        except ImportError:
+            raise RuntimeError("The llama_cpp backend needs llama-cpp-python: pip install llama-cpp-python")
+        if not options.get("model_path"):
+            raise ValueError("The llama_cpp backend needs a model_path option")
+        self.model = Llama(
+            model_path=options["model_path"],
+            n_ctx=int(options.get("n_ctx", 2048)),
+            n_threads=options.get("n_threads"),
+            verbose=False,
+        )
+        # A Llama instance isn't thread-safe; a batch runs back to back under one acquisition
+        self._lock = threading.Lock()
+
+    def _arguments(self, kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        arguments = {key: kwargs[key] for key in ("temperature", "max_tokens", "stop") if key in kwargs}
+        response_format = kwargs.get("response_format")
+        if response_format and response_format.get("type") == "json_schema":
+            # llama.cpp constrains output with a grammar built from the schema
+            arguments["response_format"] = {"type": "json_object",
+                                            "schema": response_format["json_schema"]["schema"]}
+        return arguments
+
+    def _complete_locked(self, messages: List[Dict[str, str]], **kwargs) -> Completion:
+        response = self.model.create_chat_completion(messages=messages, **self._arguments(kwargs))
+        usage = response.get("usage") or {}
+        return Completion(
+            content=response["choices"][0]["message"].get("content") or "",
+            finish_reason=response["choices"][0].get("finish_reason"),
+            prompt_tokens=usage.get("prompt_tokens", 0),
+            completion_tokens=usage.get("completion_tokens", 0),
+        )
+
+    def complete(self, messages: List[Dict[str, str]], **kwargs) -> Completion:
+        with self._lock:
+            return self._complete_locked(messages, **kwargs)
+
+    def stream(self, messages: List[Dict[str, str]], **kwargs) -> Iterator[StreamChunk]:
+        with self._lock:
+            for chunk in self.model.create_chat_completion(messages=messages, stream=True, **self._arguments(kwargs)):
+                choice = chunk["choices"][0]
+                yield choice.get("delta", {}).get("content") or "", choice.get("finish_reason")
+
+
+class StubProvider(LLMProvider):
+    """
+    Canned answers after a fixed latency, for running the pipeline and
+    measuring throughput without a network or a model. JSON call sites get
+    "{}" (every structured output model has defaults). Tier options:
+    latency_ms (default 50) and reply.
+    """
+
+    supports_batching = True
+
+    def __init__(self, options: Dict[str, Any]):
+        self.latency = float(options.get("latency_ms", 50)) / 1000
+        self.reply = str(options.get("reply", "This is a stub response."))
+
+    def _answer(self, messages: List[Dict[str, str]], kwargs: Dict[str, Any]) -> Completion:
+        content = "{}" if kwargs.get("response_format") else self.reply
+        prompt = "".join(m.get("content") or "" for m in messages)
+        return Completion(content, "stop", _estimate_tokens(prompt), max(_estimate_tokens(content), 1))
+
+    def complete(self, messages: List[Dict[str, str]], **kwargs) -> Completion:
+        time.sleep(self.latency)
+        return self._answer(messages, kwargs)
+
+    def stream(self, messages: List[Dict[str, str]], **kwargs) -> Iterator[StreamChunk]:
+        time.sleep(self.latency)
+        words = self._answer(messages, kwargs).content.split(" ")
+        for i, word in enumerate(words):
+            last = i == len(words) - 1
+            yield (word if last else word + " "), ("stop" if last else None)
+
+    def complete_batch(self, requests: List[Tuple[List[Dict[str, str]], Dict[str, Any]]]
+                       ) -> List[Union[Completion, Exception]]:
+        # Models a batching server: the whole batch costs one latency
+        time.sleep(self.latency)
+        return [self._answer(messages, kwargs) for messages, kwargs in requests]
+
+
+class _Pending:
+    __slots__ = ("messages", "kwargs", "result", "error", "finished", "leader", "event")
+
+    def __init__(self, messages: List[Dict[str, str]], kwargs: Dict[str, Any]):
+        self.messages = messages
+        self.kwargs = kwargs
+        self.result: Optional[Completion] = None
+        self.error: Optional[Exception] = None
+        self.finished = False
+        self.leader = False
+        self.event = threading.Event()
+
+
+class MicroBatcher(LLMProvider):
+    """
+    Groups concurrent non-streaming requests to one provider into batches.
+    The first caller waits up to `window` seconds for others (or until the
+    batch is full) and runs the batch for everyone; callers arriving while a
+    batch runs form the next one.
+    """
+
+    def __init__(self, provider: LLMProvider, window: float, max_size: int):
+        self.provider = provider
+        self.window = window
+        self.max_size = max(max_size, 1)
+        self._cond = threading.Condition()
+        self._queue: List[_Pending] = []
+        self._leader_active = False
+        self._batches = 0
+        self._batched_requests = 0
+
+    def complete(self, messages: List[Dict[str, str]], **kwargs) -> Completion:
+        item = _Pending(messages, kwargs)
+        with self._cond:
+            self._queue.append(item)
+            if self._leader_active:
+                self._cond.notify_all()
+            else:
+                self._leader_active = True
+                item.leader = True
+        while not item.finished:
+            if item.leader:
+                item.leader = False
+                self._lead()
+            else:
+                item.event.wait()
+                item.event.clear()
+        if item.error is not None:
+            raise item.error
+        return item.result
+
+    def _lead(self):
+        deadline = time.monotonic() + self.window
+        with self._cond:
+            while len(self._queue) < self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._queue[:self.max_size]
+            del self._queue[:self.max_size]
+            if self._queue:
+                # Hand collection of the next batch to the oldest waiting request
+                self._queue[0].leader = True
+                self._queue[0].event.set()
+            else:
+                self._leader_active = False
+            self._batches += 1
+            self._batched_requests += len(batch)
+
+        try:
+            results = self.provider.complete_batch([(item.messages, item.kwargs) for item in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+        for item, result in zip(batch, results):
+            if isinstance(result, Exception):
+                item.error = result
+            else:
+                item.result = result
+            item.finished = True
+            item.event.set()
+
+    def stream(self, messages: List[Dict[str, str]], **kwargs) -> Iterator[StreamChunk]:
+        return self.provider.stream(messages, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "batches": self._batches,
+                "requests": self._batched_requests,
+                "avg_batch_size": round(self._batched_requests / self._batches, 2) if self._batches else 0.0,
+            }
+
+
+def make_provider(tier: ModelTier, backend: str) -> LLMProvider:
+    """Build the provider for a tier, wrapped in a micro-batcher when batching helps it."""
+    if backend == "stub":
+        provider: LLMProvider = StubProvider(tier.options)
+    elif backend == "llama_cpp":
+        provider = LlamaCppProvider(tier.options)
+    elif backend == "local":
+        provider = OpenAIProvider(tier.api_key or "local", tier.base_url or "http://localhost:8080/v1",
+                                  settings.llm_batch_max_size)
+    elif backend == "openai":
+        api_key = tier.api_key or settings.openai_api_key
+        if not api_key:
+            raise ValueError("OpenAI API key is not configured. Please set OPENAI_API_KEY environment variable.")
+        provider = OpenAIProvider(api_key, tier.base_url, settings.llm_batch_max_size)
+    else:
+        raise ValueError(f"Unknown LLM backend '{backend}'")
+    if settings.llm_batching and tier.batch and provider.supports_batching:
+        return MicroBatcher(provider, settings.llm_batch_window_ms / 1000, settings.llm_batch_max_size)
+    return provider
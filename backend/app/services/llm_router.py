@@ -0,0 +1,454 @@
+from pydantic import BaseModel
+from typing import Dict, Any, List, Optional, Callable, Iterator, Tuple, Type, TypeVar
+from collections import deque
+from app.core.config import settings, ModelTier, CallSiteRoute
+from app.core.deadlines import DeadlineExceeded
+from app.core.request_context import (
+    current_endpoint, current_tenant, current_usage, llm_cancel, llm_executor, remaining_budget,
+)
+from app.services.json_repair import parse_json_lenient
+from app.services.llm_cutoff import make_cutoff
+from app.services.llm_providers import LLMProvider, MicroBatcher, make_provider
+from app.services.usage_accounting import current_reservation, usage_accountant
+import asyncio
+import contextvars
+import functools
+import threading
+import json
+import time
+
+
+ModelT = TypeVar("ModelT", bound=BaseModel)
+
+
+class StructuredOutputError(ValueError):
+    """Raised when a JSON call site's output can't be parsed, even after repair and retries."""
+
+    def __init__(self, call_site: str, content: str):
+        super().__init__(f"Unparseable JSON from {call_site}")
+        self.call_site = call_site
+        self.content = content
+
+
+class LLMCallCancelled(Exception):
+    """Raised in the worker thread when a call's llm_cancel event is set while it streams."""
+
+    def __init__(self, call_site: str):
+        super().__init__(f"{call_site} was cancelled")
+        self.call_site = call_site
+
+
+class _Stats:
+    """Latency, token and cost counters for one tier or call site."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+        self.total_latency = 0.0
+        self.latencies = deque(maxlen=512)
+
+    def record(self, latency: float, prompt_tokens: int, completion_tokens: int, cost: float, error: bool):
+        self.calls += 1
+        self.errors += int(error)
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.cost += cost
+        self.total_latency += latency
+        self.latencies.append(latency)
+
+    def expected_latency(self) -> Optional[float]:
+        """p95 latency in seconds once there are enough samples to trust it."""
+        if len(self.latencies) < 5:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(int(0.95 * len(ordered)), len(ordered) - 1)]
+
+    def snapshot(self) -> Dict[str, Any]:
+        ordered = sorted(self.latencies)
+
+        def pct(p: float) -> float:
+            if not ordered:
+                return 0.0
+            return round(ordered[min(int(p * len(ordered)), len(ordered) - 1)] * 1000, 1)
+
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "avg_latency_ms": round(self.total_latency / self.calls * 1000, 1) if self.calls else 0.0,
+            "p50_latency_ms": pct(0.5),
+            "p95_latency_ms": pct(0.95),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "estimated_cost_usd": round(self.cost, 6),
+        }
+
+
+class _OutputStats:
+    """Output-length counters for one endpoint."""
+
+    def __init__(self):
+        self.completions = 0
+        self.completion_tokens = 0
+        self.early_cutoffs = 0
+        self.max_tokens_truncations = 0
+        # Estimate: max_tokens minus the tokens received, summed over early cutoffs
+        self.tokens_saved_upper_bound = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "completions": self.completions,
+            "completion_tokens": self.completion_tokens,
+            "early_cutoffs": self.early_cutoffs,
+            "max_tokens_truncations": self.max_tokens_truncations,
+            "tokens_saved_upper_bound": self.tokens_saved_upper_bound,
+        }
+
+
+class LLMRouter:
+    """
+    Routes each LLM call site to a model tier configured in settings.
+    Tiers decide model, backend, timeout and pricing; call sites decide
+    tier, max_tokens, stop sequences and an optional streaming cutoff.
+    Records per-tier and per-call-site metrics, and output budgets per endpoint.
+    """
+
+    def __init__(self):
+        self._providers: Dict[str, LLMProvider] = {}
+        self._lock = threading.Lock()
+        self._tier_stats: Dict[str, _Stats] = {}
+        self._site_stats: Dict[str, _Stats] = {}
+        self._endpoint_stats: Dict[str, _OutputStats] = {}
+        self._parse_stats: Dict[str, Dict[str, int]] = {}
+        self._schemas: Dict[type, Dict[str, Any]] = {}
+        self._degraded: Dict[str, int] = {}
+
+    def route_for(self, call_site: str) -> Tuple[str, CallSiteRoute, ModelTier]:
+        """Resolve the routing rule and tier for a call site."""
+        route = settings.llm_routes.get(call_site) or CallSiteRoute(tier=settings.llm_default_tier)
+        tier_name = route.tier if route.tier in settings.llm_tiers else settings.llm_default_tier
+        return tier_name, route, settings.llm_tiers[tier_name]
+
+    def backend_for(self, tier: ModelTier) -> str:
+        """The backend a tier runs on, after the global LLM_BACKEND override."""
+        if tier.backend == "heuristic":
+            return "heuristic"
+        return settings.llm_backend or tier.backend
+
+    def _provider_for(self, tier_name: str, tier: ModelTier) -> LLMProvider:
+        provider = self._providers.get(tier_name)
+        if provider is not None:
+            return provider
+        # Built outside the lock: a llama_cpp provider loads its model, and metrics writes share the lock
+        provider = make_provider(tier, self.backend_for(tier))
+        with self._lock:
+            # Another thread may have built the tier's provider meanwhile; keep the first one
+            return self._providers.setdefault(tier_name, provider)
+
+    def _request_kwargs(self, route: CallSiteRoute, tier: ModelTier, temperature: float,
+                        response_format: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        timeout = route.timeout or tier.timeout
+        remaining = remaining_budget()
+        if remaining is not None:
+            # Never wait on a call past the request's deadline
+            timeout = max(min(timeout, remaining), 0.001)
+        kwargs: Dict[str, Any] = {
+            "model": tier.model,
+            "temperature": temperature,
+            "timeout": timeout,
+        }
+        if route.max_tokens:
+            kwargs["max_tokens"] = route.max_tokens
+        if route.stop:
+            kwargs["stop"] = route.stop
+        if response_format and tier.structured_output:
+            kwargs["response_format"] = response_format
+        return kwargs
+
+    def expected_latency(self, call_site: str) -> Optional[float]:
+        """Recent p95 latency of a call site, or None while there is too little data."""
+        with self._lock:
+            stats = self._site_stats.get(call_site)
+            return stats.expected_latency() if stats is not None else None
+
+    def can_afford(self, call_site: str) -> bool:
+        """Whether the current request's remaining budget covers the call site's expected latency."""
+        remaining = remaining_budget()
+        if remaining is None:
+            return True
+        expected = self.expected_latency(call_site)
+        return remaining > 0 and (expected is None or expected <= remaining)
+
+    def _degrade(self, call_site: str, heuristic: Optional[Callable[[], str]]) -> str:
+        """Answer with the heuristic, or raise DeadlineExceeded, when the budget can't cover a call."""
+        with self._lock:
+            self._degraded[call_site] = self._degraded.get(call_site, 0) + 1
+        usage = current_usage.get()
+        if usage is not None:
+            usage.degraded_calls += 1
+        if heuristic is not None:
+            return heuristic()
+        remaining = remaining_budget() or 0.0
+        raise DeadlineExceeded(f"Not enough time left for {call_site} ({max(remaining, 0):.2f}s remaining)")
+
+    def _record_output(self, completion_tokens: int, cut_off: bool = False,
+                       truncated: bool = False, tokens_saved: int = 0):
+        with self._lock:
+            stats = self._endpoint_stats.setdefault(current_endpoint.get(), _OutputStats())
+            stats.completions += 1
+            stats.completion_tokens += completion_tokens
+            stats.early_cutoffs += int(cut_off)
+            stats.max_tokens_truncations += int(truncated)
+            stats.tokens_saved_upper_bound += tokens_saved
+
+    def _record(self, tier_name: str, tier: ModelTier, call_site: str, started: float,
+                prompt_tokens: int = 0, completion_tokens: int = 0, error: bool = False):
+        latency = time.perf_counter() - started
+        usage = current_usage.get()
+        if usage is not None:
+            usage.llm_errors += int(error)
+            usage.prompt_tokens += prompt_tokens
+            usage.completion_tokens += completion_tokens
+        if prompt_tokens or completion_tokens:
+            usage_accountant.record(current_tenant.get(), current_endpoint.get(), call_site,
+                                    prompt_tokens, completion_tokens, current_reservation.get())
+        cost = (prompt_tokens * tier.prompt_cost_per_1k + completion_tokens * tier.completion_cost_per_1k) / 1000
+        with self._lock:
+            self._tier_stats.setdefault(tier_name, _Stats()).record(
+                latency, prompt_tokens, completion_tokens, cost, error)
+            self._site_stats.setdefault(call_site, _Stats()).record(
+                latency, prompt_tokens, completion_tokens, cost, error)
+
+    def _complete_sync(self, call_site: str, messages: List[Dict[str, str]], temperature: float,
+                       heuristic: Optional[Callable[[], str]],
+                       response_format: Optional[Dict[str, Any]] = None) -> str:
+        tier_name, route, tier = self.route_for(call_site)
+        usage = current_usage.get()
+        if usage is not None:
+            usage.observe_call(temperature)
+        if self.backend_for(tier) == "heuristic":
+            if heuristic is not None:
+                started = time.perf_counter()
+                answer = heuristic()
+                self._record(tier_name, tier, call_site, started)
+                return answer
+            # No local answer for this call site, fall back to the default tier
+            tier_name = settings.llm_default_tier
+            tier = settings.llm_tiers[tier_name]
+
+        provider = self._provider_for(tier_name, tier)
+        # Batched backends can't end one request early; they are trimmed to the cutoff below instead
+        batched = isinstance(provider, MicroBatcher)
+        # Calls that may be abandoned are always streamed, so they can be stopped between chunks
+        if (settings.llm_early_cutoff and route.cutoff and not batched) or llm_cancel.get() is not None:
+            return self._complete_with_cutoff(call_site, tier_name, route, tier, messages, temperature,
+                                              response_format)
+
+        started = time.perf_counter()
+        try:
+            completion = provider.complete(
+                messages, **self._request_kwargs(route, tier, temperature, response_format))
+        except Exception:
+            self._record(tier_name, tier, call_site, started, error=True)
+            raise
+        self._record(
+            tier_name, tier, call_site, started,
+            prompt_tokens=completion.prompt_tokens,
+            completion_tokens=completion.completion_tokens
+        )
+        self._record_output(completion.completion_tokens, truncated=completion.finish_reason == "length")
+        cutoff = make_cutoff(route.cutoff) if settings.llm_early_cutoff and route.cutoff else None
+        cut_at = cutoff.feed(completion.content) if cutoff else None
+        return completion.content[:cut_at] if cut_at is not None else completion.content
+
+    def _complete_with_cutoff(self, call_site: str, tier_name: str, route: CallSiteRoute, tier: ModelTier,
+                              messages: List[Dict[str, str]], temperature: float,
+                              response_format: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Stream the completion and close the upstream connection as soon as the
+        call site's cutoff has what its post-processing keeps, or as soon as the
+        llm_cancel event is set (raising LLMCallCancelled).
+        """
+        cutoff = make_cutoff(route.cutoff) if settings.llm_early_cutoff else None
+        cancel = llm_cancel.get()
+        started = time.perf_counter()
+        parts: List[str] = []
+        received = 0
+        cut_at = None
+        finish_reason = None
+        try:
+            response = self._provider_for(tier_name, tier).stream(
+                messages, **self._request_kwargs(route, tier, temperature, response_format))
+            try:
+                for delta, chunk_finish_reason in response:
+                    if cancel is not None and cancel.is_set():
+                        raise LLMCallCancelled(call_site)
+                    finish_reason = chunk_finish_reason or finish_reason
+                    if not delta:
+                        continue
+                    received += 1
+                    parts.append(delta)
+                    cut_at = cutoff.feed(delta) if cutoff else None
+                    if cut_at is not None:
+                        break
+            finally:
+                response.close()
+        except LLMCallCancelled:
+            self._record(tier_name, tier, call_site, started, completion_tokens=received)
+            raise
+        except Exception:
+            self._record(tier_name, tier, call_site, started, error=True)
+            raise
+
+        # Streamed responses carry no usage: count one token per content delta
+        # and estimate prompt tokens at ~4 characters per token
+        prompt_chars = sum(len(m.get("content") or "") for m in messages)
+        self._record(tier_name, tier, call_site, started,
+                     prompt_tokens=prompt_chars // 4, completion_tokens=received)
+        cut_off = cut_at is not None and finish_reason is None
+        self._record_output(
+            received,
+            cut_off=cut_off,
+            truncated=finish_reason == "length",
+            # At most the rest of the call site's budget; the model may have stopped sooner on its own
+            tokens_saved=max((route.max_tokens or received) - received, 0) if cut_off else 0
+        )
+        text = "".join(parts)
+        return text[:cut_at] if cut_at is not None else text
+
+    async def complete(
+        self,
+        call_site: str,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.7,
+        heuristic: Optional[Callable[[], str]] = None,
+        response_format: Optional[Dict[str, Any]] = None
+    ) -> str:
+        """
+        Run a chat completion for a call site and return the message content.
+        `heuristic` answers the call locally when the call site is routed to a
+        heuristic tier, or when the request's deadline can't cover the call.
+        Raises DeadlineExceeded when the deadline can't cover it and there is
+        no heuristic.
+        """
+        if not self.can_afford(call_site):
+            return self._degrade(call_site, heuristic)
+        call = functools.partial(self._complete_sync, call_site, messages, temperature, heuristic, response_format)
+        executor = llm_executor.get()
+        if executor is None:
+            return await asyncio.to_thread(call)
+        return await asyncio.get_running_loop().run_in_executor(
+            executor, functools.partial(contextvars.copy_context().run, call))
+
+    async def complete_json(
+        self,
+        call_site: str,
+        messages: List[Dict[str, str]],
+        schema: Type[ModelT],
+        temperature: float = 0.7,
+        heuristic: Optional[Callable[[], str]] = None
+    ) -> ModelT:
+        """
+        Run a JSON-producing call site with a JSON-schema response format built
+        from `schema`. Output that doesn't parse is repaired locally first and
+        only re-requested if repair fails. Raises StructuredOutputError when
+        every attempt fails.
+        """
+        response_format = {
+            "type": "json_schema",
+            "json_schema": {"name": schema.__name__, "schema": self._schema_for(schema), "strict": False},
+        }
+        attempts = 1 + max(settings.llm_json_retries, 0)
+        content = ""
+        for attempt in range(attempts):
+            content = await self.complete(call_site, messages, temperature, heuristic, response_format)
+            try:
+                parsed = schema.model_validate(json.loads(content))
+                self._record_parse(call_site, "parsed")
+                return parsed
+            except ValueError:
+                self._record_parse(call_site, "parse_failures")
+            try:
+                parsed = schema.model_validate(parse_json_lenient(content))
+                self._record_parse(call_site, "repaired")
+                return parsed
+            except ValueError:
+                if attempt + 1 < attempts:
+                    if not self.can_afford(call_site):
+                        # No time for another round trip
+                        break
+                    self._record_parse(call_site, "retries")
+        self._record_parse(call_site, "failed")
+        raise StructuredOutputError(call_site, content)
+
+    def _schema_for(self, schema: type) -> Dict[str, Any]:
+        if schema not in self._schemas:
+            self._schemas[schema] = schema.model_json_schema()
+        return self._schemas[schema]
+
+    def _record_parse(self, call_site: str, outcome: str):
+        with self._lock:
+            stats = self._parse_stats.setdefault(
+                call_site, {"parsed": 0, "parse_failures": 0, "repaired": 0, "retries": 0, "failed": 0})
+            stats[outcome] += 1
+
+    def stream(self, call_site: str, messages: List[Dict[str, str]], temperature: float = 0.7) -> Iterator[str]:
+        """Stream a chat completion for a call site, yielding content deltas."""
+        if not self.can_afford(call_site):
+            self._degrade(call_site, None)
+        tier_name, route, tier = self.route_for(call_site)
+        usage = current_usage.get()
+        if usage is not None:
+            usage.observe_call(temperature)
+        if self.backend_for(tier) == "heuristic":
+            tier_name = settings.llm_default_tier
+            tier = settings.llm_tiers[tier_name]
+        started = time.perf_counter()
+        completion_chunks = 0
+        try:
+            for delta, _ in self._provider_for(tier_name, tier).stream(
+                    messages, **self._request_kwargs(route, tier, temperature)):
+                if delta:
+                    completion_chunks += 1
+                    yield delta
+        except Exception:
+            self._record(tier_name, tier, call_site, started, error=True)
+            raise
+        # Streamed responses carry no usage, count one token per content delta
+        self._record(tier_name, tier, call_site, started, completion_tokens=completion_chunks)
+        self._record_output(completion_chunks)
+
+    def metrics(self) -> Dict[str, Any]:
+        """Snapshot of per-tier and per-call-site metrics."""
+        with self._lock:
+            return {
+                "tiers": {name: stats.snapshot() for name, stats in self._tier_stats.items()},
+                "call_sites": {name: stats.snapshot() for name, stats in self._site_stats.items()},
+                "routes": {site: self._describe_route(site) for site in settings.llm_routes},
+                "degraded": dict(self._degraded),
+                "batching": {name: provider.stats() for name, provider in self._providers.items()
+                             if isinstance(provider, MicroBatcher)},
+            }
+
+    def parse_metrics(self) -> Dict[str, Any]:
+        """
+        JSON parse outcomes per call site: clean parses, parse failures, local
+        repairs, extra round trips and unrecoverable outputs.
+        """
+        with self._lock:
+            return {call_site: dict(stats) for call_site, stats in self._parse_stats.items()}
+
+    def output_metrics(self) -> Dict[str, Any]:
+        """Snapshot of completion tokens, early cutoffs, max_tokens truncations and tokens saved per endpoint."""
+        with self._lock:
+            return {endpoint: stats.snapshot() for endpoint, stats in self._endpoint_stats.items()}
+
+    def _describe_route(self, call_site: str) -> Dict[str, Any]:
+        tier_name, route, tier = self.route_for(call_site)
+        return {"tier": tier_name, "model": tier.model, "backend": self.backend_for(tier),
+                "max_tokens": route.max_tokens, "stop": route.stop, "cutoff": route.cutoff}
+
+
+llm_router = LLMRouter()
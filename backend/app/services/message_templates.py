@@ -0,0 +1,155 @@
+from typing import Dict, Any, List, Optional
+from string import Formatter
+import re
+import threading
+
+
+# Keywords that map free-form analysis keys and missing-info notes onto the four
+# dimensions, checked in this order so e.g. "skin type" isn't read as a product type
+DIMENSION_KEYWORDS: Dict[str, List[str]] = {
+    "special_ingredients": ["ingredients?", "actives?", "extracts?", "avoid"],
+    "target_audience": ["audience", "target", "users?", "customers?", "skin type", "age", "age group", "demographics?"],
+    "achievement_goal": ["goals?", "benefits?", "achieve", "achievement", "purpose", "results?", "effects?", "concerns?"],
+    "product_type": ["product", "products", "product type", "format"],
+}
+DIMENSIONS = ["product_type", "achievement_goal", "target_audience", "special_ingredients"]
+_DIMENSION_PATTERNS = {
+    dimension: re.compile(r"\b(?:" + "|".join(keywords) + r")\b")
+    for dimension, keywords in DIMENSION_KEYWORDS.items()
+}
+
+# Question phrase banks per dimension. A template is only used when every field
+# it references is known, so the more specific variants come first.
+QUESTION_TEMPLATES: Dict[str, List[str]] = {
+    "product_type": [
+        "Since you're aiming for {achievement_goal}, what kind of product should this be, for example a cream, serum or snack bar?",
+        "For {target_audience}, what kind of product do you have in mind?",
+        "What kind of product would you like to create, for example a cream, serum, drink or snack?",
+    ],
+    "achievement_goal": [
+        "What should your {product_type} achieve for {target_audience}, for example hydration, energy or soothing?",
+        "What's the main benefit you want your {product_type} to deliver?",
+        "What's the main result you're hoping this product will deliver?",
+    ],
+    "target_audience": [
+        "Who is this {product_type} for, and is there a particular skin type, age group or lifestyle in mind?",
+        "Who should benefit most from {achievement_goal}, for example a particular age group or skin type?",
+        "Who is the product meant for?",
+    ],
+    "special_ingredients": [
+        "Are there any ingredients you'd like your {product_type} to include or avoid for {target_audience}?",
+        "Are there any ingredients you'd like your {product_type} to include or avoid?",
+        "Are there any ingredients you'd like to include or avoid?",
+    ],
+}
+
+# Used in "template" mode when the missing information doesn't map onto a dimension
+GENERIC_QUESTION = "Is there anything else I should know about the product you have in mind?"
+
+COMPLETION_TEMPLATES: List[str] = [
+    "Perfect, I have everything I need to create your {product_type} for {target_audience}, so let's build your formulation!",
+    "Great, I now have everything I need to design your {product_type} focused on {achievement_goal}!",
+    "Wonderful, I have all I need and will now create your {product_type} formulation!",
+    "Perfect, I have everything I need and will now create your formulation!",
+]
+
+_FORMATTER = Formatter()
+
+
+def _fields(template: str) -> List[str]:
+    return [field for _, field, _, _ in _FORMATTER.parse(template) if field]
+
+
+def _as_phrase(value: Any) -> str:
+    if isinstance(value, list):
+        return ", ".join(str(item) for item in value if item)
+    if isinstance(value, dict):
+        return ", ".join(str(item) for item in value.values() if item)
+    return str(value or "").strip()
+
+
+def dimension_for(text: str) -> Optional[str]:
+    """The dimension a free-form key or note refers to, if any."""
+    lowered = str(text).lower().replace("_", " ")
+    for dimension, pattern in _DIMENSION_PATTERNS.items():
+        if pattern.search(lowered):
+            return dimension
+    return None
+
+
+class MessageTemplates:
+    """
+    Local phrase-bank generation for conversation questions and completion
+    messages, filled from what the user has already told us. Returns None
+    when no template fits so the caller can fall back to the LLM.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {
+            "question": {"local": 0, "llm": 0},
+            "completion": {"local": 0, "llm": 0},
+        }
+
+    def slots(self, gathered_info: Any) -> Dict[str, str]:
+        """Map gathered information onto dimension slots usable in templates."""
+        slots: Dict[str, str] = {}
+        if not isinstance(gathered_info, dict):
+            return slots
+        for key, value in gathered_info.items():
+            dimension = key if key in DIMENSIONS else dimension_for(key)
+            phrase = _as_phrase(value)
+            # Long answers read badly inside a one-sentence question
+            if dimension and phrase and dimension not in slots and len(phrase) <= 60:
+                slots[dimension] = phrase
+        return slots
+
+    def next_dimension(
+        self,
+        missing_info: List[str],
+        slots: Dict[str, str],
+        exclude: Optional[str] = None
+    ) -> Optional[str]:
+        """
+        The single dimension to ask about next, or None when the missing
+        information doesn't map cleanly onto the fixed dimensions.
+        """
+        if not isinstance(missing_info, list):
+            missing_info = [missing_info] if missing_info else []
+        mapped = [dimension_for(note) for note in missing_info]
+        if None in mapped:
+            # Something outside the four dimensions is missing; let the LLM phrase it
+            return None
+        for dimension in DIMENSIONS:
+            if dimension in mapped and dimension not in slots and dimension != exclude:
+                return dimension
+        return None
+
+    def question(self, dimension: str, slots: Dict[str, str], variant: int = 0) -> Optional[str]:
+        """Fill the most specific question template for a dimension."""
+        return self._fill(QUESTION_TEMPLATES.get(dimension, []), slots, variant)
+
+    def completion(self, slots: Dict[str, str], variant: int = 0) -> str:
+        # The last completion template has no fields, so this always succeeds
+        return self._fill(COMPLETION_TEMPLATES, slots, variant) or COMPLETION_TEMPLATES[-1]
+
+    def _fill(self, templates: List[str], slots: Dict[str, str], variant: int) -> Optional[str]:
+        usable = [t for t in templates if all(field in slots for field in _fields(t))]
+        if not usable:
+            return None
+        # Among the most specific usable templates, rotate so turns don't repeat verbatim
+        most_fields = max(len(_fields(t)) for t in usable)
+        best = [t for t in usable if len(_fields(t)) == most_fields]
+        return best[variant % len(best)].format(**slots)
+
+    def record(self, kind: str, local: bool):
+        with self._lock:
+            self._stats[kind]["local" if local else "llm"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats: Dict[str, Any] = {kind: dict(counts) for kind, counts in self._stats.items()}
+        local = sum(counts["local"] for counts in stats.values())
+        total = local + sum(counts["llm"] for counts in stats.values())
+        stats["local_share"] = round(local / total, 3) if total else 0.0
+        return stats
@@ -0,0 +1,147 @@
+from collections import OrderedDict
+from typing import Dict, Any, Awaitable, Callable, Optional, Tuple
+from app.core.config import settings
+from app.core.deadlines import DeadlineExceeded
+from app.core.request_context import (
+    RequestUsage, current_deadline, current_usage, llm_cancel, mark_fallback, remaining_budget,
+)
+import asyncio
+import contextvars
+import hashlib
+import re
+import time
+
+
+_TRAILING_PUNCTUATION = re.compile(r"[\s.!?,;:]+$")
+
+
+def query_fingerprint(query: str) -> str:
+    """Fingerprint of a query that ignores case, spacing, quotes and trailing punctuation."""
+    normalized = " ".join(query.lower().split()).strip("\"'")
+    normalized = _TRAILING_PUNCTUATION.sub("", normalized)
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+class QueryArtifactStore:
+    """
+    Derived artifacts of a query (intent analysis, enhanced query, ...) keyed
+    by query fingerprint, so the endpoints that see the same query share one
+    LLM call per artifact. Concurrent requests for an artifact that is still
+    being produced wait for that producer instead of starting their own.
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # (fingerprint, part) -> (value, expires_at)
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[Any, float]]" = OrderedDict()
+        self._inflight: Dict[Tuple[str, str], asyncio.Future] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def _count(self, part: str, stat: str):
+        stats = self._stats.setdefault(part, {"hits": 0, "misses": 0, "coalesced": 0, "stores": 0})
+        stats[stat] += 1
+
+    def peek(self, query: str, part: str) -> Optional[Any]:
+        """The stored artifact, if any, without producing it."""
+        key = (query_fingerprint(query), part)
+        entry = self._entries.get(key)
+        if entry is None or entry[1] <= time.time():
+            return None
+        return entry[0]
+
+    async def get_or_create(
+        self,
+        query: str,
+        part: str,
+        producer: Callable[[], Awaitable[Tuple[Any, bool]]],
+        retain: bool = True,
+        on_deadline: Optional[Callable[[], Any]] = None
+    ) -> Any:
+        """
+        Return the artifact for a query, producing it at most once at a time.
+        `producer` returns (value, cacheable); fallback values should not be
+        cacheable. With retain=False only in-flight calls are shared. A
+        fallback result marks every request that receives it as degraded.
+
+        The producer runs with its own budget and is charged to the caller that
+        started it (tenant, endpoint and LLM executor carry over). Each caller
+        waits only as long as its own deadline allows and then gets
+        `on_deadline()` (marked as a fallback) or DeadlineExceeded, while the
+        producer keeps going for the others.
+        """
+        key = (query_fingerprint(query), part)
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[1] > time.time():
+                self._entries.move_to_end(key)
+                self._count(part, "hits")
+                return entry[0]
+            del self._entries[key]
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self._count(part, "coalesced")
+        else:
+            self._count(part, "misses")
+            # The producer runs as its own task in a copy of the starting caller's context, and
+            # shielded so a cancelled caller doesn't cancel it for the others
+            inflight = contextvars.copy_context().run(asyncio.ensure_future, self._produce(key, producer, retain))
+            inflight.add_done_callback(lambda task: task.cancelled() or task.exception())
+            self._inflight[key] = inflight
+        remaining = remaining_budget()
+        try:
+            if remaining is None:
+                value, produced = await asyncio.shield(inflight)
+            else:
+                value, produced = await asyncio.wait_for(asyncio.shield(inflight), timeout=max(remaining, 0))
+        except asyncio.TimeoutError:
+            if on_deadline is None:
+                raise DeadlineExceeded(f"Not enough time left to wait for the query's {part}")
+            mark_fallback()
+            return on_deadline()
+        usage = current_usage.get()
+        if usage is not None:
+            usage.inherit(produced)
+        return value
+
+    async def _produce(self, key: Tuple[str, str], producer: Callable[[], Awaitable[Tuple[Any, bool]]],
+                       retain: bool) -> Tuple[Any, RequestUsage]:
+        # The producer's own usage tells whether the shared result is degraded, whoever started it.
+        # Its deadline is its own, and no single caller can abandon its LLM calls.
+        usage = RequestUsage()
+        current_usage.set(usage)
+        current_deadline.set(time.monotonic() + settings.query_artifact_budget_seconds)
+        llm_cancel.set(None)
+        try:
+            value, cacheable = await producer()
+        finally:
+            self._inflight.pop(key, None)
+        usage.fallback = usage.fallback or not cacheable
+        if retain and not usage.degraded:
+            self._store(key, value)
+        return value, usage
+
+    def put(self, query: str, part: str, value: Any):
+        """Store an artifact produced outside get_or_create."""
+        self._store((query_fingerprint(query), part), value)
+
+    def _store(self, key: Tuple[str, str], value: Any):
+        self._entries[key] = (value, time.time() + self.ttl)
+        self._entries.move_to_end(key)
+        self._count(key[1], "stores")
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "inflight": len(self._inflight),
+            "parts": {part: dict(stats) for part, stats in self._stats.items()},
+        }
+
+
+query_artifacts = QueryArtifactStore(
+    ttl=settings.query_artifact_ttl_seconds,
+    max_entries=settings.query_artifact_max_entries,
+)
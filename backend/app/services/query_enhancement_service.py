@@ -1,11 +1,52 @@
-from openai import OpenAI
-from typing import Dict, Any, List
-from app.core.config import settings
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+from app.models.analysis import IntentAnalysis
+from app.core.deadlines import DeadlineExceeded
+from app.core.request_context import llm_cancel, mark_fallback
+from app.services.llm_router import llm_router, StructuredOutputError
+from app.services.query_artifacts import query_artifacts
+import re
+import threading
 
 
 class QueryEnhancementService:
+    # Bump when the intent analysis or enhancement prompts change; stored warehouse results depend on them
+    PROMPT_VERSION = 1
+
+    # keyword tables for the local, LLM-free intent analysis used for live feedback
+    INTENT_KEYWORDS = {
+        "skincare": ["skin", "face", "facial", "serum", "moisturizer", "cleanser", "toner", "acne", "wrinkle"],
+        "hair care": ["hair", "shampoo", "conditioner", "scalp", "dandruff", "frizz"],
+        "body care": ["body", "lotion", "soap", "deodorant", "scrub", "bath"],
+        "makeup": ["makeup", "lipstick", "foundation", "mascara", "blush", "concealer"],
+        "supplements": ["supplement", "capsule", "vitamin", "gummy", "tablet"],
+    }
+    PRODUCT_TYPES = [
+        "lip balm", "face mask", "body wash", "cleanser", "moisturizer", "serum", "mask", "shampoo",
+        "conditioner", "lotion", "cream", "balm", "oil", "soap", "scrub", "toner", "sunscreen",
+        "deodorant", "gel", "butter", "mist", "spray",
+    ]
+    TARGET_AUDIENCES = [
+        "sensitive skin", "dry skin", "oily skin", "combination skin", "normal skin", "acne-prone",
+        "mature skin", "aging skin", "dry hair", "oily hair", "curly hair", "damaged hair", "fine hair",
+        "baby", "babies", "kids", "children", "teen", "men", "women", "pregnant",
+    ]
+    CONCERNS = [
+        "acne", "wrinkles", "fine lines", "dryness", "dandruff", "frizz", "redness", "dark spots",
+        "hyperpigmentation", "eczema", "itch", "breakage", "hair loss", "dullness", "oiliness", "sun damage",
+    ]
+    PREFERENCES = [
+        "organic", "vegan", "fragrance-free", "cruelty-free", "natural", "sulfate-free",
+        "paraben-free", "gluten-free", "unscented", "plant-based",
+    ]
+    PREFIX_CACHE_SIZE = 512
+
     def __init__(self):
-        self.client = OpenAI(api_key=settings.openai_api_key)
+        self.llm = llm_router
+        # shared with every other instance, so all endpoints reuse each other's analyses
+        self.artifacts = query_artifacts
+        # normalized query -> LLM intent analysis, used to answer prefixes of new queries
+        self._analysis_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
     
     async def enhance_query(self, user_query: str) -> Dict[str, Any]:
         """
@@ -17,7 +58,9 @@ class QueryEnhancementService:
             intent_analysis = await self._analyze_intent(user_query)
             
             # Enhance the query based on the analysis
-            enhanced_query = await self._create_enhanced_query(user_query, intent_analysis)
+            enhanced_query = await self.artifacts.get_or_create(
+                user_query, "enhanced_query", lambda: self._produce_enhanced_query(user_query, intent_analysis),
+                on_deadline=lambda: self._heuristic_enhanced_query(user_query, intent_analysis))
             
             return {
                 "original_query": user_query,
@@ -31,6 +74,12 @@ class QueryEnhancementService:
             raise Exception(f"Failed to enhance query: {str(e)}")
     
     async def _analyze_intent(self, query: str) -> Dict[str, Any]:
+        """Intent analysis for a query, shared across endpoints through the artifact store."""
+        return await self.artifacts.get_or_create(
+            query, "intent_analysis", lambda: self._produce_intent_analysis(query),
+            on_deadline=lambda: self._heuristic_intent_analysis(query))
+
+    async def _produce_intent_analysis(self, query: str) -> Tuple[Dict[str, Any], bool]:
         """Analyze user intent and extract key information from the query."""
         
         analysis_prompt = f"""
@@ -53,19 +102,30 @@ class QueryEnhancementService:
         Focus on natural, clean, and organic ingredients. Be specific about what information is missing.
         """
         
-        response = self.client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": analysis_prompt}],
-            temperature=0.3
-        )
-        
-        content = response.choices[0].message.content
         try:
-            import json
-            return json.loads(content)
-        except json.JSONDecodeError:
-            # Fallback analysis
-            return self._fallback_intent_analysis(query)
+            result = await self.llm.complete_json(
+                "analyze_intent",
+                [{"role": "user", "content": analysis_prompt}],
+                IntentAnalysis,
+                temperature=0.3
+            )
+        except StructuredOutputError:
+            # Fallback analysis, not kept as the query's artifact
+            return self._fallback_intent_analysis(query), False
+        except DeadlineExceeded:
+            # Not enough time left for the LLM: answer from keywords instead
+            return self._heuristic_intent_analysis(query), False
+        analysis = result.model_dump()
+        self._remember_analysis(query, analysis)
+        return analysis, True
+
+    async def _produce_enhanced_query(self, query: str, intent_analysis: Dict[str, Any]) -> Tuple[str, bool]:
+        try:
+            enhanced_query = await self._create_enhanced_query(query, intent_analysis)
+        except DeadlineExceeded:
+            return self._heuristic_enhanced_query(query, intent_analysis), False
+        # An enhancement built on the fallback analysis is redone once a real analysis exists
+        return enhanced_query, self.artifacts.peek(query, "intent_analysis") is not None
     
     async def _create_enhanced_query(self, original_query: str, intent_analysis: Dict[str, Any]) -> str:
         """Create an enhanced query based on the intent analysis."""
@@ -89,14 +149,27 @@ class QueryEnhancementService:
         Return only the enhanced query text, no JSON formatting.
         """
         
-        response = self.client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": enhancement_prompt}],
+        content = await self.llm.complete(
+            "enhance_query",
+            [{"role": "user", "content": enhancement_prompt}],
             temperature=0.4
         )
         
-        return response.choices[0].message.content.strip()
+        return content.strip()
     
+    def _heuristic_enhanced_query(self, query: str, intent_analysis: Dict[str, Any]) -> str:
+        """The query with the analyzed details appended, for when there is no time to rewrite it."""
+        details = []
+        for label, key in (("Product type", "product_type"), ("Target audience", "target_audience"),
+                           ("Concerns", "specific_concerns"), ("Preferences", "ingredient_preferences")):
+            value = intent_analysis.get(key)
+            if isinstance(value, list):
+                value = ", ".join(value)
+            if value:
+                details.append(f"{label}: {value}.")
+        details.append("Use natural, clean and safe ingredients with recommended concentrations.")
+        return " ".join([query.strip().rstrip(".") + "."] + details)
+
     def _fallback_intent_analysis(self, query: str) -> Dict[str, Any]:
         """Fallback analysis when JSON parsing fails."""
         return {
@@ -116,21 +189,16 @@ class QueryEnhancementService:
             intent_analysis = await self._analyze_intent(user_query)
             return intent_analysis.get("suggestions", [])
         except Exception as e:
+            mark_fallback()
             return ["Please provide more specific details about your formulation needs"]
     
     async def validate_query(self, user_query: str) -> Dict[str, Any]:
         """Validate if a query has sufficient information for formulation."""
         try:
             intent_analysis = await self._analyze_intent(user_query)
-            missing_context = intent_analysis.get("missing_context", [])
-            
-            return {
-                "is_sufficient": len(missing_context) == 0,
-                "missing_information": missing_context,
-                "confidence_score": self._calculate_confidence(intent_analysis),
-                "recommendations": intent_analysis.get("suggestions", [])
-            }
+            return self._validation_from_analysis(intent_analysis)
         except Exception as e:
+            mark_fallback()
             return {
                 "is_sufficient": False,
                 "missing_information": ["Unable to analyze query"],
@@ -138,6 +206,136 @@ class QueryEnhancementService:
                 "recommendations": ["Please provide more specific details"]
             }
     
+    async def analyze_query(self, user_query: str) -> Dict[str, Any]:
+        """Validation and suggestions for a query from a single intent analysis."""
+        intent_analysis = await self._analyze_intent(user_query)
+        return {
+            "validation": self._validation_from_analysis(intent_analysis),
+            "suggestions": intent_analysis.get("suggestions", [])
+        }
+
+    def stored_analysis(self, user_query: str) -> Optional[Dict[str, Any]]:
+        """analyze_query's answer from the query's stored intent analysis, if there is one."""
+        intent_analysis = self.artifacts.peek(user_query, "intent_analysis")
+        if intent_analysis is None:
+            return None
+        return {
+            "validation": self._validation_from_analysis(intent_analysis),
+            "suggestions": intent_analysis.get("suggestions", [])
+        }
+
+    async def analyze_query_live(self, user_query: str, stop: threading.Event) -> Dict[str, Any]:
+        """
+        analyze_query for live validation. The intent analysis runs outside the
+        shared artifact store, so setting `stop` ends its LLM call at the next
+        streamed chunk without affecting other requests for the same query.
+        """
+        token = llm_cancel.set(stop)
+        try:
+            intent_analysis, cacheable = await self._produce_intent_analysis(user_query)
+        finally:
+            llm_cancel.reset(token)
+        if cacheable:
+            self.artifacts.put(user_query, "intent_analysis", intent_analysis)
+        else:
+            mark_fallback()
+        return {
+            "validation": self._validation_from_analysis(intent_analysis),
+            "suggestions": intent_analysis.get("suggestions", [])
+        }
+
+    async def full_analysis(self, user_query: str) -> Dict[str, Any]:
+        """Validation, suggestions and the enhanced query in one pass over the shared artifacts."""
+        enhanced = await self.enhance_query(user_query)
+        intent_analysis = enhanced["intent_analysis"]
+        return {
+            "original_query": user_query,
+            "validation": self._validation_from_analysis(intent_analysis),
+            "suggestions": intent_analysis.get("suggestions", []),
+            "enhanced_query": enhanced["enhanced_query"],
+            "intent_analysis": intent_analysis
+        }
+
+    def quick_analysis(self, user_query: str) -> Dict[str, Any]:
+        """
+        Answer validation and suggestions without calling the LLM: from a cached
+        analysis of this query or the longest cached prefix of it, otherwise
+        from keyword heuristics.
+        """
+        source, intent_analysis = self._lookup_prefix(user_query)
+        if intent_analysis is None:
+            source, intent_analysis = "heuristic", self._heuristic_intent_analysis(user_query)
+        return {
+            "source": source,
+            "validation": self._validation_from_analysis(intent_analysis),
+            "suggestions": intent_analysis.get("suggestions", [])
+        }
+
+    def _validation_from_analysis(self, intent_analysis: Dict[str, Any]) -> Dict[str, Any]:
+        missing_context = intent_analysis.get("missing_context", [])
+        return {
+            "is_sufficient": len(missing_context) == 0,
+            "missing_information": missing_context,
+            "confidence_score": self._calculate_confidence(intent_analysis),
+            "recommendations": intent_analysis.get("suggestions", [])
+        }
+
+    def _normalize_query(self, query: str) -> str:
+        return " ".join(query.lower().split())
+
+    def _remember_analysis(self, query: str, analysis: Dict[str, Any]):
+        key = self._normalize_query(query)
+        self._analysis_cache[key] = analysis
+        self._analysis_cache.move_to_end(key)
+        while len(self._analysis_cache) > self.PREFIX_CACHE_SIZE:
+            self._analysis_cache.popitem(last=False)
+
+    def _lookup_prefix(self, query: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """Cached analysis for the query itself ("cache") or its longest cached prefix ("prefix_cache")."""
+        key = self._normalize_query(query)
+        if key in self._analysis_cache:
+            return "cache", self._analysis_cache[key]
+        for end in range(len(key) - 1, 0, -1):
+            analysis = self._analysis_cache.get(key[:end])
+            if analysis is not None:
+                return "prefix_cache", analysis
+        return "", None
+
+    def _heuristic_intent_analysis(self, query: str) -> Dict[str, Any]:
+        """Keyword-based intent analysis with the same shape as the LLM analysis."""
+        text = self._normalize_query(query)
+
+        def found(terms: List[str]) -> List[str]:
+            return [term for term in terms if re.search(rf"\b{re.escape(term)}s?\b", text)]
+
+        intent = next((name for name, words in self.INTENT_KEYWORDS.items() if found(words)), "")
+        product_types = found(self.PRODUCT_TYPES)
+        audiences = found(self.TARGET_AUDIENCES)
+        concerns = found(self.CONCERNS)
+        preferences = found(self.PREFERENCES)
+
+        missing_context, suggestions = [], []
+        if not product_types:
+            missing_context.append("product type")
+            suggestions.append("Specify product type")
+        if not audiences:
+            missing_context.append("specific skin or hair type")
+            suggestions.append("Add skin or hair type")
+        if not concerns:
+            missing_context.append("specific concerns")
+            suggestions.append("Mention specific concerns")
+
+        return {
+            "intent": intent,
+            "target_audience": ", ".join(audiences),
+            "product_type": product_types[0] if product_types else "",
+            "specific_concerns": concerns,
+            "ingredient_preferences": preferences,
+            "missing_context": missing_context,
+            "suggestions": suggestions,
+            "complexity_level": "basic"
+        }
+
     def _calculate_confidence(self, intent_analysis: Dict[str, Any]) -> float:
         """Calculate confidence score based on completeness of information."""
         required_fields = ["intent", "target_audience", "product_type"]
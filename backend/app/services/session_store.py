@@ -0,0 +1,187 @@
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+from app.core.config import settings
+import os
+import sys
+import threading
+import time
+import zlib
+
+
+# Gathered info is LLM output; these keep one session's share of it bounded
+MAX_INFO_KEYS = 16
+MAX_INFO_VALUE_CHARS = 500
+
+
+class SessionState:
+    """What the bot remembers about one conversation between turns."""
+
+    __slots__ = ("conversation_id", "gathered_info", "remaining_dims", "exchange_count",
+                 "last_asked_dimension", "last_seen")
+
+    def __init__(self, conversation_id: str):
+        self.conversation_id = conversation_id
+        self.gathered_info: Dict[str, str] = {}
+        self.remaining_dims: List[str] = []
+        self.exchange_count = 0
+        # Dimension the last templated question asked about, so a vague answer moves on from it
+        self.last_asked_dimension: Optional[str] = None
+        self.last_seen = time.monotonic()
+
+    def merge_info(self, info: Any):
+        """Add provided info from an analysis, truncated to the per-session limits."""
+        if not isinstance(info, dict):
+            return
+        for key, value in info.items():
+            if key not in self.gathered_info and len(self.gathered_info) >= MAX_INFO_KEYS:
+                break
+            if isinstance(value, str):
+                value = value[:MAX_INFO_VALUE_CHARS]
+            self.gathered_info[str(key)[:64]] = value
+
+    def approx_bytes(self) -> int:
+        size = sys.getsizeof(self) + sys.getsizeof(self.gathered_info) + sys.getsizeof(self.remaining_dims)
+        for key, value in self.gathered_info.items():
+            size += sys.getsizeof(key) + sys.getsizeof(value)
+        return size + sys.getsizeof(self.conversation_id)
+
+
+class _Shard:
+    __slots__ = ("lock", "sessions")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Least recently used first
+        self.sessions: "OrderedDict[str, SessionState]" = OrderedDict()
+
+
+def _rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _max_rss_bytes() -> Optional[int]:
+    try:
+        import resource  # Unix only
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class SessionStore:
+    """
+    Per-conversation state, sharded by a hash of the conversation ID so
+    concurrent turns of different conversations rarely share a lock. Each
+    shard keeps its sessions in LRU order and evicts the least recently used
+    beyond its share of `max_entries`, and sessions idle longer than
+    `idle_ttl` as the shard is touched.
+    """
+
+    def __init__(self, shards: int, max_entries: int, idle_ttl: float):
+        self.shards = [_Shard() for _ in range(max(shards, 1))]
+        self.per_shard = max(-(-max_entries // len(self.shards)), 1)
+        self.idle_ttl = idle_ttl
+        self._stats_lock = threading.Lock()
+        self._stats = {"created": 0, "evicted_size": 0, "evicted_idle": 0, "discarded": 0}
+
+    def _shard(self, conversation_id: str) -> _Shard:
+        return self.shards[zlib.crc32(conversation_id.encode("utf-8")) % len(self.shards)]
+
+    def _count(self, stat: str, amount: int = 1):
+        if amount:
+            with self._stats_lock:
+                self._stats[stat] += amount
+
+    def _evict_idle(self, shard: _Shard, now: float) -> int:
+        """Drop idle sessions from the LRU end of a shard; call with the shard locked."""
+        evicted = 0
+        while shard.sessions:
+            oldest = next(iter(shard.sessions.values()))
+            if now - oldest.last_seen <= self.idle_ttl:
+                break
+            shard.sessions.popitem(last=False)
+            evicted += 1
+        return evicted
+
+    def get(self, conversation_id: str) -> Optional[SessionState]:
+        shard = self._shard(conversation_id)
+        now = time.monotonic()
+        with shard.lock:
+            idle = self._evict_idle(shard, now)
+            state = shard.sessions.get(conversation_id)
+            if state is not None:
+                state.last_seen = now
+                shard.sessions.move_to_end(conversation_id)
+        self._count("evicted_idle", idle)
+        return state
+
+    def get_or_create(self, conversation_id: str) -> SessionState:
+        """The session's state, created empty if it is new or was evicted."""
+        shard = self._shard(conversation_id)
+        now = time.monotonic()
+        created = full = 0
+        with shard.lock:
+            idle = self._evict_idle(shard, now)
+            state = shard.sessions.get(conversation_id)
+            if state is None:
+                state = shard.sessions[conversation_id] = SessionState(conversation_id)
+                created = 1
+                while len(shard.sessions) > self.per_shard:
+                    shard.sessions.popitem(last=False)
+                    full += 1
+            else:
+                state.last_seen = now
+                shard.sessions.move_to_end(conversation_id)
+        self._count("evicted_idle", idle)
+        self._count("evicted_size", full)
+        self._count("created", created)
+        return state
+
+    def discard(self, conversation_id: str):
+        """Forget a session, e.g. when its socket closes."""
+        shard = self._shard(conversation_id)
+        with shard.lock:
+            removed = shard.sessions.pop(conversation_id, None)
+        self._count("discarded", int(removed is not None))
+
+    def sweep(self):
+        """Evict idle sessions from every shard."""
+        now = time.monotonic()
+        for shard in self.shards:
+            with shard.lock:
+                idle = self._evict_idle(shard, now)
+            self._count("evicted_idle", idle)
+
+    def stats(self) -> Dict[str, Any]:
+        """Session counts, estimated state size and process memory gauges."""
+        self.sweep()
+        sizes = []
+        state_bytes = 0
+        for shard in self.shards:
+            with shard.lock:
+                sizes.append(len(shard.sessions))
+                state_bytes += sum(state.approx_bytes() for state in shard.sessions.values())
+        with self._stats_lock:
+            stats = dict(self._stats)
+        return {
+            "sessions": sum(sizes),
+            "max_sessions": self.per_shard * len(self.shards),
+            "shards": len(self.shards),
+            "largest_shard": max(sizes),
+            "state_bytes": state_bytes,
+            **stats,
+            "rss_bytes": _rss_bytes(),
+            "max_rss_bytes": _max_rss_bytes(),
+        }
+
+
+session_store = SessionStore(
+    shards=settings.session_shards,
+    max_entries=settings.session_max_entries,
+    idle_ttl=settings.session_idle_ttl_seconds,
+)
@@ -0,0 +1,173 @@
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Dict, Any, List, Optional, Callable, Awaitable, Iterable, Set
+from app.core.deadlines import DeadlineExceeded
+from app.core.request_context import mark_fallback, remaining_budget
+import asyncio
+import hashlib
+import json
+import threading
+
+
+# Called with a stage's name whenever a stage finishes in the current context, e.g. to report progress
+stage_observer: ContextVar[Optional[Callable[[str], None]]] = ContextVar("stage_observer", default=None)
+
+
+class Stage:
+    """
+    One step of a stage graph. `func` is awaited with the stage's `inputs`
+    as keyword arguments and its result is stored under `name`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[..., Awaitable[Any]],
+        inputs: Iterable[str] = (),
+        timeout: Optional[float] = None,
+        fallback: Optional[Callable[[Dict[str, Any]], Any]] = None,
+        skip_if: Optional[Callable[[Dict[str, Any]], bool]] = None,
+        skip_value: Any = None,
+        memoize: bool = False
+    ):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.timeout = timeout
+        # Called with the stage inputs when the stage fails or times out; None re-raises
+        self.fallback = fallback
+        # Skip rule evaluated on the inputs; a skipped stage yields `skip_value`
+        self.skip_if = skip_if
+        self.skip_value = skip_value
+        # Reuse the last result for identical inputs instead of running again
+        self.memoize = memoize
+
+
+class StageGraph:
+    """
+    Small declarative executor: runs only the stages needed for the requested
+    outputs, starts each stage as soon as its inputs are available (so
+    independent stages run concurrently) and never re-runs a stage whose
+    output is already known or memoized for the same inputs.
+    """
+
+    MEMO_SIZE = 256
+
+    def __init__(self, stages: List[Stage]):
+        self.stages: Dict[str, Stage] = {stage.name: stage for stage in stages}
+        self._memo: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {
+            name: {"runs": 0, "skipped": 0, "memo_hits": 0, "timeouts": 0, "failures": 0, "degraded": 0}
+            for name in self.stages
+        }
+
+    def _required(self, values: Dict[str, Any], targets: Iterable[str]) -> Set[str]:
+        required: Set[str] = set()
+        pending = list(targets)
+        while pending:
+            name = pending.pop()
+            if name in values or name in required:
+                continue
+            if name not in self.stages:
+                raise KeyError(f"No stage or initial value named '{name}'")
+            required.add(name)
+            pending.extend(self.stages[name].inputs)
+        return required
+
+    async def run(self, values: Dict[str, Any], targets: Iterable[str]) -> Dict[str, Any]:
+        """Compute `targets` from `values`, returning values extended with every stage that ran."""
+        values = dict(values)
+        required = self._required(values, targets)
+        futures: Dict[str, asyncio.Future] = {}
+
+        async def execute(stage: Stage):
+            kwargs = {}
+            for name in stage.inputs:
+                kwargs[name] = values[name] if name in values else await futures[name]
+            result = await self._execute(stage, kwargs)
+            values[stage.name] = result
+            observer = stage_observer.get()
+            if observer is not None:
+                observer(stage.name)
+            return result
+
+        # Tasks await their inputs' futures, so creation order doesn't matter
+        for name in required:
+            futures[name] = asyncio.ensure_future(execute(self.stages[name]))
+        if futures:
+            try:
+                await asyncio.gather(*futures.values())
+            except BaseException:
+                for future in futures.values():
+                    future.cancel()
+                raise
+        return values
+
+    async def _execute(self, stage: Stage, kwargs: Dict[str, Any]) -> Any:
+        if stage.skip_if is not None and stage.skip_if(kwargs):
+            self._count(stage.name, "skipped")
+            return stage.skip_value
+
+        memo_key = self._memo_key(stage.name, kwargs) if stage.memoize else None
+        if memo_key is not None:
+            with self._lock:
+                if memo_key in self._memo:
+                    self._memo.move_to_end(memo_key)
+                    self._count(stage.name, "memo_hits", locked=True)
+                    return self._memo[memo_key]
+
+        self._count(stage.name, "runs")
+        timeout = stage.timeout
+        remaining = remaining_budget()
+        if remaining is not None:
+            # A stage never outlives the request's deadline
+            timeout = max(min(timeout or remaining, remaining), 0.001)
+        try:
+            if timeout:
+                result = await asyncio.wait_for(stage.func(**kwargs), timeout=timeout)
+            else:
+                result = await stage.func(**kwargs)
+        except DeadlineExceeded as e:
+            self._count(stage.name, "degraded")
+            print(f"[STAGE DEGRADED] {stage.name}: {e}")
+            if stage.fallback is None:
+                raise
+            mark_fallback()
+            return stage.fallback(kwargs)
+        except asyncio.TimeoutError:
+            self._count(stage.name, "timeouts")
+            print(f"[STAGE TIMEOUT] {stage.name} after {timeout:.2f}s")
+            if stage.fallback is None:
+                raise
+            mark_fallback()
+            return stage.fallback(kwargs)
+        except Exception as e:
+            self._count(stage.name, "failures")
+            print(f"[STAGE ERROR] {stage.name}: {e}")
+            if stage.fallback is None:
+                raise
+            mark_fallback()
+            return stage.fallback(kwargs)
+
+        if memo_key is not None:
+            with self._lock:
+                self._memo[memo_key] = result
+                while len(self._memo) > self.MEMO_SIZE:
+                    self._memo.popitem(last=False)
+        return result
+
+    def _memo_key(self, name: str, kwargs: Dict[str, Any]) -> str:
+        canonical = json.dumps(kwargs, sort_keys=True, default=str)
+        return f"{name}:{hashlib.sha256(canonical.encode('utf-8')).hexdigest()}"
+
+    def _count(self, name: str, stat: str, locked: bool = False):
+        if locked:
+            self._stats[name][stat] += 1
+            return
+        with self._lock:
+            self._stats[name][stat] += 1
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {name: dict(stats) for name, stats in self._stats.items()}
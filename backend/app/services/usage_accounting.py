@@ -0,0 +1,219 @@
+from contextvars import ContextVar
+from typing import Dict, Any, List, Optional, Tuple
+from app.core.config import settings
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+
+
+WINDOW_SECONDS = 60
+
+
+class _TenantWindow:
+    """Tokens used per second over the last minute, plus tokens reserved by admitted requests."""
+
+    __slots__ = ("buckets", "reserved")
+
+    def __init__(self):
+        self.buckets: List[List[int]] = [[0, 0] for _ in range(WINDOW_SECONDS)]  # [second, tokens]
+        self.reserved = 0
+
+    def add(self, now: int, tokens: int):
+        bucket = self.buckets[now % WINDOW_SECONDS]
+        if bucket[0] != now:
+            bucket[0], bucket[1] = now, 0
+        bucket[1] += tokens
+
+    def used(self, now: int) -> int:
+        return sum(tokens for second, tokens in self.buckets if now - second < WINDOW_SECONDS)
+
+    def oldest_second(self, now: int) -> Optional[int]:
+        seconds = [second for second, tokens in self.buckets if tokens and now - second < WINDOW_SECONDS]
+        return min(seconds) if seconds else None
+
+
+class Reservation:
+    """Tokens held against a tenant's quota for one admitted request, drawn down as its real usage is recorded."""
+
+    __slots__ = ("tenant", "tokens")
+
+    def __init__(self, tenant: str, tokens: int):
+        self.tenant = tenant
+        self.tokens = tokens
+
+
+# The reservation of the request being served; LLM usage recorded under it draws it down
+current_reservation: ContextVar[Optional[Reservation]] = ContextVar("current_reservation", default=None)
+
+
+class UsageAccountant:
+    """
+    Per-tenant token accounting. Calls are counted in memory (a sliding
+    one-minute window for quotas and aggregates for reporting) and the
+    aggregates are flushed to SQLite periodically.
+    """
+
+    def __init__(self, db_path: str, flush_interval: float):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._windows: Dict[str, _TenantWindow] = {}
+        # (tenant, minute, endpoint, call_site) -> [calls, prompt_tokens, completion_tokens]
+        self._pending: Dict[Tuple[str, int, str, str], List[int]] = {}
+        self._conn: Optional[sqlite3.Connection] = None
+        self._task: Optional[asyncio.Task] = None
+        self._rejected: Dict[str, int] = {}
+        self._queued: Dict[str, int] = {}
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS usage (
+                    tenant TEXT NOT NULL,
+                    minute INTEGER NOT NULL,
+                    endpoint TEXT NOT NULL,
+                    call_site TEXT NOT NULL,
+                    calls INTEGER NOT NULL,
+                    prompt_tokens INTEGER NOT NULL,
+                    completion_tokens INTEGER NOT NULL,
+                    PRIMARY KEY (tenant, minute, endpoint, call_site)
+                )
+            """)
+            self._conn.commit()
+        return self._conn
+
+    def _window(self, tenant: str) -> _TenantWindow:
+        window = self._windows.get(tenant)
+        if window is None:
+            window = self._windows[tenant] = _TenantWindow()
+        return window
+
+    def record(self, tenant: str, endpoint: str, call_site: str, prompt_tokens: int, completion_tokens: int,
+               reservation: Optional[Reservation] = None):
+        """
+        Account one LLM call to a tenant. The tokens are taken out of the
+        request's reservation, so in-flight usage isn't counted both as used
+        and as reserved.
+        """
+        now = time.time()
+        tokens = prompt_tokens + completion_tokens
+        with self._lock:
+            window = self._window(tenant)
+            window.add(int(now), tokens)
+            if reservation is not None and reservation.tenant == tenant and reservation.tokens:
+                drawn = min(reservation.tokens, tokens)
+                reservation.tokens -= drawn
+                window.reserved = max(window.reserved - drawn, 0)
+            totals = self._pending.setdefault((tenant, int(now // 60), endpoint, call_site), [0, 0, 0])
+            totals[0] += 1
+            totals[1] += prompt_tokens
+            totals[2] += completion_tokens
+
+    def try_reserve(self, reservation: Reservation, limit: int) -> Optional[float]:
+        """
+        Reserve tokens against the tenant's per-minute limit (0 means unlimited).
+        Returns None when admitted, otherwise the seconds until enough capacity
+        should free up.
+        """
+        now = int(time.time())
+        with self._lock:
+            window = self._window(reservation.tenant)
+            used = window.used(now) + window.reserved
+            # A request bigger than the whole quota is admitted when the tenant is idle
+            if limit <= 0 or used + reservation.tokens <= limit or used == 0:
+                window.reserved += reservation.tokens
+                return None
+            oldest = window.oldest_second(now)
+            return float(WINDOW_SECONDS - (now - oldest)) if oldest is not None else 1.0
+
+    def release(self, reservation: Reservation):
+        """Release what is left of a reservation once the request has finished."""
+        with self._lock:
+            window = self._window(reservation.tenant)
+            window.reserved = max(window.reserved - reservation.tokens, 0)
+            reservation.tokens = 0
+
+    def count_admission(self, tenant: str, outcome: str):
+        with self._lock:
+            counter = self._rejected if outcome == "rejected" else self._queued
+            counter[tenant] = counter.get(tenant, 0) + 1
+
+    def flush(self):
+        """Write pending aggregates to SQLite."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        with self._db_lock:
+            self._write(pending)
+
+    def _write(self, pending: Dict[Tuple[str, int, str, str], List[int]]):
+        conn = self._connect()
+        conn.executemany(
+            "INSERT INTO usage (tenant, minute, endpoint, call_site, calls, prompt_tokens, completion_tokens) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (tenant, minute, endpoint, call_site) DO UPDATE SET "
+            "calls = calls + excluded.calls, "
+            "prompt_tokens = prompt_tokens + excluded.prompt_tokens, "
+            "completion_tokens = completion_tokens + excluded.completion_tokens",
+            [(*key, *totals) for key, totals in pending.items()]
+        )
+        conn.commit()
+
+    async def start(self):
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await asyncio.to_thread(self.flush)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                print(f"[USAGE FLUSH ERROR]: {e}")
+
+    def summary(self, since_minutes: int = 60 * 24) -> Dict[str, Any]:
+        """Per-tenant usage over a period, plus live window and admission counters."""
+        self.flush()
+        since = int(time.time() // 60) - since_minutes
+        with self._db_lock:
+            rows = self._connect().execute(
+                "SELECT tenant, endpoint, SUM(calls), SUM(prompt_tokens), SUM(completion_tokens) "
+                "FROM usage WHERE minute >= ? GROUP BY tenant, endpoint", (since,)
+            ).fetchall()
+        now = int(time.time())
+        tenants: Dict[str, Any] = {}
+        for tenant, endpoint, calls, prompt_tokens, completion_tokens in rows:
+            entry = tenants.setdefault(tenant, {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "endpoints": {}})
+            entry["calls"] += calls
+            entry["prompt_tokens"] += prompt_tokens
+            entry["completion_tokens"] += completion_tokens
+            entry["endpoints"][endpoint] = {
+                "calls": calls, "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}
+        with self._lock:
+            for tenant, window in self._windows.items():
+                entry = tenants.setdefault(tenant, {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "endpoints": {}})
+                entry["tokens_last_minute"] = window.used(now)
+                entry["tokens_reserved"] = window.reserved
+                entry["rejected"] = self._rejected.get(tenant, 0)
+                entry["queued"] = self._queued.get(tenant, 0)
+        return {"since_minutes": since_minutes, "tenants": tenants}
+
+
+usage_accountant = UsageAccountant(
+    db_path=settings.usage_db_path,
+    flush_interval=settings.usage_flush_interval_seconds,
+)
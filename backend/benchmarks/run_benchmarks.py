@@ -0,0 +1,291 @@
+"""
+Performance regression suite. Drives the API in-process against the stub LLM
+backend with a fixed latency and reports, per endpoint: throughput, p50/p99
+latency, memory allocated per request (tracemalloc peak) and LLM calls per
+request. Results are compared with benchmarks/baseline.json and the run exits
+with 1 when any metric regresses beyond the baseline's tolerances.
+
+Throughput and latency depend on the machine, so each run first times a fixed
+pure-Python workload (the calibration unit). The stub LLM latency is set in
+those units, and throughput and latency are compared in them, so a baseline
+recorded on one machine holds on a faster or slower one.
+
+    python benchmarks/run_benchmarks.py                   # compare with the baseline
+    python benchmarks/run_benchmarks.py --update-baseline # record a new baseline
+    python benchmarks/run_benchmarks.py --only formulation_validate --requests 50
+"""
+from typing import Dict, Any, List, Callable, Optional
+import argparse
+import asyncio
+import json
+import math
+import os
+import re
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(BACKEND_DIR, "benchmarks", "baseline.json")
+
+DEFAULT_TOLERANCE = {
+    # Relative slack before a change counts as a regression
+    "throughput_cu": 0.25,
+    "p50_cu": 0.25,
+    "p99_cu": 0.5,
+    "alloc_kib": 0.25,
+    # LLM calls per request are deterministic on the stub backend: any increase fails
+    "llm_calls": 0.0,
+}
+# Latency differences below this many milliseconds are noise, whatever the ratio
+LATENCY_SLACK_MS = 5.0
+# Depend on the machine, so they are printed but not kept in the baseline
+ABSOLUTE_METRICS = ("throughput_rps", "p50_ms", "p99_ms")
+
+PRODUCTS = ["shampoo", "face serum", "baby lotion", "lip balm", "body wash", "hand cream", "sunscreen", "toner"]
+AUDIENCES = ["dry hair", "oily skin", "sensitive skin", "toddlers", "athletes", "mature skin"]
+
+
+CALIBRATION_PAYLOAD = {"ingredients": [{"name": f"ingredient {i}", "percentage": round(i / 7, 3), "function": "emollient"}
+                                       for i in range(100)]}
+_WORD = re.compile(r"[a-z]+")
+
+
+def calibrate(rounds: int = 7) -> float:
+    """Milliseconds one calibration unit takes here: the best of a few runs of a fixed JSON, regex and dict workload."""
+    best = math.inf
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for _ in range(80):
+            text = json.dumps(CALIBRATION_PAYLOAD)
+            data = json.loads(text)
+            sorted(_WORD.findall(text))
+            {item["name"]: item for item in data["ingredients"]}
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def configure_environment(latency_ms: float):
+    """Point the app at the stub LLM and keep caches, quotas and the warehouse out of the measurements."""
+    data_dir = tempfile.mkdtemp(prefix="bench-")
+    os.environ.pop("OPENAI_API_KEY", None)
+    os.environ.update({
+        "LLM_BACKEND": "stub",
+        "LLM_TIERS": json.dumps({tier: {"model": "stub", "options": {"latency_ms": latency_ms}}
+                                 for tier in ("classify", "standard", "generate")}),
+        "RESPONSE_CACHE_ENABLED": "false",
+        "WAREHOUSE_ENABLED": "false",
+        "MAX_INFLIGHT_REQUESTS": "0",
+        "ANONYMOUS_TOKENS_PER_MINUTE": "0",
+        "JOB_DB_PATH": os.path.join(data_dir, "jobs.sqlite3"),
+        "USAGE_DB_PATH": os.path.join(data_dir, "usage.sqlite3"),
+        "WAREHOUSE_DB_PATH": os.path.join(data_dir, "warehouse.sqlite3"),
+    })
+    sys.path.insert(0, BACKEND_DIR)
+
+
+def query(i: int) -> str:
+    # Distinct queries, so per-query artifacts don't turn the run into cache hits
+    return f"natural {PRODUCTS[i % len(PRODUCTS)]} for {AUDIENCES[i % len(AUDIENCES)]} #{i}"
+
+
+class Scenario:
+    def __init__(self, name: str, path: str, body: Callable[[int], Dict[str, Any]],
+                 setup: Optional[Callable] = None):
+        self.name = name
+        self.path = path
+        self.body = body
+        # Awaited once with the client before the run, e.g. to create a conversation to continue
+        self.setup = setup
+
+
+def scenarios() -> List[Scenario]:
+    history: List[Dict[str, str]] = []
+
+    async def start_conversation(client):
+        response = await client.post("/conversation/start", json={"initial_query": "I want a shampoo"})
+        history[:] = response.json()["conversation_history"]
+
+    return [
+        Scenario("formulation", "/formulation/", lambda i: {"query": query(i)}),
+        Scenario("formulation_validate", "/formulation/validate", lambda i: {"query": query(i)}),
+        Scenario("formulation_analyze", "/formulation/analyze", lambda i: {"query": query(i)}),
+        Scenario("conversation_start", "/conversation/start", lambda i: {"initial_query": query(i)}),
+        Scenario("conversation_continue", "/conversation/continue",
+                 lambda i: {"conversation_id": f"bench-{i}", "user_response": f"for {AUDIENCES[i % len(AUDIENCES)]}",
+                            "conversation_history": list(history), "include_current_query": False},
+                 setup=start_conversation),
+        Scenario("conversation_aggregate_intent", "/conversation/aggregate-intent",
+                 lambda i: {"conversation_history": history + [{"role": "user", "content": query(i)}]},
+                 setup=start_conversation),
+        Scenario("conversation_summary", "/conversation/summary",
+                 lambda i: {"conversation_history": history + [{"role": "user", "content": query(i)}]},
+                 setup=start_conversation),
+    ]
+
+
+def llm_calls() -> int:
+    from app.services.llm_router import llm_router
+    return sum(site["calls"] for site in llm_router.metrics()["call_sites"].values())
+
+
+def percentile(values: List[float], share: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(share * len(ordered)), len(ordered) - 1)]
+
+
+async def run_scenario(client, scenario: Scenario, requests: int, concurrency: int, alloc_samples: int,
+                       offset: int, unit_ms: float) -> Dict[str, Any]:
+    if scenario.setup is not None:
+        await scenario.setup(client)
+    errors = 0
+
+    async def call(i: int) -> float:
+        nonlocal errors
+        started = time.perf_counter()
+        response = await client.post(scenario.path, json=scenario.body(offset + i))
+        if response.status_code >= 400:
+            errors += 1
+        return time.perf_counter() - started
+
+    for i in range(min(5, requests)):
+        await call(-1 - i)
+
+    # Throughput and latency under concurrency
+    latencies: List[float] = []
+    queue = iter(range(requests))
+    calls_before = llm_calls()
+
+    async def worker():
+        for i in queue:
+            latencies.append(await call(i))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    calls = llm_calls() - calls_before
+
+    # Allocations, one request at a time so each peak belongs to a single request
+    peaks: List[float] = []
+    tracemalloc.start()
+    try:
+        for i in range(alloc_samples):
+            tracemalloc.reset_peak()
+            current, _ = tracemalloc.get_traced_memory()
+            await call(requests + i)
+            peaks.append((tracemalloc.get_traced_memory()[1] - current) / 1024)
+    finally:
+        tracemalloc.stop()
+
+    throughput = requests / elapsed
+    p50, p99 = percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000
+    return {
+        "requests": requests,
+        "errors": errors,
+        # Requests per calibration unit and latency in calibration units; the _rps/_ms values are for reading only
+        "throughput_cu": round(throughput * unit_ms / 1000, 4),
+        "p50_cu": round(p50 / unit_ms, 2),
+        "p99_cu": round(p99 / unit_ms, 2),
+        "throughput_rps": round(throughput, 2),
+        "p50_ms": round(p50, 2),
+        "p99_ms": round(p99, 2),
+        "alloc_kib": round(statistics.median(peaks), 1) if peaks else 0.0,
+        "llm_calls": round(calls / requests, 3),
+    }
+
+
+async def run(selected: List[Scenario], requests: int, concurrency: int, alloc_samples: int,
+              unit_ms: float) -> Dict[str, Any]:
+    import httpx
+    from main import app
+
+    await app.router.startup()
+    results: Dict[str, Any] = {}
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=300) as client:
+            for index, scenario in enumerate(selected):
+                results[scenario.name] = await run_scenario(
+                    client, scenario, requests, concurrency, alloc_samples, offset=index * 100000, unit_ms=unit_ms)
+                print(f"{scenario.name:<32} {json.dumps(results[scenario.name])}", flush=True)
+    finally:
+        await app.router.shutdown()
+    return results
+
+
+def regressions(results: Dict[str, Any], baseline: Dict[str, Any], unit_ms: float) -> List[str]:
+    """Human-readable descriptions of every metric that regressed against the baseline."""
+    tolerance = {**DEFAULT_TOLERANCE, **baseline.get("tolerance", {})}
+    found = []
+    for name, metrics in results.items():
+        if metrics["errors"]:
+            found.append(f"{name}: {metrics['errors']} failed requests")
+        base = baseline.get("endpoints", {}).get(name)
+        if base is None:
+            print(f"{name}: no baseline, skipped")
+            continue
+        if metrics["throughput_cu"] < base["throughput_cu"] * (1 - tolerance["throughput_cu"]):
+            found.append(f"{name}: throughput {metrics['throughput_cu']} per unit < baseline {base['throughput_cu']}")
+        for key in ("p50_cu", "p99_cu"):
+            limit = max(base[key] * (1 + tolerance[key]), base[key] + LATENCY_SLACK_MS / unit_ms)
+            if metrics[key] > limit:
+                found.append(f"{name}: {key} {metrics[key]} units > baseline {base[key]}")
+        if metrics["alloc_kib"] > base["alloc_kib"] * (1 + tolerance["alloc_kib"]):
+            found.append(f"{name}: alloc_kib {metrics['alloc_kib']} > baseline {base['alloc_kib']}")
+        if metrics["llm_calls"] > base["llm_calls"] * (1 + tolerance["llm_calls"]) + 0.01:
+            found.append(f"{name}: llm_calls {metrics['llm_calls']} per request > baseline {base['llm_calls']}")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=100, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--alloc-samples", type=int, default=20, help="sequential requests traced for allocations")
+    parser.add_argument("--latency-units", type=float, default=2.0,
+                        help="stub LLM latency per call, in calibration units")
+    parser.add_argument("--only", action="append", help="run only this scenario (repeatable)")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    unit_ms = calibrate()
+    print(f"Calibration unit: {unit_ms:.2f} ms, stub LLM latency: {args.latency_units * unit_ms:.1f} ms")
+    configure_environment(args.latency_units * unit_ms)
+    selected = [s for s in scenarios() if not args.only or s.name in args.only]
+    results = asyncio.run(run(selected, args.requests, args.concurrency, args.alloc_samples, unit_ms))
+    config = {"requests": args.requests, "concurrency": args.concurrency, "latency_units": args.latency_units}
+
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update({"config": config, "tolerance": baseline.get("tolerance", DEFAULT_TOLERANCE),
+                         "calibration_ms": round(unit_ms, 3)})
+        baseline["endpoints"] = {**baseline.get("endpoints", {}), **{
+            name: {key: value for key, value in metrics.items() if key not in ABSOLUTE_METRICS}
+            for name, metrics in results.items()}}
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2)
+            f.write("\n")
+        print(f"Baseline written to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --update-baseline first")
+        sys.exit(1)
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("config") != config:
+        print(f"Warning: baseline was recorded with {baseline.get('config')}, this run used {config}")
+    found = regressions(results, baseline, unit_ms)
+    for line in found:
+        print(f"REGRESSION {line}")
+    sys.exit(1 if found else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,35 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.routes.formulation import router as formulation_router
+from app.routes.formulation import router as formulation_router, formulation_service
 from app.routes.conversation import router as conversation_router
+from app.routes.metrics import router as metrics_router
+from app.routes.admin import router as admin_router
 from app.core.config import settings
+from app.core.admission import AdmissionControlMiddleware
+from app.core.deadlines import DeadlineMiddleware, load_shedder
+from app.core.profiler import profiler
+from app.core.request_context import RequestContextMiddleware
+from app.core.response_cache import ResponseCacheMiddleware, response_cache
+from app.services.formulation_warehouse import formulation_warehouse
+from app.services.job_queue import job_queue
+from app.services.usage_accounting import usage_accountant
+import asyncio
 import os
 
 app = FastAPI(title="Formulation Engine API", version="1.0.0")
 
+# Routes whose responses are cached; only low-temperature results are kept
+response_cache.cache_route("/formulation/validate", ttl=600, max_temperature=0.3)
+response_cache.cache_route("/formulation/suggestions", ttl=600, max_temperature=0.3)
+response_cache.cache_route("/conversation/summary", ttl=300, max_temperature=0.3)
+
+# Middleware added last runs first: CORS, request context, deadlines and load shedding,
+# admission control, response cache
+app.add_middleware(ResponseCacheMiddleware, cache=response_cache)
+app.add_middleware(AdmissionControlMiddleware)
+app.add_middleware(DeadlineMiddleware, shedder=load_shedder)
+app.add_middleware(RequestContextMiddleware)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -19,6 +42,27 @@ app.add_middleware(
 # Include the routers
 app.include_router(formulation_router, prefix="/formulation", tags=["formulation"])
 app.include_router(conversation_router, prefix="/conversation", tags=["conversation"])
+app.include_router(metrics_router, prefix="/metrics", tags=["metrics"])
+app.include_router(admin_router, prefix="/admin", tags=["admin"])
+
+
+@app.on_event("startup")
+async def start_background_workers():
+    if settings.profiling_enabled:
+        profiler.start()
+    await usage_accountant.start()
+    await job_queue.start()
+    formulation_service.register_warehouse()
+    await formulation_warehouse.start()
+
+
+@app.on_event("shutdown")
+async def stop_background_workers():
+    await formulation_warehouse.stop()
+    await job_queue.stop()
+    await usage_accountant.stop()
+    # Joins the sampler thread, which can take up to one sampling interval
+    await asyncio.to_thread(profiler.stop)
 
 
 @app.get("/")
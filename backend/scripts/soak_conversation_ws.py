@@ -0,0 +1,208 @@
+"""
+Soak test for the multiplexed conversation socket (/conversation/ws).
+
+Opens thousands of concurrent sockets, each running a full conversation
+(start, a few answers pipelined behind it, then the aggregate intent), and
+reports latency percentiles, throughput and errors. By default it starts its
+own server on the stub LLM backend, so no network or API key is needed:
+
+    python scripts/soak_conversation_ws.py --sockets 2000
+
+Use --url to soak an already running server instead. Exits with 1 when the
+error rate exceeds --max-error-rate.
+"""
+from typing import Dict, Any, List, Optional
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import websockets
+
+
+QUERIES = [
+    "I want to make a shampoo",
+    "a gentle baby lotion",
+    "something for acne",
+    "vegan lip balm",
+    "a face serum",
+]
+ANSWERS = [
+    "for dry, frizzy hair",
+    "for adults with sensitive skin",
+    "I'd like argan oil and aloe vera",
+    "moisturizing and soothing",
+    "not sure, anything natural",
+    "for teenagers",
+]
+
+
+def percentile(values: List[float], share: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(share * len(ordered)), len(ordered) - 1)]
+
+
+class SoakStats:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.conversations = 0
+        self.frames_in = 0
+        self.speculative_intents = 0
+
+    def observe(self, kind: str, seconds: float):
+        self.latencies.setdefault(kind, []).append(seconds)
+
+    def error(self, kind: str):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+
+async def run_conversation(url: str, turns: int, stats: SoakStats, rng: random.Random):
+    """One socket: start, pipelined answers until the conversation completes, then the intent."""
+    try:
+        async with websockets.connect(url, max_queue=None, open_timeout=60) as ws:
+            sent_at: Dict[Any, float] = {}
+
+            async def request(kind: str, id: Any, data: Optional[Dict[str, Any]] = None):
+                sent_at[id] = time.monotonic()
+                await ws.send(json.dumps({"t": kind, "id": id, "d": data or {}}, separators=(",", ":")))
+
+            await request("start", "s", {"q": rng.choice(QUERIES)})
+            for turn in range(turns):
+                await request("say", f"a{turn}", {"r": rng.choice(ANSWERS)})
+
+            pending = {"s", *(f"a{turn}" for turn in range(turns))}
+            asked_intent = False
+            while pending:
+                frame = json.loads(await asyncio.wait_for(ws.recv(), timeout=120))
+                stats.frames_in += 1
+                kind, id = frame["t"], frame.get("id")
+                if kind == "prog":
+                    continue
+                if kind == "intent" and id is None:
+                    stats.speculative_intents += 1
+                    continue
+                if id in sent_at:
+                    stats.observe(kind, time.monotonic() - sent_at.pop(id))
+                pending.discard(id)
+                if kind == "err":
+                    stats.error("err_frame")
+                    continue
+                if kind == "turn" and frame["d"].get("ready_for_formulation") and not asked_intent:
+                    asked_intent = True
+                    await request("intent", "i")
+                    pending.add("i")
+            stats.conversations += 1
+    except Exception as e:
+        stats.error(type(e).__name__)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port: int, stub_latency_ms: float) -> subprocess.Popen:
+    """Run the API on the stub LLM backend with quotas and shedding out of the way."""
+    data_dir = tempfile.mkdtemp(prefix="soak-")
+    env = {
+        **os.environ,
+        "LLM_BACKEND": "stub",
+        "LLM_TIERS": json.dumps({tier: {"model": "stub", "options": {"latency_ms": stub_latency_ms}}
+                                 for tier in ("classify", "standard", "generate")}),
+        # Unlimited (the default), so the soak measures the socket rather than the quota
+        "ANONYMOUS_TOKENS_PER_MINUTE": "0",
+        "MAX_INFLIGHT_REQUESTS": "0",
+        "JOB_DB_PATH": os.path.join(data_dir, "jobs.sqlite3"),
+        "USAGE_DB_PATH": os.path.join(data_dir, "usage.sqlite3"),
+        "WAREHOUSE_DB_PATH": os.path.join(data_dir, "warehouse.sqlite3"),
+    }
+    env.pop("OPENAI_API_KEY", None)
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning", "--backlog", "4096"],
+        cwd=backend_dir, env=env
+    )
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1)
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("Server did not start")
+
+
+async def soak(url: str, sockets: int, turns: int, ramp: float, seed: int) -> SoakStats:
+    stats = SoakStats()
+    rng = random.Random(seed)
+    tasks = []
+    for _ in range(sockets):
+        tasks.append(asyncio.create_task(run_conversation(url, turns, stats, rng)))
+        if ramp:
+            await asyncio.sleep(ramp / sockets)
+    await asyncio.gather(*tasks)
+    return stats
+
+
+def report(stats: SoakStats, sockets: int, elapsed: float, metrics: Optional[Dict[str, Any]]) -> float:
+    failed = sum(stats.errors.values())
+    print(f"sockets: {sockets}  completed: {stats.conversations}  failed: {failed}  "
+          f"elapsed: {elapsed:.1f}s  conversations/s: {stats.conversations / elapsed:.1f}")
+    print(f"frames received: {stats.frames_in}  speculative intents: {stats.speculative_intents}")
+    for kind, values in sorted(stats.latencies.items()):
+        print(f"  {kind:<8} n={len(values):<6} p50={percentile(values, 0.5) * 1000:8.1f}ms  "
+              f"p99={percentile(values, 0.99) * 1000:8.1f}ms")
+    if stats.errors:
+        print(f"errors: {stats.errors}")
+    if metrics is not None:
+        print(f"server: {json.dumps(metrics)}")
+    return failed / sockets if sockets else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="ws:// URL of a running server's /conversation/ws (default: start one)")
+    parser.add_argument("--sockets", type=int, default=2000)
+    parser.add_argument("--turns", type=int, default=3, help="answers sent per conversation")
+    parser.add_argument("--ramp", type=float, default=5.0, help="seconds over which sockets are opened")
+    parser.add_argument("--stub-latency-ms", type=float, default=0.0)
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if url is None:
+        port = free_port()
+        server = start_server(port, args.stub_latency_ms)
+        url = f"ws://127.0.0.1:{port}/conversation/ws"
+    try:
+        started = time.monotonic()
+        stats = asyncio.run(soak(url, args.sockets, args.turns, args.ramp, args.seed))
+        elapsed = time.monotonic() - started
+        metrics = None
+        if server is not None:
+            with urllib.request.urlopen(url.replace("ws://", "http://").replace("/conversation/ws", "/metrics/channels")) as response:
+                metrics = json.loads(response.read())
+        error_rate = report(stats, args.sockets, elapsed, metrics)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+    sys.exit(1 if error_rate > args.max_error_rate else 0)
+
+
+if __name__ == "__main__":
+    main()